@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# Нагрузочный тест /bing* эндпоинтов.
+# Обычно запускается против инстанса у которого BING_BASE_URL указывает на mock_bing.py:
+#
+#   python mock_bing.py --port 58800 &
+#   python bench.py --api http://127.0.0.1:58796 --mock http://127.0.0.1:58800 \
+#       --endpoint /bing --concurrency 4 --requests 40 --out bench.json
+#
+# Результат пишется в JSON, с --compare старый.json показывает разницу и
+# завершается с кодом 1 если пропускная способность или p95 стали хуже чем на --threshold.
+#
+# Офлайн режим по записанным кассетам (см. cassette.py), без api и без сети:
+#
+#   python bench.py --cassettes cassettes --repeats 200 --out parser.json
+#
+# меряет разбор страниц результатов и полный BingBrush.process на воспроизведении,
+# и проверяет что из записанных страниц все еще достаются картинки (формат бинга не уехал).
+
+
+import argparse
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+
+from utils import percentile
+
+
+def get_mock_stats(mock_url: Optional[str]) -> Dict[str, int]:
+    if not mock_url:
+        return {}
+    try:
+        return requests.get(f'{mock_url}/__stats', timeout=5).json()
+    except (requests.exceptions.RequestException, ValueError):
+        return {}
+
+
+def run_benchmark(api_url: str, endpoint: str, concurrency: int, total: int,
+                  prompt: str, mock_url: Optional[str] = None, timeout: int = 3600) -> Dict[str, Any]:
+    """Гоняет total запросов в concurrency потоков и собирает метрики."""
+    local = threading.local()
+    results: List[Dict[str, Any]] = []
+    results_lock = threading.Lock()
+
+    def one(index: int) -> None:
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        start = time.time()
+        try:
+            response = local.session.post(f'{api_url}{endpoint}', json={"prompt": f'{prompt} #{index}'},
+                                          timeout=timeout)
+            code = response.status_code
+            try:
+                images = len(response.json().get('urls', []))
+            except ValueError:
+                images = 0
+        except requests.exceptions.RequestException:
+            code, images = 0, 0
+        with results_lock:
+            results.append({"code": code, "latency": time.time() - start, "images": images})
+
+    stats_before = get_mock_stats(mock_url)
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    duration = time.time() - start
+    stats_after = get_mock_stats(mock_url)
+
+    ok = [x for x in results if x['code'] == 200]
+    latencies = [x['latency'] for x in results]
+    ok_latencies = [x['latency'] for x in ok]
+    codes: Dict[str, int] = {}
+    for x in results:
+        codes[str(x['code'])] = codes.get(str(x['code']), 0) + 1
+
+    report: Dict[str, Any] = {
+        "time": time.strftime('%Y-%m-%d %H:%M:%S'),
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "requests": total,
+        "ok": len(ok),
+        "codes": codes,
+        "duration": round(duration, 2),
+        "throughput": round(len(ok) / duration, 4) if duration else 0,
+        "images_per_request": round(sum(x['images'] for x in ok) / len(ok), 2) if ok else 0,
+        "latency": {
+            "p50": round(percentile(latencies, 50), 3),
+            "p95": round(percentile(latencies, 95), 3),
+            "p99": round(percentile(latencies, 99), 3),
+        },
+        "ok_latency": {
+            "p50": round(percentile(ok_latencies, 50), 3),
+            "p95": round(percentile(ok_latencies, 95), 3),
+            "p99": round(percentile(ok_latencies, 99), 3),
+        },
+    }
+
+    if stats_before and stats_after:
+        upstream = {k: stats_after.get(k, 0) - stats_before.get(k, 0) for k in stats_after}
+        report["upstream"] = upstream
+        jobs = upstream.get('jobs', 0)
+        report["requests_per_job"] = round(upstream.get('requests', 0) / jobs, 2) if jobs else 0
+
+    return report
+
+
+def is_image_link(url: str) -> bool:
+    return url.startswith('http') and ('bing.net/th/id/' in url or 'bing.com/th/id/' in url)
+
+
+def legacy_poll_parse(text: str, pending_marker: str) -> Optional[List[str]]:
+    """Разбор страницы опроса как до потокового парсера (весь текст, findall, set) - для сравнения."""
+    import regex
+
+    if not text or pending_marker in text:
+        return None
+    image_links = regex.findall(r'src="([^"]+)"', text)
+    return list(set(link.split("?w=")[0] for link in image_links))
+
+
+def stream_poll_parse(data: bytes, pending_marker: str, chunk_size: int) -> Tuple[Optional[List[str]], int]:
+    """Разбор страницы опроса потоковым парсером, возвращает (ссылки или None, сколько байт прочитано)."""
+    import bing_genimg_v3
+
+    parser = bing_genimg_v3.ResultPageParser(pending_marker)
+    read = 0
+    for i in range(0, len(data), chunk_size):
+        chunk = data[i:i + chunk_size]
+        read += len(chunk)
+        if parser.feed(chunk):
+            break
+    if parser.pending or not parser.size:
+        return None, read
+    return parser.links(), read
+
+
+def run_cassettes(cassette_dir: str, repeats: int = 100, speed: float = 0.0) -> Dict[str, Any]:
+    """
+    Офлайн бенчмарк по кассетам: разбор страницы результатов и полный цикл BingBrush.process.
+    Страницы на которых разбор не нашел картинок попадают в drift.
+    """
+    # импортируем тут, онлайн режиму не нужен cfg
+    import bing_genimg_v3
+    import cassette
+    import job_journal
+
+    # не пишем офлайн прогоны в настоящий журнал заданий
+    job_journal.DB_PATH = ':memory:'
+    bing_genimg_v3.POLL_INTERVAL = bing_genimg_v3.POLL_INTERVAL * speed
+
+    parse_times: List[float] = []
+    page_bytes: List[int] = []
+    legacy_poll_times: List[float] = []
+    stream_poll_times: List[float] = []
+    poll_bytes_total = 0
+    poll_bytes_read = 0
+    e2e_times: List[float] = []
+    e2e_requests: List[int] = []
+    drift: List[str] = []
+
+    paths = sorted(glob.glob(os.path.join(cassette_dir, '*.json')))
+    for path in paths:
+        interactions = cassette.load(path)
+        submit = next((x for x in interactions if x['method'] == 'POST'), None)
+        pages = [x for x in interactions if '/async/results/' in x['url'] and x['status'] == 200 and x['body']]
+        if submit is None or not pages:
+            continue
+        final_page = pages[-1]['body']
+        query = parse_qs(urlsplit(submit['url']).query)
+        pending_marker = 'strm' if query.get('mdl', ['0'])[0] == '1' else 'errorMessage'
+
+        # каждый опрос: старый разбор всего текста против потокового с ранним выходом
+        for page in pages:
+            data = page['body'].encode('utf-8')
+            start = time.perf_counter()
+            for _ in range(repeats):
+                legacy_poll_parse(data.decode('utf-8'), pending_marker)
+            legacy_poll_times.append((time.perf_counter() - start) / repeats)
+            start = time.perf_counter()
+            for _ in range(repeats):
+                _, read = stream_poll_parse(data, pending_marker, bing_genimg_v3.RESULT_CHUNK_SIZE)
+            stream_poll_times.append((time.perf_counter() - start) / repeats)
+            poll_bytes_total += len(data)
+            poll_bytes_read += read
+
+        start = time.perf_counter()
+        for _ in range(repeats):
+            links = bing_genimg_v3.parse_image_links(final_page)
+        parse_times.append((time.perf_counter() - start) / repeats)
+        page_bytes.append(len(final_page.encode('utf-8')))
+        expected = sorted(x for x in links if is_image_link(x))
+        if not expected:
+            drift.append(f'{os.path.basename(path)}: no image links parsed from results page')
+            continue
+
+        prompt = query.get('q', [''])[0]
+        model = 'gpt4o' if query.get('mdl', ['0'])[0] == '1' else 'dalle'
+        ar = query.get('ar', [None])[0]
+        adapter = cassette.ReplayAdapter(path, speed=speed)
+        brush = bing_genimg_v3.BingBrush(cookie='replay=1', adapter=adapter)
+        start = time.perf_counter()
+        result = brush.process(prompt, model=model, ar=ar)
+        e2e_times.append(time.perf_counter() - start)
+        e2e_requests.append(adapter.requests_count)
+        if sorted(result) != expected:
+            drift.append(f'{os.path.basename(path)}: replay returned {len(result)} images, expected {len(expected)}')
+
+    return {
+        "time": time.strftime('%Y-%m-%d %H:%M:%S'),
+        "mode": "cassettes",
+        "cassettes": len(paths),
+        "pages": len(parse_times),
+        "avg_page_bytes": round(sum(page_bytes) / len(page_bytes)) if page_bytes else 0,
+        "parse_us": {
+            "p50": round(percentile(parse_times, 50) * 1e6, 1),
+            "p95": round(percentile(parse_times, 95) * 1e6, 1),
+        },
+        "poll_parse": {
+            "pages": len(stream_poll_times),
+            "legacy_us": round(sum(legacy_poll_times) / len(legacy_poll_times) * 1e6, 1) if legacy_poll_times else 0,
+            "stream_us": round(sum(stream_poll_times) / len(stream_poll_times) * 1e6, 1) if stream_poll_times else 0,
+            "speedup": round(sum(legacy_poll_times) / sum(stream_poll_times), 2) if sum(stream_poll_times) else 0,
+            "bytes_read_ratio": round(poll_bytes_read / poll_bytes_total, 3) if poll_bytes_total else 0,
+        },
+        "e2e": {
+            "p50": round(percentile(e2e_times, 50), 4),
+            "p95": round(percentile(e2e_times, 95), 4),
+            "requests_per_job": round(sum(e2e_requests) / len(e2e_requests), 2) if e2e_requests else 0,
+        },
+        "drift": drift,
+    }
+
+
+def compare_rows(report: Dict[str, Any], baseline: Dict[str, Any]) -> List[Tuple[str, float, float, bool, bool]]:
+    """(имя, новое, старое, больше - лучше, проверять на регрессию)"""
+    if report.get('mode') == 'cassettes':
+        return [
+            ("parse_us_p50", report['parse_us']['p50'], baseline['parse_us']['p50'], False, True),
+            ("parse_us_p95", report['parse_us']['p95'], baseline['parse_us']['p95'], False, False),
+            ("poll_stream_us", report['poll_parse']['stream_us'], baseline['poll_parse']['stream_us'], False, True),
+            ("e2e_p95", report['e2e']['p95'], baseline['e2e']['p95'], False, True),
+            ("requests_per_job", report['e2e']['requests_per_job'], baseline['e2e']['requests_per_job'], False, False),
+        ]
+    return [
+        ("throughput", report['throughput'], baseline['throughput'], True, True),
+        ("p50", report['latency']['p50'], baseline['latency']['p50'], False, False),
+        ("p95", report['latency']['p95'], baseline['latency']['p95'], False, True),
+        ("p99", report['latency']['p99'], baseline['latency']['p99'], False, False),
+        ("requests_per_job", report.get('requests_per_job', 0), baseline.get('requests_per_job', 0), False, False),
+    ]
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> bool:
+    """Печатает разницу с прошлым прогоном, возвращает False если есть регрессия."""
+    ok = True
+    for name, new, old, higher_is_better, checked in compare_rows(report, baseline):
+        change = (new - old) / old if old else 0.0
+        worse = -change if higher_is_better else change
+        mark = ''
+        if worse > threshold and checked:
+            mark = '  <-- REGRESSION'
+            ok = False
+        print(f'{name:>18}: {old:>10} -> {new:>10} ({change:+.1%}){mark}')
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark /bing* endpoints')
+    parser.add_argument('--api', default='http://127.0.0.1:58796', help='API base url')
+    parser.add_argument('--mock', default=None, help='mock_bing.py base url, for requests per job')
+    parser.add_argument('--endpoint', default='/bing')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--prompt', default='benchmark prompt')
+    parser.add_argument('--out', default=None, help='write JSON report to this file')
+    parser.add_argument('--compare', default=None, help='previous JSON report to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed regression, 0.1 = 10%%')
+    parser.add_argument('--cassettes', default=None, help='offline mode: directory with recorded cassettes')
+    parser.add_argument('--repeats', type=int, default=100, help='offline mode: parser runs per page')
+    parser.add_argument('--speed', type=float, default=0.0,
+                        help='offline mode: replay timing, 1 - as recorded, 0 - no delays')
+    args = parser.parse_args()
+
+    if args.cassettes:
+        report = run_cassettes(args.cassettes, args.repeats, args.speed)
+    else:
+        report = run_benchmark(args.api, args.endpoint, args.concurrency, args.requests, args.prompt, args.mock)
+    print(json.dumps(report, indent=2))
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if not compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+    if report.get('drift'):
+        sys.exit(1)
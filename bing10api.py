@@ -1,38 +1,72 @@
 #!/usr/bin/env python3
 
+import functools
+import hashlib
+import hmac
+import json
 import os
 import re
 import subprocess
+import threading
 import time
 import traceback
 from collections import deque
-from typing import Any, Deque, Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, send_file
 
+import bing_genimg_v3
 import cfg  # type: ignore
+import cookie_check
+import cookie_policy
+import diagnostics
+import image_dedup
+import image_store
+import job_journal
 import my_genimg
 import my_log
 import rotate_cookie
+import scheduler
+import tracing
+import webhook
 from utils import async_run, seconds_to_hms
 
-# сколько раз подряд должно быть фейлов что бы принять меры - сменить куки
-MAX_COOKIE_FAIL = 5
-COOKIE_FAIL = 0
 COOKIE_INITIALIZED = False
-# сколько раз подряд должно быть фейлов что бы принять меры - выключить сервис
-MAX_COOKIE_FAIL_FOR_TERMINATE = 10
-COOKIE_FAIL_FOR_TERMINATE = 0
-SUSPEND_TIME = 0  # время когда можно снова запустить сервис
-SUSPEND_TIME_SET = 12 * 60 * 60  # время в секундах до следующего запуска сервиса (12 часов)
 
 # после такого количества запросов принудительно сменить куки
 MAX_REQUESTS_BEFORE_ROTATE_COOKIE = 50
 REQUESTS_BEFORE_ROTATE_COOKIE = 0
 
+# максимум элементов в одном запросе /bing_batch
+MAX_BATCH_ITEMS = 50
+# максимум повторов для одного элемента batch (как у /bing20)
+MAX_BATCH_ITERATIONS = 20
+
+def suspend_service() -> None:
+    """Сервис выключается из-за слишком большого количества ошибок подряд."""
+    my_log.log2(f'Suspend service: {seconds_to_hms(int(POLICY.suspend_time))}')
+
+    # Проверку и выполнение команды из cfg.CMD_ON_STOP
+    if hasattr(cfg, 'CMD_ON_STOP') and cfg.CMD_ON_STOP:
+        try:
+            my_log.log2(f'Executing CMD_ON_STOP: {cfg.CMD_ON_STOP}')
+            subprocess.Popen(cfg.CMD_ON_STOP, shell=True)
+        except Exception as cmd_e:
+            my_log.log2(f'Error executing CMD_ON_STOP: {cmd_e}')
+
+
+# смена куки и выключение сервиса после ошибок подряд (пороги в cfg, см. cookie_policy.py)
+POLICY = cookie_policy.CookiePolicy(rotate=rotate_cookie.rotate_cookie, on_suspend=suspend_service,
+                                    on_resume=lambda: my_log.log2('Restart service'))
+
 # Global deque to store the last 5 failed prompts with their timestamps
 FAILED_PROMPTS: Deque[Dict[str, Any]] = deque(maxlen=5)
 
+# сколько запросов сейчас ждут или выполняют генерацию (глубина очереди для роутера)
+ACTIVE_REQUESTS = 0
+ACTIVE_REQUESTS_LOCK = threading.Lock()
+
 
 def get_last_attempts(log_file: str = 'logs/debug_bing_api.log', num_attempts: int = 10) -> list[dict[str, str]]:
     """
@@ -110,50 +144,58 @@ def get_current_cookie(log_file: str = 'logs/debug.log') -> str:
 # API для доступа к генератору картинок бинг
 FLASK_APP = Flask(__name__)
 
+# токен для /admin/* в заголовке X-Admin-Token, без него эти эндпоинты выключены
+ADMIN_TOKEN = getattr(cfg, 'ADMIN_TOKEN', '')
+
+
+def get_client_id() -> str:
+    """
+    Идентификатор клиента для очереди: API ключ (X-Api-Key), X-Client-Id или IP адрес.
+    Ключ в статистику не попадает, вместо него короткий хеш.
+    """
+    api_key = request.headers.get('X-Api-Key')
+    if api_key:
+        return 'key:' + hashlib.sha1(api_key.encode()).hexdigest()[:8]
+    return request.headers.get('X-Client-Id') or request.remote_addr or ''
+
+
+def init_cookie() -> None:
+    '''
+    Выбирает первый куки. Первый запрос и фоновая проверка куки (check_cookies_loop) могут
+    прийти сюда одновременно, поэтому под замком POLICY, под которым куки меняет и сама POLICY.
+    '''
+    global COOKIE_INITIALIZED
+    with POLICY.lock:
+        if not COOKIE_INITIALIZED:
+            rotate_cookie.rotate_cookie()
+            COOKIE_INITIALIZED = True
+
 
-def bing(j: Dict[str, Any], iterations: int = 1, model: str = 'dalle') -> Any:
+def generate(j: Dict[str, Any], iterations: int = 1, model: str = 'dalle',
+             client_id: str = '', priority: int = scheduler.PRIORITY_INTERACTIVE) -> Tuple[Dict[str, Any], int]:
     '''
-    Делает 1 запрос на рисование бингом.
+    Делает 1 запрос на рисование бингом, возвращает (словарь с ответом, http код).
     Если не получилось - возвращает ошибку.
     Если не получилось 5 раз подряд то пытается сменить куки.
     Если не получилось 20 раз подряд то выключает сервис на 12 часов.
     '''
     try:
-        global COOKIE_FAIL, COOKIE_INITIALIZED, COOKIE_FAIL_FOR_TERMINATE, SUSPEND_TIME
-        global REQUESTS_BEFORE_ROTATE_COOKIE
-
-        if COOKIE_FAIL_FOR_TERMINATE >= MAX_COOKIE_FAIL_FOR_TERMINATE:
-            if SUSPEND_TIME and SUSPEND_TIME > time.time():
-                return jsonify({"error": "Service is disabled, time to next start is " + seconds_to_hms(int(SUSPEND_TIME - time.time())) + " seconds"}), 500
-            elif SUSPEND_TIME == 0:
-                SUSPEND_TIME = time.time() + SUSPEND_TIME_SET
-                my_log.log2(f'Suspend service: {seconds_to_hms(int(SUSPEND_TIME_SET))}')
-
-                # Проверку и выполнение команды из cfg.CMD_ON_STOP
-                if hasattr(cfg, 'CMD_ON_STOP') and cfg.CMD_ON_STOP:
-                    try:
-                        my_log.log2(f'Executing CMD_ON_STOP: {cfg.CMD_ON_STOP}')
-                        subprocess.Popen(cfg.CMD_ON_STOP, shell=True)
-                    except Exception as cmd_e:
-                        my_log.log2(f'Error executing CMD_ON_STOP: {cmd_e}')
-
-                return jsonify({"error": "Service is disabled for " + seconds_to_hms(int(SUSPEND_TIME_SET)) + " seconds"}), 500
-            elif SUSPEND_TIME and SUSPEND_TIME < time.time():
-                my_log.log2('Restart service')
-                SUSPEND_TIME = 0
-                COOKIE_FAIL_FOR_TERMINATE = 0
-                COOKIE_FAIL = 0
+        global ACTIVE_REQUESTS
+
+        state, time_left = POLICY.check()
+        if state == cookie_policy.SUSPENDED:
+            return {"error": "Service is disabled, time to next start is " + seconds_to_hms(int(time_left)) + " seconds"}, 500
+        elif state == cookie_policy.JUST_SUSPENDED:
+            return {"error": "Service is disabled for " + seconds_to_hms(int(time_left)) + " seconds"}, 500
 
         if not COOKIE_INITIALIZED:
-            rotate_cookie.rotate_cookie()
-            COOKIE_INITIALIZED = True
+            init_cookie()
 
         # # принудительно сменить куки после определенного количества запросов
         # if REQUESTS_BEFORE_ROTATE_COOKIE > MAX_REQUESTS_BEFORE_ROTATE_COOKIE:
         #     rotate_cookie.rotate_cookie()
         #     REQUESTS_BEFORE_ROTATE_COOKIE = 0
-        #     COOKIE_FAIL = 0
-        #     COOKIE_FAIL_FOR_TERMINATE = 0
+        #     POLICY.reset()
         #     my_log.log2(f'rotate_cookie: after {MAX_REQUESTS_BEFORE_ROTATE_COOKIE} requests')
         # else:
         #     REQUESTS_BEFORE_ROTATE_COOKIE += 1
@@ -166,33 +208,215 @@ def bing(j: Dict[str, Any], iterations: int = 1, model: str = 'dalle') -> Any:
         ar: Optional[int] = data.get('ar', None)
 
         if not prompt:
-            return jsonify({"error": "Prompt is required"}), 400
+            return {"error": "Prompt is required"}, 400
+
+        # поиск почти одинаковых картинок: "drop" - оставить по одной из группы, "group" - вернуть группы
+        dedup_mode: str = data.get('dedup_images', '')
+        if dedup_mode not in ('', 'drop', 'group'):
+            return {"error": "dedup_images must be 'drop' or 'group'"}, 400
+        try:
+            distinct = int(data.get('distinct', 0))
+        except (TypeError, ValueError):
+            return {"error": "distinct must be an integer"}, 400
+        # distinct отбрасывает похожие картинки, клиент должен сам об этом попросить
+        if distinct and not dedup_mode:
+            return {"error": "distinct requires dedup_images ('drop' or 'group')"}, 400
+        mirror: bool = data.get('mirror', image_store.ENABLED)
+        dedup: Optional[image_dedup.NearDupFilter] = None
+        if dedup_mode and iterations > 1:
+            if image_dedup.AVAILABLE:
+                dedup = image_dedup.NearDupFilter(use_store=mirror)
+            else:
+                my_log.log_bing_api('tb:bing: dedup_images requested but numpy/Pillow are not installed')
 
         # Generate images using Bing API
-        image_urls: List[str] = my_genimg.gen_images_bing_only(prompt, iterations, model=model, ar=ar)
+        with ACTIVE_REQUESTS_LOCK:
+            ACTIVE_REQUESTS += 1
+        try:
+            image_urls: List[str] = my_genimg.gen_images_bing_only(prompt, iterations, model=model, ar=ar,
+                                                                   client_id=client_id, priority=priority,
+                                                                   dedup=dedup, distinct=distinct)
+        except scheduler.SchedulerBusy as busy:
+            # это не ошибка куки, счетчики не трогаем
+            return {"error": str(busy)}, 429
+        finally:
+            with ACTIVE_REQUESTS_LOCK:
+                ACTIVE_REQUESTS -= 1
 
         if not image_urls:
-            COOKIE_FAIL += 1
-            COOKIE_FAIL_FOR_TERMINATE += 1
             # Add the failed prompt with a timestamp to our deque
             FAILED_PROMPTS.appendleft({
                 "timestamp": time.time(),
                 "prompt": prompt,
             })
 
-            if COOKIE_FAIL >= MAX_COOKIE_FAIL:
-                COOKIE_FAIL = 0
-                rotate_cookie.rotate_cookie()
+            # 5 раз подряд - сменить куки, 10 - выключить сервис на следующем запросе
+            POLICY.failure()
 
-            return jsonify({"error": "No images generated"}), 404
+            return {"error": "No images generated"}, 404
         else:
-            COOKIE_FAIL = 0
-            COOKIE_FAIL_FOR_TERMINATE = 0
+            POLICY.success()
+
+        result: Dict[str, Any] = {"urls": image_urls}
+
+        if dedup is not None:
+            with tracing.span('dedup', mode=dedup_mode):
+                if dedup_mode == 'group':
+                    result["groups"] = dedup.groups_list()
+                else:
+                    image_urls = dedup.distinct()
+                    result["urls"] = image_urls
 
-        return jsonify({"urls": image_urls}), 200
+        # локальные копии картинок со стабильными ссылками
+        if mirror:
+            with tracing.span('mirror', count=len(image_urls)):
+                mirrored = image_store.mirror(image_urls)
+            result["local_urls"] = [image_store.local_url(mirrored[x]) for x in image_urls if x in mirrored]
+
+        return result, 200
     except Exception as e:
         my_log.log_bing_api(f'tb:bing: {e}')
-        return jsonify({"error": str(e)}), 500
+        return {"error": str(e)}, 500
+
+
+def bing(j: Dict[str, Any], iterations: int = 1, model: str = 'dalle',
+         priority: int = scheduler.PRIORITY_INTERACTIVE) -> Any:
+    """
+    Обертка над generate для flask эндпоинтов.
+    Если в запросе есть callback_url то сразу отвечает 202 с job_id, а результат
+    отправляется на callback_url когда будет готов (см. webhook.py).
+    """
+    client_id = get_client_id()
+    # свой trace id может задать только админ, остальные запросы трассируются по TRACE_SAMPLE_RATE
+    trace_id = tracing.sample(request.headers.get('X-Trace-Id') if is_admin() else None)
+    callback_url = j.get('callback_url') if isinstance(j, dict) else None
+    if callback_url:
+        url_error = webhook.check_url(callback_url)
+        if url_error:
+            return jsonify({"error": url_error}), 400
+        job_request = {"j": j, "iterations": iterations, "model": model,
+                       "client_id": client_id, "priority": priority, "trace_id": trace_id}
+        try:
+            job_id = webhook.accept(callback_url, job_request)
+        except Exception as error:
+            # база занята или диск кончился - задание не принято, клиент может повторить
+            my_log.log_bing_api(f'tb:bing: webhook.accept: {error}')
+            return jsonify({"error": "Failed to accept the job, try again later"}), 503
+        webhook.start_sender()
+        run_webhook_job(job_id, job_request)
+        response = jsonify({"job_id": job_id, "status": "accepted"})
+    else:
+        with tracing.trace('request', trace_id, endpoint=request.path, iterations=iterations, model=model,
+                           priority=priority):
+            result, code = generate(j, iterations, model=model, client_id=client_id, priority=priority)
+        response = jsonify(result)
+    if trace_id:
+        response.headers['X-Trace-Id'] = trace_id
+    return response, 202 if callback_url else code
+
+
+@async_run
+def run_webhook_job(job_id: str, job_request: Dict[str, Any]) -> None:
+    """Рисует задание принятое с callback_url и ставит результат в очередь на доставку."""
+    try:
+        with tracing.trace('webhook_job', job_request.get('trace_id', ''), job_id=job_id,
+                           iterations=job_request['iterations'], model=job_request['model'],
+                           priority=job_request['priority']):
+            result, code = generate(job_request['j'], job_request['iterations'], model=job_request['model'],
+                                    client_id=job_request['client_id'], priority=job_request['priority'])
+    except Exception as error:
+        result, code = {"error": str(error)}, 500
+    webhook.enqueue(job_id, dict(result, job_id=job_id, status=code))
+
+
+def is_admin() -> bool:
+    """В запросе правильный X-Admin-Token."""
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN)
+
+
+def admin_only(func):
+    """Пускает только запросы с правильным X-Admin-Token, если токен не задан - 404."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return jsonify({"error": "Not found"}), 404
+        if not is_admin():
+            return jsonify({"error": "Forbidden"}), 403
+        return func(*args, **kwargs)
+    return wrapper
+
+
+@FLASK_APP.route('/admin/profile', methods=['GET'])
+@admin_only
+def admin_profile_api() -> Any:
+    """
+    Семплирующий профайлер по всем потокам на ?seconds=10 (не больше 60) с шагом ?interval=0.005.
+    Отдает collapsed stacks для flamegraph.pl / speedscope.
+    """
+    try:
+        seconds = float(request.args.get('seconds', 10))
+        interval = float(request.args.get('interval', 0.005))
+    except ValueError:
+        return jsonify({"error": "seconds and interval must be numbers"}), 400
+    try:
+        folded = diagnostics.profile(seconds, interval)
+    except diagnostics.ProfilerBusy as busy:
+        return jsonify({"error": str(busy)}), 409
+    return Response(folded, mimetype='text/plain',
+                    headers={'Content-Disposition': f'attachment; filename=profile-{int(time.time())}.folded'})
+
+
+@FLASK_APP.route('/admin/threads', methods=['GET'])
+@admin_only
+def admin_threads_api() -> Any:
+    """Стеки всех потоков, кто держит и кто ждет слоты очереди к бингу."""
+    return jsonify({
+        "submit_lock_locked": my_genimg.SUBMIT_LOCK.locked(),
+        "scheduler": my_genimg.SCHEDULER.stats(),
+        "threads": diagnostics.thread_dump(my_genimg.SCHEDULER.threads()),
+    }), 200
+
+
+@FLASK_APP.route('/admin/memory', methods=['GET', 'POST'])
+@admin_only
+def admin_memory_api() -> Any:
+    """
+    Память процесса, ?top=20. Пока включен tracemalloc - в отчете самые большие места выделения
+    и рост с прошлого отчета. Включается POST ?tracemalloc=start (замедляет работу),
+    выключается POST ?tracemalloc=stop, GET ничего не меняет.
+    """
+    if request.method == 'POST':
+        action = request.args.get('tracemalloc', '')
+        if action == 'start':
+            diagnostics.tracemalloc_start()
+        elif action == 'stop':
+            diagnostics.tracemalloc_stop()
+        else:
+            return jsonify({"error": "tracemalloc must be start or stop"}), 400
+    try:
+        top = int(request.args.get('top', 20))
+    except ValueError:
+        return jsonify({"error": "top must be an integer"}), 400
+    return jsonify(diagnostics.memory_report(top)), 200
+
+
+@FLASK_APP.route('/traces/<trace_id>', methods=['GET'])
+@admin_only
+def trace_api(trace_id: str) -> Any:
+    """Стадии запроса по trace id из заголовка X-Trace-Id (см. tracing.py)."""
+    found = tracing.get_trace(trace_id)
+    if found is None:
+        return jsonify({"error": "Trace not found"}), 404
+    return jsonify(found), 200
+
+
+@FLASK_APP.route('/jobs/<job_id>', methods=['GET'])
+def job_api(job_id: str) -> Any:
+    """Состояние задания принятого с callback_url (на случай если вебхук не дошел)."""
+    job = webhook.get_job(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job), 200
 
 
 @FLASK_APP.route('/reload_cookies', methods=['POST'])
@@ -203,11 +427,11 @@ def reload_cookies_api() -> Any:
     :return: A JSON response indicating success or failure.
     """
     try:
-        rotate_cookie.rotate_cookie()
-        global COOKIE_FAIL, COOKIE_INITIALIZED, COOKIE_FAIL_FOR_TERMINATE, REQUESTS_BEFORE_ROTATE_COOKIE
-        COOKIE_FAIL = 0
-        COOKIE_INITIALIZED = True
-        COOKIE_FAIL_FOR_TERMINATE = 0
+        global COOKIE_INITIALIZED, REQUESTS_BEFORE_ROTATE_COOKIE
+        with POLICY.lock:
+            rotate_cookie.rotate_cookie()
+            POLICY.reset()
+            COOKIE_INITIALIZED = True
         REQUESTS_BEFORE_ROTATE_COOKIE = 0
         my_log.log2('Cookies reloaded successfully via API.')
         return jsonify({"message": "Cookies reloaded successfully"}), 200
@@ -225,7 +449,7 @@ def bing_api_post10() -> Any:
 
     :return: A JSON response containing a list of URLs or an error message.
     """
-    return bing(request.get_json(), 10)
+    return bing(request.get_json(), 10, priority=scheduler.PRIORITY_BULK)
 
 
 @FLASK_APP.route('/bing20', methods=['POST'])
@@ -237,7 +461,7 @@ def bing_api_post20() -> Any:
 
     :return: A JSON response containing a list of URLs or an error message.
     """
-    return bing(request.get_json(), 20)
+    return bing(request.get_json(), 20, priority=scheduler.PRIORITY_BULK)
 
 
 @FLASK_APP.route('/bing2', methods=['POST'])
@@ -249,7 +473,7 @@ def bing_api_post2() -> Any:
 
     :return: A JSON response containing a list of URLs or an error message.
     """
-    return bing(request.get_json(), 2)
+    return bing(request.get_json(), 2, priority=scheduler.PRIORITY_BULK)
 
 
 @FLASK_APP.route('/bing', methods=['POST'])
@@ -272,6 +496,128 @@ def bing_api_post_gpt() -> Any:
     return bing(request.get_json(), 1, model='gpt4o')
 
 
+def parse_batch_items(items: Any) -> Tuple[List[Dict[str, Any]], str]:
+    """
+    Проверяет и нормализует элементы batch запроса.
+    Возвращает (список элементов, текст ошибки).
+    """
+    if not isinstance(items, list) or not items:
+        return [], "items must be a non-empty list"
+    if len(items) > MAX_BATCH_ITEMS:
+        return [], f"Too many items, max is {MAX_BATCH_ITEMS}"
+
+    result = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not item.get('prompt'):
+            return [], f"Item {index}: prompt is required"
+        model = item.get('model', 'dalle')
+        if model not in ('dalle', 'gpt4o'):
+            return [], f"Item {index}: unknown model {model}"
+        try:
+            iterations = int(item.get('iterations', 1))
+            distinct = int(item.get('distinct', 0))
+        except (TypeError, ValueError):
+            return [], f"Item {index}: iterations and distinct must be integers"
+        dedup_mode = item.get('dedup_images', '')
+        if dedup_mode not in ('', 'drop', 'group'):
+            return [], f"Item {index}: dedup_images must be 'drop' or 'group'"
+        if distinct and not dedup_mode:
+            return [], f"Item {index}: distinct requires dedup_images ('drop' or 'group')"
+        result.append({
+            "index": index,
+            "prompt": item['prompt'],
+            "model": model,
+            "ar": item.get('ar', None),
+            "iterations": min(max(iterations, 1), MAX_BATCH_ITERATIONS),
+            "mirror": bool(item.get('mirror', image_store.ENABLED)),
+            "dedup_images": dedup_mode,
+            "distinct": distinct,
+        })
+    return result, ''
+
+
+def run_batch(items: List[Dict[str, Any]], client_id: str = '') -> Iterator[Dict[str, Any]]:
+    """
+    Рисует все элементы batch запроса и отдает результат каждого элемента по мере готовности.
+
+    Каждый элемент - один вызов generate() со всеми его повторами, как отдельный /bing10:
+    один исход для счетчиков неудач куки и FAILED_PROMPTS, те же mirror, dedup_images и distinct.
+    Одновременно в работе не больше INFLIGHT_DEPTH элементов, больше очередь все равно
+    не пропустит. Одинаковые элементы рисуются один раз.
+    """
+    # одинаковые элементы группируем, рисуем только первый
+    groups: Dict[Tuple[Any, ...], List[Dict[str, Any]]] = {}
+    for item in items:
+        key = (item['prompt'], item['model'], str(item['ar']), item['iterations'],
+               item['mirror'], item['dedup_images'], item['distinct'])
+        groups.setdefault(key, []).append(item)
+
+    def run(item: Dict[str, Any]) -> Tuple[Dict[str, Any], int]:
+        j = {x: item[x] for x in ('prompt', 'ar', 'mirror', 'dedup_images', 'distinct')}
+        return generate(j, item['iterations'], model=item['model'], client_id=client_id,
+                        priority=scheduler.PRIORITY_BULK)
+
+    pool = ThreadPoolExecutor(max_workers=max(1, min(my_genimg.INFLIGHT_DEPTH, len(groups))),
+                              thread_name_prefix='bing_batch')
+    futures = {pool.submit(run, group[0]): group for group in groups.values()}
+    try:
+        for future in as_completed(futures):
+            result, code = future.result()
+            for same_item in futures[future]:
+                if code == 200:
+                    yield dict(result, index=same_item['index'])
+                else:
+                    yield {"index": same_item['index'], "error": result.get('error', 'No images generated')}
+    finally:
+        # клиент отключился от потока - оставшиеся элементы не рисуем
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+@FLASK_APP.route('/bing_batch', methods=['POST'])
+def bing_api_batch() -> Any:
+    """
+    API endpoint for generating images for many prompts in one call.
+
+    Body: {"items": [{"prompt": ..., "model": "dalle", "ar": 1, "iterations": 1,
+                      "mirror": true, "dedup_images": "", "distinct": 0}, ...], "stream": false}
+
+    :return: A JSON response with results for every item in request order,
+        or an NDJSON stream with one line per item as soon as it is finished if stream is true.
+    """
+    data = request.get_json() or {}
+    items, error = parse_batch_items(data.get('items'))
+    if error:
+        return jsonify({"error": error}), 400
+
+    client_id = get_client_id()
+
+    if data.get('stream'):
+        def stream() -> Iterator[str]:
+            for result in run_batch(items, client_id):
+                yield json.dumps(result, ensure_ascii=False) + '\n'
+        return Response(stream(), mimetype='application/x-ndjson')
+
+    results = sorted(run_batch(items, client_id), key=lambda x: x['index'])
+    return jsonify({"results": results}), 200
+
+
+@FLASK_APP.route('/img/<digest>', methods=['GET'])
+def image_api(digest: str) -> Any:
+    """
+    Отдает локальную копию картинки по ее sha256.
+    Поддерживает Range и условные запросы (ETag / If-Modified-Since).
+    """
+    path = image_store.acquire(digest)
+    if path is None:
+        return jsonify({"error": "Not found"}), 404
+    # send_file открывает файл сразу, после этого удаление при вытеснении отдаче уже не мешает
+    try:
+        return send_file(os.path.abspath(path), mimetype=image_store.guess_mimetype(path), conditional=True,
+                         etag=digest, max_age=365 * 24 * 60 * 60)
+    finally:
+        image_store.release(digest)
+
+
 @FLASK_APP.route('/status', methods=['GET'])
 def status_api() -> Any:
     """
@@ -281,19 +627,27 @@ def status_api() -> Any:
     try:
         status_data = {
             "service_status": "OK",
-            "cookie_fail_count": COOKIE_FAIL,
-            "total_fail_count": COOKIE_FAIL_FOR_TERMINATE,
-            "max_fail_for_rotate": MAX_COOKIE_FAIL,
-            "max_fail_for_suspend": MAX_COOKIE_FAIL_FOR_TERMINATE,
+            "cookie_fail_count": POLICY.fail,
+            "total_fail_count": POLICY.total_fail,
+            "max_fail_for_rotate": POLICY.max_fail,
+            "max_fail_for_suspend": POLICY.max_fail_for_terminate,
             "requests_before_rotate": f"{REQUESTS_BEFORE_ROTATE_COOKIE}/{MAX_REQUESTS_BEFORE_ROTATE_COOKIE}",
+            "active_requests": ACTIVE_REQUESTS,
+            "scheduler": my_genimg.SCHEDULER.stats(),
+            "pipeline": {
+                "depth": my_genimg.INFLIGHT_DEPTH,
+                "cookies": bing_genimg_v3.PIPELINE_STATS.to_dict(),
+            },
             "current_cookie": get_current_cookie(),
+            "cookie_states": cookie_check.snapshot(),
             "last_attempts": get_last_attempts(),
             "last_failed_prompts": list(FAILED_PROMPTS),
         }
 
-        if COOKIE_FAIL_FOR_TERMINATE >= MAX_COOKIE_FAIL_FOR_TERMINATE and SUSPEND_TIME > time.time():
+        time_to_restart = POLICY.seconds_to_restart()
+        if time_to_restart:
             status_data["service_status"] = "SUSPENDED"
-            status_data["time_to_restart"] = seconds_to_hms(int(SUSPEND_TIME - time.time()))
+            status_data["time_to_restart"] = seconds_to_hms(int(time_to_restart))
 
         return jsonify(status_data), 200
     except Exception as e:
@@ -302,6 +656,27 @@ def status_api() -> Any:
         return jsonify({"error": "Failed to get status", "details": str(e)}), 500
 
 
+@async_run
+def check_cookies_loop() -> None:
+    '''
+    Проверяет все куки при запуске и потом раз в cookie_check.CHECK_INTERVAL, в фоне.
+    Если текущий куки оказался просроченным - сразу меняет его, не дожидаясь ошибок пользователей.
+    '''
+    global COOKIE_INITIALIZED
+    while 1:
+        try:
+            cookie_check.check_all()
+            # под тем же замком что и смена куки в init_cookie() и POLICY.failure()
+            with POLICY.lock:
+                if not COOKIE_INITIALIZED or rotate_cookie.is_expired(rotate_cookie.CURRENT_COOKIE):
+                    rotate_cookie.rotate_cookie()
+                    COOKIE_INITIALIZED = True
+                    POLICY.cookie_changed()
+        except Exception as error:
+            my_log.log_bing_api(f'tb:check_cookies_loop: {error}')
+        time.sleep(cookie_check.CHECK_INTERVAL)
+
+
 @async_run
 def run_flask(addr: str = '127.0.0.1', port: int = 58796):
     try:
@@ -314,6 +689,12 @@ def run_flask(addr: str = '127.0.0.1', port: int = 58796):
 
 
 if __name__ == '__main__':
+    # дорисовать задания которые были в работе до перезапуска
+    job_journal.resume_unfinished()
+    # задания с callback_url которые не успели дорисовать или доставить
+    webhook.resume_unfinished(run_webhook_job)
+    # проверка куки идет параллельно с запуском сервера
+    check_cookies_loop()
     run_flask(addr=cfg.ADDR, port=cfg.PORT)
     my_log.log2(f'run_flask: {cfg.ADDR}:{cfg.PORT} started')
     while 1:
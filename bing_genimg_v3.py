@@ -2,20 +2,112 @@
 # https://github.com/vra/bing_brush
 
 
+import contextlib
 import json
 import html
 import os
 import random
+import re
+import threading
 import time
 import traceback
 from http.cookies import SimpleCookie
-from typing import Optional
+from typing import Any, Dict, Optional
 
-import regex
 import requests
 from requests.utils import cookiejar_from_dict
 
+import cassette
+import cfg  # type: ignore
+import image_check
+import job_journal
 import my_log
+import rotate_cookie
+import tracing
+
+
+# адрес Bing Image Creator, можно направить на локальный mock_bing.py для нагрузочных тестов
+DEFAULT_BING_BASE_URL = 'https://www.bing.com'
+BING_BASE_URL = getattr(cfg, 'BING_BASE_URL', DEFAULT_BING_BASE_URL).rstrip('/')
+# сколько ждать картинки от dalle и от gpt4o, секунд
+DALLE_MAX_WAIT_TIME = 60
+GPT_MAX_WAIT_TIME = 240
+# пауза между опросами результата, секунд
+POLL_INTERVAL = getattr(cfg, 'BING_POLL_INTERVAL', 1)
+
+# если задано то все обмены с бингом записываются в кассеты в этой папке (см. cassette.py)
+CASSETTE_DIR = getattr(cfg, 'BING_CASSETTE_DIR', '')
+
+
+# страница результатов читается кусками такого размера
+RESULT_CHUNK_SIZE = 8192
+# если страница "еще рисуется" то остаток меньше этого размера дочитываем, чтобы
+# соединение вернулось в пул, а больше - просто закрываем соединение
+RESULT_DRAIN_LIMIT = 32 * 1024
+
+# разбор идет прямо по байтам, без декодирования всей страницы, в utf-8 байты
+# кавычки и латиницы не встречаются внутри многобайтных символов
+IMAGE_SRC_RE = re.compile(rb'src="([^"]+)"')
+SRC_PREFIX = b'src="'
+# признаки на странице /images/create: остаток бустов и имя залогиненного пользователя
+TOKEN_BALANCE_RE = re.compile(r'id="token_bal"[^>]*>\s*(\d+)')
+SIGNED_IN_RE = re.compile(r'id="id_n"[^>]*>\s*[^<\s]')
+# признаки незалогиненного: кнопка "Join & Create" ведет на /fd/auth/signin, или редирект на логин
+SIGNED_OUT_RE = re.compile(r'/fd/auth/signin|login\.live\.com')
+
+
+class ResultPageParser:
+    """
+    Потоковый разбор страницы результатов.
+
+    feed() получает страницу по кускам (bytes) и сразу достает из них ссылки на картинки
+    (одним проходом, без дублей, в порядке появления). Если в странице встретился
+    pending_marker (strm у gpt4o, errorMessage у dalle) то картинки еще не готовы,
+    feed() возвращает True и дальше страницу можно не читать.
+    """
+
+    def __init__(self, pending_marker: Optional[str] = None):
+        self.pending_marker = pending_marker.encode() if pending_marker else b''
+        self.pending = False
+        self.size = 0
+        self.tail = b''
+        self.found: Dict[str, None] = {}
+        # сколько байт с конца куска надо держать чтобы не потерять маркер или начало src="
+        self.keep = max(len(SRC_PREFIX), len(self.pending_marker)) - 1
+
+    def feed(self, chunk: bytes) -> bool:
+        if self.pending:
+            return True
+        self.size += len(chunk)
+        data = self.tail + chunk
+        if self.pending_marker and self.pending_marker in data:
+            self.pending = True
+            return True
+
+        last_end = 0
+        for match in IMAGE_SRC_RE.finditer(data):
+            self.found[match.group(1).decode('utf-8', errors='replace').split("?w=")[0]] = None
+            last_end = match.end()
+
+        # незакрытый src="... ждет продолжения в следующем куске. Если он есть то последняя
+        # кавычка в куске - его открывающая, так что ищем с конца только до нее
+        quote = data.rfind(b'"', last_end)
+        prefix_start = quote - len(SRC_PREFIX) + 1
+        if quote != -1 and prefix_start >= last_end and data.startswith(SRC_PREFIX, prefix_start):
+            self.tail = data[prefix_start:]
+        else:
+            self.tail = data[-self.keep:]
+        return False
+
+    def links(self) -> list[str]:
+        return list(self.found)
+
+
+def parse_image_links(text: str) -> list[str]:
+    """Достает ссылки на картинки из страницы результатов."""
+    parser = ResultPageParser()
+    parser.feed(text.encode('utf-8'))
+    return parser.links()
 
 
 class BingBrush:
@@ -23,12 +115,26 @@ class BingBrush:
         self,
         cookie,
         verbose=False,
-        max_wait_time=60,
+        max_wait_time=DALLE_MAX_WAIT_TIME,
+        adapter=None,
     ):
+        """
+        adapter - транспорт для запросов к бингу, например cassette.ReplayAdapter
+        """
         self.max_wait_time = max_wait_time
+        # срок задания (time.time()), задается когда опрос продолжается после перезапуска
+        self.deadline: Optional[float] = None
         self.verbose = verbose
 
         self.session = self.construct_requests_session(cookie)
+        if adapter is None and CASSETTE_DIR:
+            adapter = cassette.RecordingAdapter(CASSETTE_DIR)
+        if adapter is not None:
+            self.session.mount(BING_BASE_URL, adapter)
+        # ссылки на картинки проверяются только при работе с настоящим бингом (в том числе при записи
+        # кассет), у mock_bing и воспроизводимых кассет ссылки ненастоящие
+        self.validate_images = (not isinstance(adapter, cassette.ReplayAdapter)
+                                and BING_BASE_URL == DEFAULT_BING_BASE_URL)
 
         self.prepare_error_messages()
 
@@ -68,8 +174,8 @@ class BingBrush:
             "accept-language": "en-US,en;q=0.9",
             "cache-control": "max-age=0",
             "content-type": "application/x-www-form-urlencoded",
-            "referrer": "https://www.bing.com/images/create/",
-            "origin": "https://www.bing.com",
+            "referrer": f"{BING_BASE_URL}/images/create/",
+            "origin": BING_BASE_URL,
             # "user-agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/110.0.0.0 Safari/537.36 Edg/110.0.1587.63",
             "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36",
             "x-forwarded-for": FORWARDED_IP,
@@ -93,28 +199,57 @@ class BingBrush:
         return redirect_url, request_id
 
 
+    def fetch_result_page(self, polling_url: str, pending_marker: str) -> Optional[list[str]]:
+        """
+        Один опрос результата. Читает ответ кусками и перестает разбирать его как только
+        видно что картинки еще рисуются. Возвращает None если еще не готово, иначе ссылки.
+        """
+        tracing.incr('requests')
+        response = self.session.get(polling_url, timeout=self.max_wait_time, stream=True)
+        # дочитанный до конца ответ сам возвращает соединение в пул, close() нужен только
+        # если бросили чтение на середине - такое соединение переиспользовать нельзя
+        exhausted = False
+        try:
+            if response.status_code != 200:
+                raise Exception(self.error_message_dict["error_noresults"])
+
+            parser = ResultPageParser(pending_marker)
+            drained = 0
+            for chunk in response.iter_content(chunk_size=RESULT_CHUNK_SIZE):
+                if parser.pending:
+                    drained += len(chunk)
+                    if drained > RESULT_DRAIN_LIMIT:
+                        break
+                    continue
+                parser.feed(chunk)
+            else:
+                exhausted = True
+        finally:
+            if not exhausted:
+                response.close()
+        tracing.incr('bytes', parser.size)
+
+        if parser.pending or not parser.size:
+            return None
+        return parser.links()
+
     def obtaion_image_url_dalle(self, redirect_url, request_id, url_encoded_prompt):
-        self.session.get(f"https://www.bing.com{redirect_url}", timeout=self.max_wait_time)
-        polling_url = f"https://www.bing.com/images/create/async/results/{request_id}?q={url_encoded_prompt}"
+        with tracing.span('redirect'):
+            self.session.get(f"{BING_BASE_URL}{redirect_url}", timeout=self.max_wait_time)
+        polling_url = f"{BING_BASE_URL}/images/create/async/results/{request_id}?q={url_encoded_prompt}"
         # Poll for results
         start_wait = time.time()
         while True:
             if int(time.time() - start_wait) > self.max_wait_time:
                 raise Exception(self.error_message_dict["error_timeout"])
-            response = self.session.get(polling_url, timeout=self.max_wait_time)
-            if response.status_code != 200:
-                raise Exception(self.error_message_dict["error_noresults"])
-            if not response.text or response.text.find("errorMessage") != -1:
-                time.sleep(1)
+            links = self.fetch_result_page(polling_url, "errorMessage")
+            if links is None:
+                time.sleep(POLL_INTERVAL)
                 continue
             else:
                 break
 
-        image_links = regex.findall(r'src="([^"]+)"', response.text)
-        normal_image_links = [link.split("?w=")[0] for link in image_links]
-        normal_image_links = list(set(normal_image_links))
-
-        return normal_image_links
+        return links
 
 
     def obtaion_image_url(
@@ -125,35 +260,31 @@ class BingBrush:
         This method is now unified and works similarly to the DALL-E polling.
         """
         polling_url = (
-            f"https://www.bing.com/images/create/async/results/{request_id}"
+            f"{BING_BASE_URL}/images/create/async/results/{request_id}"
             f"?q={url_encoded_prompt}"
         )
 
 
-        self.max_wait_time = 240 # 4 минуты принудительно
+        self.max_wait_time = GPT_MAX_WAIT_TIME # 4 минуты принудительно
+        if self.deadline is not None:
+            # продолжение после перезапуска, ждать можно только до срока задания
+            self.max_wait_time = min(self.max_wait_time, max(1, int(self.deadline - time.time())))
 
         start_wait = time.time()
         while True:
             if int(time.time() - start_wait) > self.max_wait_time:
                 raise Exception(self.error_message_dict["error_timeout"])
 
-            response = self.session.get(polling_url, timeout=self.max_wait_time)
-
-            if response.status_code != 200:
-                raise Exception(self.error_message_dict["error_noresults"])
-
             # The 'strm' class indicates that the image is still being rendered progressively.
             # We wait until this class is no longer present in the response.
-            if "strm" in response.text or not response.text:
-                time.sleep(1)
+            links = self.fetch_result_page(polling_url, "strm")
+            if links is None:
+                time.sleep(POLL_INTERVAL)
                 continue
             else:
                 break
 
-        image_links = regex.findall(r'src="([^"]+)"', response.text)
-        normal_image_links = [link.split("?w=")[0] for link in image_links]
-
-        return list(set(normal_image_links))
+        return links
 
     def send_request(self, prompt, model="gpt4o", rt_type=4, ar: Optional[str] = None):
         # Маппинг имени модели на ее ID
@@ -163,7 +294,7 @@ class BingBrush:
         payload = f"q={url_encoded_prompt}&qs=ds"
 
         # Используем model_id вместо имени
-        url = f"https://www.bing.com/images/create?q={url_encoded_prompt}&rt={rt_type}&mdl={model_id}&FORM=GENCRE"
+        url = f"{BING_BASE_URL}/images/create?q={url_encoded_prompt}&rt={rt_type}&mdl={model_id}&FORM=GENCRE"
         if ar is not None:
             url += f"&ar={ar}"
 
@@ -175,15 +306,60 @@ class BingBrush:
         )
         return response, url_encoded_prompt
 
-    def process(self, prompt, model="dalle", ar: Optional[str] = None):
+    def check_account(self, timeout: float = 20) -> Dict[str, Any]:
         """
-        Основной метод для генерации изображений.
-        model: "dalle" или "gpt4o"
-        ar: optional int for aspect ratio. For example, 1 for square.
+        Дешевая проверка куки без отправки задания: открывает страницу создания картинок
+        и смотрит залогинен ли пользователь и сколько у него бустов.
+        Возвращает {"state": rotate_cookie.COOKIE_*, "boosts": число или None}.
+        """
+        response = self.session.get(f"{BING_BASE_URL}/images/create", timeout=timeout)
+        if response.status_code != 200:
+            return {"state": rotate_cookie.COOKIE_UNKNOWN, "boosts": None}
+        text = response.text
+        match = TOKEN_BALANCE_RE.search(text)
+        boosts = int(match.group(1)) if match else None
+        if boosts is None and not SIGNED_IN_RE.search(text):
+            if SIGNED_OUT_RE.search(response.url or '') or SIGNED_OUT_RE.search(text):
+                return {"state": rotate_cookie.COOKIE_EXPIRED, "boosts": None}
+            # страница поменялась и ни одного признака не нашлось - не повод выкидывать куки
+            my_log.log_bing_api('bing_genimg_v3:check_account: unknown /images/create page layout')
+            return {"state": rotate_cookie.COOKIE_UNKNOWN, "boosts": None}
+        if boosts == 0:
+            return {"state": rotate_cookie.COOKIE_BOOST_EXHAUSTED, "boosts": 0}
+        return {"state": rotate_cookie.COOKIE_VALID, "boosts": boosts}
+
+    def poll(self, redirect_url: str, request_id: str, url_encoded_prompt: str, model: str = "dalle") -> list[str]:
+        """
+        Ждет результат уже принятого бингом задания и возвращает ссылки на картинки.
+        """
+        with tracing.span('poll', model=model):
+            if model == 'gpt4o':
+                img_urls = self.obtaion_image_url(redirect_url, request_id, url_encoded_prompt)
+                if len(img_urls) > 1:
+                    img_urls = [x for x in img_urls if x.startswith('http') and 'bing.net/th/id/' in x or 'bing.com/th/id/' in x]
+            else:
+                img_urls = self.obtaion_image_url_dalle(redirect_url, request_id, url_encoded_prompt)
+                img_urls = [x for x in img_urls if x.startswith('http') and 'bing.net/th/id/' in x or 'bing.com/th/id/' in x]
+
+        # битые ссылки и заглушки выкидываем, если не осталось ничего - это неудачная попытка
+        if self.validate_images:
+            with tracing.span('validate_urls', count=len(img_urls)):
+                img_urls, bad_urls = image_check.validate(img_urls)
+            if bad_urls:
+                my_log.log_bing_api(f'image_check: {self.error_message_dict["error_bad_images"]} {bad_urls}')
+        my_log.log_bing_api(f'bing_genimg_v3:process: {img_urls}')
+        return img_urls
+
+    def submit(self, prompt, model="dalle", ar: Optional[str] = None, client_id: str = '') -> Optional[dict]:
+        """
+        Первая стадия: отправляет задание в бинг (POST + ссылка на результат).
+        Возвращает задание для complete() или None если бинг его не принял.
+        client_id записывается в журнал заданий (см. job_journal.take_result).
         """
         try:
             # Сначала пробуем быстрый канал (rt=4)
-            response, url_encoded_prompt = self.send_request(prompt, model=model, rt_type=4, ar=ar)
+            with tracing.span('send_request', rt=4):
+                response, url_encoded_prompt = self.send_request(prompt, model=model, rt_type=4, ar=ar)
 
             if response.status_code != 302:
                 self.process_error(response)
@@ -196,34 +372,128 @@ class BingBrush:
             # Если бусты кончились, пробуем медленный (rt=3)
             if redirect_url is None:
                 my_log.log_bing_api('bing_genimg_v3:process: ==> Your boosts have run out, using the slow generating pipeline, please wait...')
-                response, url_encoded_prompt = self.send_request(prompt, model=model, rt_type=3, ar=ar)
+                tracing.set_attr('rt3_fallback', True)
+                with tracing.span('send_request', rt=3):
+                    response, url_encoded_prompt = self.send_request(prompt, model=model, rt_type=3, ar=ar)
                 redirect_url, request_id = self.request_result_urls(
                     response, url_encoded_prompt
                 )
                 if redirect_url is None:
                     my_log.log_bing_api('bing_genimg_v3:process: ==> Error occurs, please submit an issue at https://github.com/vra/bing_brush, I will fix it as soon as possible.')
-                    return []
-
-            if model == 'gpt4o':
-                img_urls = self.obtaion_image_url(redirect_url, request_id, url_encoded_prompt)
-                if len(img_urls) > 1:
-                    img_urls = [x for x in img_urls if x.startswith('http') and 'bing.net/th/id/' in x or 'bing.com/th/id/' in x]
-                my_log.log_bing_api(f'bing_genimg_v3:process: {img_urls}')
-                return img_urls
-            else:
-                img_urls = self.obtaion_image_url_dalle(redirect_url, request_id, url_encoded_prompt)
-                img_urls = [x for x in img_urls if x.startswith('http') and 'bing.net/th/id/' in x or 'bing.com/th/id/' in x]
-                my_log.log_bing_api(f'bing_genimg_v3:process: {img_urls}')
-                return img_urls
+                    return None
+
+            job_id = job_journal.submitted(
+                prompt, model, ar, rotate_cookie.CURRENT_COOKIE or 'cookie.txt', redirect_url, request_id,
+                url_encoded_prompt, GPT_MAX_WAIT_TIME if model == 'gpt4o' else self.max_wait_time, client_id)
+            return {
+                "job_id": job_id,
+                "model": model,
+                "redirect_url": redirect_url,
+                "request_id": request_id,
+                "url_encoded_prompt": url_encoded_prompt,
+            }
 
         except Exception as unknown_error:
             traceback_error = traceback.format_exc()
             my_log.log_bing_api(f'bing_genimg_v3:process: {unknown_error}\n\n{traceback_error}')
-            return []
+            return None
 
+    def complete(self, job: dict) -> list[str]:
+        """
+        Вторая стадия: ждет пока бинг дорисует задание из submit() и возвращает картинки.
+        """
+        img_urls = []
+        try:
+            img_urls = self.poll(job['redirect_url'], job['request_id'], job['url_encoded_prompt'], job['model'])
+        except Exception as unknown_error:
+            traceback_error = traceback.format_exc()
+            my_log.log_bing_api(f'bing_genimg_v3:process: {unknown_error}\n\n{traceback_error}')
+        finally:
+            job_journal.finish(job['job_id'], img_urls)
+        return img_urls
 
-def gen_images(prompt: str, model: str = 'dalle', ar: Optional[str] = '1') -> list:
+    def process(self, prompt, model="dalle", ar: Optional[str] = None):
+        """
+        Основной метод для генерации изображений.
+        model: "dalle" или "gpt4o"
+        ar: optional int for aspect ratio. For example, 1 for square.
+        """
+        job = self.submit(prompt, model=model, ar=ar)
+        if job is None:
+            return []
+        return self.complete(job)
+
+
+class PipelineStats:
+    """
+    Статистика стадий submit/poll по куки файлам, для сравнения пропускной способности
+    при разной глубине конвейера (BING_INFLIGHT_DEPTH).
+
+    busy_time - сколько времени у куки было хотя бы одно задание в работе,
+    throughput = успешных заданий в час этого времени.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cookies: Dict[str, Dict[str, Any]] = {}
+
+    def _get(self, cookie: str) -> Dict[str, Any]:
+        if cookie not in self.cookies:
+            self.cookies[cookie] = {
+                "in_flight": 0, "max_in_flight": 0, "jobs": 0, "ok": 0,
+                "submit_time": 0.0, "poll_time": 0.0, "busy_time": 0.0, "busy_since": 0.0,
+            }
+        return self.cookies[cookie]
+
+    def started(self, cookie: str) -> None:
+        with self.lock:
+            stats = self._get(cookie)
+            if not stats['in_flight']:
+                stats['busy_since'] = time.time()
+            stats['in_flight'] += 1
+            stats['max_in_flight'] = max(stats['max_in_flight'], stats['in_flight'])
+
+    def finished(self, cookie: str, ok: bool, submit_time: float, poll_time: float) -> None:
+        with self.lock:
+            stats = self._get(cookie)
+            stats['in_flight'] -= 1
+            if not stats['in_flight']:
+                stats['busy_time'] += time.time() - stats['busy_since']
+            stats['jobs'] += 1
+            stats['ok'] += int(ok)
+            stats['submit_time'] += submit_time
+            stats['poll_time'] += poll_time
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self.lock:
+            now = time.time()
+            result = {}
+            for cookie, stats in self.cookies.items():
+                busy_time = stats['busy_time'] + (now - stats['busy_since'] if stats['in_flight'] else 0)
+                jobs = stats['jobs'] or 1
+                result[cookie] = {
+                    "in_flight": stats['in_flight'],
+                    "max_in_flight": stats['max_in_flight'],
+                    "jobs": stats['jobs'],
+                    "ok": stats['ok'],
+                    "avg_submit_time": round(stats['submit_time'] / jobs, 2),
+                    "avg_poll_time": round(stats['poll_time'] / jobs, 2),
+                    "busy_time": round(busy_time, 1),
+                    "ok_per_hour": round(stats['ok'] / busy_time * 3600, 1) if busy_time else 0,
+                }
+            return result
+
+
+PIPELINE_STATS = PipelineStats()
+
+
+def gen_images(prompt: str, model: str = 'dalle', ar: Optional[str] = '1',
+               submit_lock: Optional[threading.Lock] = None, client_id: str = '') -> list:
     '''
+    submit_lock - если задан то под ним выполняется только отправка задания,
+    опрос результатов идет уже без него и следующее задание может отправляться параллельно
+    client_id - клиент, только он получит результат этого задания после перезапуска
+
     ar = None - 1024x1024
     ar = 1 - 1024x1024
     ar = 2 - 1792x1024
@@ -233,8 +503,29 @@ def gen_images(prompt: str, model: str = 'dalle', ar: Optional[str] = '1') -> li
     #     ar = '2'
     # else:
     #     ar = '1'
-    brush = BingBrush(cookie='cookie.txt')
-    r = brush.process(prompt, model=model, ar=ar)
+    # если этот клиент отправил такое задание до перезапуска то забираем его результат
+    r = job_journal.take_result(prompt, model, ar, client_id)
+    if r is not None:
+        tracing.set_attr('journal_hit', True)
+    else:
+        cookie = rotate_cookie.CURRENT_COOKIE or 'cookie.txt'
+        PIPELINE_STATS.started(cookie)
+        submit_time = poll_time = 0.0
+        r = []
+        try:
+            start = time.time()
+            with submit_lock or contextlib.nullcontext():
+                tracing.add_span('submit_lock_wait', start, time.time() - start)
+                with tracing.span('submit', cookie=cookie):
+                    brush = BingBrush(cookie='cookie.txt')
+                    job = brush.submit(prompt, model=model, ar=ar, client_id=client_id)
+            submit_time = time.time() - start
+            if job is not None:
+                start = time.time()
+                r = brush.complete(job)
+                poll_time = time.time() - start
+        finally:
+            PIPELINE_STATS.finished(cookie, bool(r), submit_time, poll_time)
     cleaned_urls = [url.split('?')[0] if '?' in url else url for url in r]
     return cleaned_urls
 
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+# Роутер перед несколькими инстансами bing10api.
+# Берет список инстансов из cfg.MONITOR_INSTANCES (тот же что и у монитора),
+# опрашивает их /status и отправляет /bing* запросы на наименее загруженный живой инстанс.
+
+
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import requests
+from flask import Flask, Response, jsonify, request
+
+import cfg  # type: ignore
+import my_log
+from utils import async_run
+
+
+# как часто опрашивать /status инстансов, секунд
+STATUS_POLL_INTERVAL = getattr(cfg, 'ROUTER_STATUS_POLL_INTERVAL', 5)
+# сколько ждать ответа от /status
+STATUS_TIMEOUT = 3
+# сколько ждать ответа на генерацию (bing20 может рисовать очень долго)
+FORWARD_TIMEOUT = getattr(cfg, 'ROUTER_FORWARD_TIMEOUT', 60 * 60)
+# на скольких других инстансах повторять запрос после ошибки соединения, ответа 5xx или 404
+MAX_RETRIES = getattr(cfg, 'ROUTER_MAX_RETRIES', 1)
+# заголовки клиента которые передаются инстансу, по ним инстанс различает клиентов в очереди
+# (X-Admin-Token нужен чтобы инстанс принял X-Trace-Id)
+FORWARD_HEADERS = ('Content-Type', 'X-Api-Key', 'X-Client-Id', 'X-Trace-Id', 'X-Admin-Token')
+
+
+class Instance:
+    """Состояние одного инстанса с точки зрения роутера."""
+
+    def __init__(self, name: str, status_url: str):
+        self.name = name
+        self.status_url = status_url
+        # базовый адрес инстанса, http://host:port
+        self.base_url = status_url.rsplit('/status', 1)[0]
+        self.online = False
+        self.service_status = 'UNKNOWN'
+        # очередь по данным самого инстанса (active_requests из /status)
+        self.remote_queue = 0
+        # запросы которые роутер отправил и ответ на которые еще не получен
+        self.in_flight = 0
+        self.last_update = 0.0
+
+    @property
+    def healthy(self) -> bool:
+        return self.online and self.service_status == 'OK'
+
+    @property
+    def load(self) -> int:
+        # инстанс узнает о запросе только когда тот до него дойдет,
+        # поэтому берем максимум из того что видит он и что отправили мы
+        return max(self.remote_queue, self.in_flight)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "url": self.base_url,
+            "online": self.online,
+            "service_status": self.service_status,
+            "remote_queue": self.remote_queue,
+            "in_flight": self.in_flight,
+            "last_update": self.last_update,
+        }
+
+
+INSTANCES: List[Instance] = [Instance(x['name'], x['url']) for x in cfg.MONITOR_INSTANCES]
+INSTANCES_LOCK = threading.Lock()
+
+# пул соединений до инстансов
+SESSION = requests.Session()
+
+
+def update_instance(instance: Instance) -> None:
+    """Опрашивает /status одного инстанса и обновляет его состояние."""
+    try:
+        response = SESSION.get(instance.status_url, timeout=STATUS_TIMEOUT)
+        response.raise_for_status()
+        data = response.json()
+        with INSTANCES_LOCK:
+            instance.online = True
+            instance.service_status = data.get('service_status', 'UNKNOWN')
+            instance.remote_queue = int(data.get('active_requests', 0))
+            instance.last_update = time.time()
+    except (requests.exceptions.RequestException, ValueError):
+        with INSTANCES_LOCK:
+            instance.online = False
+            instance.last_update = time.time()
+
+
+@async_run
+def health_loop() -> None:
+    """Фоновый опрос всех инстансов."""
+    while True:
+        for instance in INSTANCES:
+            update_instance(instance)
+        time.sleep(STATUS_POLL_INTERVAL)
+
+
+def pick_instance(exclude: List[Instance], healthy_only: bool = False) -> Optional[Instance]:
+    """
+    Выбирает наименее загруженный живой инстанс и сразу резервирует для него слот.
+    Если живых не осталось то берет любой онлайн инстанс из тех что еще не пробовали,
+    статус мог устареть за время между опросами (кроме healthy_only).
+    """
+    with INSTANCES_LOCK:
+        candidates = [x for x in INSTANCES if x not in exclude and x.healthy]
+        if not candidates and not healthy_only:
+            candidates = [x for x in INSTANCES if x not in exclude and x.online]
+        if not candidates:
+            return None
+        instance = min(candidates, key=lambda x: (x.load, x.in_flight))
+        instance.in_flight += 1
+        return instance
+
+
+def release_instance(instance: Instance) -> None:
+    with INSTANCES_LOCK:
+        instance.in_flight -= 1
+
+
+# rest api #######################################################################
+
+
+FLASK_APP = Flask(__name__)
+
+
+def forward_headers() -> Dict[str, str]:
+    """
+    Заголовки для инстанса. Если клиент не прислал X-Client-Id то подставляется его адрес,
+    иначе инстанс видит всех клиентов с адреса роутера и считает их одним клиентом.
+    """
+    headers = {name: request.headers[name] for name in FORWARD_HEADERS if request.headers.get(name)}
+    headers.setdefault('Content-Type', 'application/json')
+    if 'X-Client-Id' not in headers and request.remote_addr:
+        headers['X-Client-Id'] = request.remote_addr
+    return headers
+
+
+def stream_response(instance: Instance, response: requests.Response) -> Response:
+    """
+    Отдает ответ инстанса клиенту по мере получения (/bing_batch?stream=true).
+    Слот инстанса освобождается когда ответ дочитан или клиент отключился.
+    """
+    def close() -> None:
+        response.close()
+        release_instance(instance)
+
+    result = Response(response.iter_content(chunk_size=None), status=response.status_code,
+                      content_type=response.headers.get('Content-Type'))
+    if response.headers.get('X-Trace-Id'):
+        result.headers['X-Trace-Id'] = response.headers['X-Trace-Id']
+    result.call_on_close(close)
+    return result
+
+
+@FLASK_APP.route('/<path:endpoint>', methods=['POST'])
+def forward_api(endpoint: str) -> Any:
+    """
+    Пересылает /bing* запрос на наименее загруженный живой инстанс.
+    При ответе 5xx или ошибке соединения пробует еще MAX_RETRIES других инстансов.
+    404 (картинок нет) инстанс отвечает на любую неудачу, в том числе из-за своих куки
+    (кончились, заблокированы, сервис выключен), поэтому его тоже повторяем, но только
+    на инстансе со статусом OK. Если повторять негде, клиент получает последний ответ.
+    """
+    if not endpoint.startswith('bing'):
+        return jsonify({"error": "Not found"}), 404
+
+    body = request.get_data()
+    headers = forward_headers()
+    url = endpoint
+    if request.query_string:
+        url += '?' + request.query_string.decode('latin-1')
+
+    tried: List[Instance] = []
+    last_error = "No healthy instances"
+    instance = pick_instance(tried)
+    while instance is not None:
+        tried.append(instance)
+        try:
+            response = SESSION.post(f'{instance.base_url}/{url}', data=body, headers=headers,
+                                    timeout=FORWARD_TIMEOUT, stream=True)
+        except requests.exceptions.RequestException as error:
+            release_instance(instance)
+            my_log.log2(f'bing_router:forward_api: {instance.name}: {error}')
+            last_error = str(error)
+            # сразу помечаем как недоступный, не дожидаясь следующего опроса
+            with INSTANCES_LOCK:
+                instance.online = False
+            instance = pick_instance(tried) if len(tried) <= MAX_RETRIES else None
+            continue
+
+        code = response.status_code
+        next_instance = None
+        if len(tried) <= MAX_RETRIES and (code >= 500 or code == 404):
+            next_instance = pick_instance(tried, healthy_only=code == 404)
+        if next_instance is None:
+            return stream_response(instance, response)
+
+        my_log.log2(f'bing_router:forward_api: {instance.name} returned {code}, retry on {next_instance.name}')
+        response.close()
+        release_instance(instance)
+        instance = next_instance
+
+    return jsonify({"error": last_error}), 503
+
+
+@FLASK_APP.route('/status', methods=['GET'])
+def status_api() -> Any:
+    """Состояние роутера и всех инстансов за ним."""
+    with INSTANCES_LOCK:
+        instances = [x.to_dict() for x in INSTANCES]
+    healthy = sum(1 for x in INSTANCES if x.healthy)
+    return jsonify({
+        "service_status": "OK" if healthy else "NO_HEALTHY_INSTANCES",
+        "healthy_instances": healthy,
+        "instances": instances,
+    }), 200
+
+
+@async_run
+def run_flask(addr: str = '127.0.0.1', port: int = 58790):
+    try:
+        FLASK_APP.run(debug=False, use_reloader=False, host=addr, port=port, threaded=True)
+    except Exception as error:
+        my_log.log2(f'tb:bing_router:run_flask: {error}')
+
+
+# rest api #######################################################################
+
+
+if __name__ == '__main__':
+    addr = getattr(cfg, 'ROUTER_ADDR', cfg.ADDR)
+    port = getattr(cfg, 'ROUTER_PORT', 58790)
+    health_loop()
+    run_flask(addr=addr, port=port)
+    my_log.log2(f'bing_router:run_flask: {addr}:{port} started')
+    while 1:
+        time.sleep(1)
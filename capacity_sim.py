@@ -0,0 +1,618 @@
+#!/usr/bin/env python3
+# Симулятор пропускной способности для подбора порогов без экспериментов на проде.
+#
+# Дискретно-событийная модель одного инстанса в модельном времени: поток запросов,
+# набор куки (у каждого своя доля удачных заданий, время рисования и "провалы" когда куки
+# какое-то время не работает совсем), очередь, отправка заданий строго по одной, опрос
+# результата раз в POLL_INTERVAL и пауза после задания. Решения принимает тот же код что
+# и в сервисе: cookie_policy.CookiePolicy (смена куки и выключение сервиса),
+# rotate_cookie.next_cookie (порядок смены куки) и scheduler.FairQueue (порядок очереди).
+#
+# Модель подбирается по истории:
+#   logs/debug_bing_api.log - удачные и неудачные попытки (те же признаки что в /status),
+#   logs/debug.log          - когда какой куки стал текущим (rotate_cookie: X -> cookie.txt),
+#   jobs.db                 - время рисования по куки (created -> finished) и сколько опрашивались
+#                             задания которые бинг принял, но не дорисовал,
+#   logs/traces.jsonl       - поток запросов, число повторов, модель и приоритет (interactive / bulk),
+#                             время отправки и опроса.
+# Чего нет в истории - берется из значений по умолчанию.
+#
+#   python capacity_sim.py --fit-only
+#   python capacity_sim.py --hours 24 --seeds 3 --grid max_fail=3,5,8 \
+#       --grid max_fail_for_terminate=10,20 --grid pause=0,2,4 --grid poll_interval=0.5,1,2 --out sim.json
+#
+# Для каждого набора параметров выводит пропускную способность, перцентили времени ответа
+# и впустую потраченные запросы к бингу (отправки без картинок и лишние опросы).
+
+
+import argparse
+import datetime
+import heapq
+import itertools
+import json
+import math
+import os
+import random
+import re
+import sqlite3
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import bing_genimg_v3
+import cookie_policy
+import job_journal
+import my_genimg
+import rotate_cookie
+import scheduler
+from utils import percentile
+
+
+LOG_TIME_FORMAT = '%d-%m-%Y %H:%M:%S'
+LOG_SEPARATOR = '=' * 80
+ROTATE_RE = re.compile(r'rotate_cookie: (cookie.*?\.txt) ->')
+# перерывы в потоке запросов длиннее этого считаются простоем сервиса, а не свойством нагрузки
+MAX_INTERARRIVAL = 60 * 60
+# по меньшему числу попыток долю удач и провалы куки не подобрать, берутся значения по умолчанию
+MIN_ATTEMPTS = 20
+# эндпоинты bing10api с приоритетом bulk, для трасс записанных до того как в них появился priority
+BULK_ENDPOINTS = ('/bing2', '/bing10', '/bing20')
+
+# модель по умолчанию, если в истории ничего нет
+DEFAULT_COOKIES = 5
+DEFAULT_SUCCESS = 0.9
+DEFAULT_OUTAGE_RATE = 0.02
+DEFAULT_OUTAGE_DURATIONS = [5 * 60, 30 * 60, 2 * 60 * 60]
+DEFAULT_RENDER = [10.0, 12.0, 15.0, 18.0, 20.0, 25.0, 30.0, 45.0]
+DEFAULT_SUBMIT = [0.8, 1.0, 1.2, 1.5, 2.5]
+DEFAULT_POLL_RTT = [0.2, 0.3, 0.4]
+DEFAULT_INTERARRIVAL = 30.0
+# доля неудач, при которых бинг принял задание, но не дорисовал его (остальные - отказ при отправке)
+DEFAULT_RENDER_FAIL_SHARE = 0.5
+# неудачное задание опрашивается до ошибки или до этого срока
+MAX_WAIT_TIME = {'dalle': bing_genimg_v3.DALLE_MAX_WAIT_TIME, 'gpt4o': bing_genimg_v3.GPT_MAX_WAIT_TIME}
+
+# параметры для --grid и их значения в сервисе
+PARAMS: Dict[str, float] = {
+    'max_fail': cookie_policy.MAX_COOKIE_FAIL,
+    'max_fail_for_terminate': cookie_policy.MAX_COOKIE_FAIL_FOR_TERMINATE,
+    'suspend_time': cookie_policy.SUSPEND_TIME_SET,
+    'pause': my_genimg.PAUSE_BETWEEN_REQUESTS,
+    'poll_interval': bing_genimg_v3.POLL_INTERVAL,
+    'inflight_depth': my_genimg.INFLIGHT_DEPTH,
+}
+
+
+class CookieModel:
+    """
+    Поведение одного куки: в обычном режиме задание удается с вероятностью success,
+    с вероятностью outage_rate на каждую попытку куки "ломается" на время из outage_durations
+    (бан, кончились бусты и т.п.) и все задания в это время неудачные.
+    """
+
+    def __init__(self, name: str, success: float = DEFAULT_SUCCESS, outage_rate: float = DEFAULT_OUTAGE_RATE,
+                 outage_durations: Optional[List[float]] = None, render: Optional[List[float]] = None,
+                 attempts: int = 0):
+        self.name = name
+        self.success = success
+        self.outage_rate = outage_rate
+        self.outage_durations = outage_durations or list(DEFAULT_OUTAGE_DURATIONS)
+        self.render = render or list(DEFAULT_RENDER)
+        self.attempts = attempts
+        # состояние во время симуляции
+        self.blocked_until = 0.0
+
+    def attempt(self, now: float, rng: random.Random) -> bool:
+        if now < self.blocked_until:
+            return False
+        if rng.random() < self.outage_rate:
+            self.blocked_until = now + rng.choice(self.outage_durations)
+            return False
+        return rng.random() < self.success
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "success": round(self.success, 4),
+            "outage_rate": round(self.outage_rate, 4),
+            "outage_p50": percentile(self.outage_durations, 50),
+            "render_p50": percentile(self.render, 50),
+            "render_p95": percentile(self.render, 95),
+            "attempts": self.attempts,
+        }
+
+
+class Inputs:
+    """Все входные данные модели: куки, нагрузка и времена отдельных стадий."""
+
+    def __init__(self):
+        self.cookies: Dict[str, CookieModel] = {}
+        self.interarrival: List[float] = []
+        # число повторов, приоритет и модель запросов, по одному на запрос
+        self.iterations: List[int] = [1]
+        self.priorities: List[int] = [scheduler.PRIORITY_INTERACTIVE]
+        self.models: List[str] = ['dalle']
+        self.submit: List[float] = list(DEFAULT_SUBMIT)
+        self.poll_rtt: List[float] = list(DEFAULT_POLL_RTT)
+        # неудачи: доля принятых но не дорисованных заданий и сколько они опрашивались, по моделям
+        self.render_fail_share = DEFAULT_RENDER_FAIL_SHARE
+        self.render_fail: Dict[str, List[float]] = {}
+        self.sources: List[str] = []
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "sources": self.sources,
+            "cookies": {name: x.to_dict() for name, x in self.cookies.items()},
+            "requests_per_hour": round(3600 / (sum(self.interarrival) / len(self.interarrival)), 1)
+            if self.interarrival else round(3600 / DEFAULT_INTERARRIVAL, 1),
+            "iterations_p50": percentile(self.iterations, 50),
+            "bulk_share": round(self.priorities.count(scheduler.PRIORITY_BULK) / len(self.priorities), 4),
+            "submit_p50": percentile(self.submit, 50),
+            "poll_rtt_p50": percentile(self.poll_rtt, 50),
+            "render_fail_share": round(self.render_fail_share, 4),
+            "render_fail_p50": {x: percentile(self.render_fail_times(x), 50) for x in MAX_WAIT_TIME},
+        }
+
+    def render_fail_times(self, model: str) -> List[float]:
+        """Сколько опрашивается не дорисованное задание, по умолчанию - до max_wait_time."""
+        return self.render_fail.get(model) or [MAX_WAIT_TIME.get(model, bing_genimg_v3.DALLE_MAX_WAIT_TIME)]
+
+
+def parse_log_time(text: str) -> Optional[float]:
+    try:
+        return datetime.datetime.strptime(text.strip(), LOG_TIME_FORMAT).timestamp()
+    except ValueError:
+        return None
+
+
+def read_log_entries(log_file: str) -> List[Tuple[float, str]]:
+    """Записи my_log.log2: (время, текст)."""
+    if not os.path.exists(log_file):
+        return []
+    with open(log_file, encoding='utf-8', errors='replace') as f:
+        content = f.read()
+    entries = []
+    for entry in content.split(LOG_SEPARATOR):
+        lines = entry.strip().split('\n')
+        ts = parse_log_time(lines[0]) if lines else None
+        if ts is not None:
+            entries.append((ts, '\n'.join(lines[2:])))
+    return entries
+
+
+def read_attempts(log_file: str) -> List[Tuple[float, bool]]:
+    """Удачные и неудачные попытки, по тем же признакам что bing10api.get_last_attempts."""
+    attempts = []
+    for ts, message in read_log_entries(log_file):
+        if 'bing_genimg_v3:process: [' in message and 'http' in message:
+            attempts.append((ts, True))
+        elif ('bing_genimg_v3:process: []' in message or '==> Error occurs' in message
+              or 'Traceback (most recent call last):' in message or 'Exception:' in message):
+            attempts.append((ts, False))
+    return attempts
+
+
+def read_rotations(log_file: str) -> List[Tuple[float, str]]:
+    """Когда какой куки стал текущим."""
+    rotations = []
+    for ts, message in read_log_entries(log_file):
+        match = ROTATE_RE.search(message)
+        if match and '-> cookie.txt' in message:
+            rotations.append((ts, match.group(1)))
+    return rotations
+
+
+def fit_cookie(name: str, attempts: List[Tuple[float, bool]]) -> CookieModel:
+    """
+    Доля удач и провалы одного куки. Две и больше неудачи подряд считаются провалом,
+    его длительность - от первой неудачи до следующей удачи на этом куки (или до последней
+    неудачи если куки сменили раньше). Одиночные неудачи - обычный шум.
+    Если попыток меньше MIN_ATTEMPTS - модель по умолчанию, по паре удачных попыток вышло бы success=1.0.
+    """
+    if len(attempts) < MIN_ATTEMPTS:
+        return CookieModel(name, attempts=len(attempts))
+    runs: List[List[float]] = []
+    run: List[float] = []
+    durations: List[float] = []
+    for ts, ok in attempts:
+        if not ok:
+            run.append(ts)
+            continue
+        if len(run) >= 2:
+            durations.append(ts - run[0])
+        runs.append(run)
+        run = []
+    if len(run) >= 2:
+        durations.append(run[-1] - run[0])
+    runs.append(run)
+
+    outages = [x for x in runs if len(x) >= 2]
+    isolated = sum(1 for x in runs if len(x) == 1)
+    normal = len(attempts) - sum(len(x) for x in outages)
+    return CookieModel(
+        name,
+        success=1 - isolated / normal if normal else DEFAULT_SUCCESS,
+        outage_rate=len(outages) / normal if normal else DEFAULT_OUTAGE_RATE,
+        outage_durations=[x for x in durations if x > 0] or None,
+        attempts=len(attempts),
+    )
+
+
+def fit_inputs(logs_dir: str = 'logs', jobs_db: str = job_journal.DB_PATH,
+               traces: str = os.path.join('logs', 'traces.jsonl')) -> Inputs:
+    """Подбирает модель по логам, журналу заданий и трассам."""
+    inputs = Inputs()
+
+    # попытки по куки: каждая попытка относится к куки который был текущим в это время
+    attempts = read_attempts(os.path.join(logs_dir, 'debug_bing_api.log'))
+    rotations = read_rotations(os.path.join(logs_dir, 'debug.log'))
+    by_cookie: Dict[str, List[Tuple[float, bool]]] = {}
+    if attempts:
+        inputs.sources.append('attempts')
+        index = 0
+        current = rotations[0][1] if rotations else 'cookie.txt'
+        for ts, ok in attempts:
+            while index < len(rotations) and rotations[index][0] <= ts:
+                current = rotations[index][1]
+                index += 1
+            by_cookie.setdefault(current, []).append((ts, ok))
+    for name in sorted(set(by_cookie) | {x[1] for x in rotations}):
+        inputs.cookies[name] = fit_cookie(name, by_cookie.get(name, []))
+
+    # время рисования по куки
+    if os.path.exists(jobs_db):
+        conn = sqlite3.connect(f'file:{jobs_db}?mode=ro', uri=True)
+        try:
+            rows = conn.execute('SELECT cookie, finished - created FROM jobs WHERE state IN (?, ?)'
+                                ' AND finished IS NOT NULL',
+                                (job_journal.STATE_DONE, job_journal.STATE_CONSUMED)).fetchall()
+            failed = conn.execute('SELECT model, created, finished - created FROM jobs WHERE state = ?'
+                                  ' AND finished IS NOT NULL', (job_journal.STATE_FAILED,)).fetchall()
+            first = conn.execute('SELECT MIN(created) FROM jobs').fetchone()[0]
+        except sqlite3.Error:
+            rows, failed, first = [], [], None
+        conn.close()
+        if rows or failed:
+            inputs.sources.append('jobs')
+        renders: Dict[str, List[float]] = {}
+        for cookie, seconds in rows:
+            if seconds is not None and seconds >= 0:
+                renders.setdefault(cookie or '', []).append(seconds)
+        everything = [x for values in renders.values() for x in values]
+        for name, model in inputs.cookies.items():
+            model.render = renders.get(name) or everything or model.render
+
+        # в журнал попадают только задания которые бинг принял, так что не дорисованные задания
+        # из журнала среди всех неудач из лога за то же время - доля неудач с опросом до срока
+        for model_name, _, seconds in failed:
+            if seconds is not None and seconds >= 0:
+                inputs.render_fail.setdefault(model_name, []).append(seconds)
+        failures = sum(1 for ts, ok in attempts if not ok and first is not None and ts >= first)
+        if failed and failures:
+            inputs.render_fail_share = min(1.0, len(failed) / failures)
+
+    # нагрузка и времена стадий из трасс
+    arrivals: List[float] = []
+    if os.path.exists(traces):
+        iterations: List[int] = []
+        priorities: List[int] = []
+        models: List[str] = []
+        submit: List[float] = []
+        poll_rtt: List[float] = []
+        with open(traces, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                for span in record.get('spans', []):
+                    attrs = span.get('attrs', {})
+                    if span['parent_id'] == 0 and span['name'] in ('request', 'webhook_job'):
+                        arrivals.append(span['start'])
+                        iterations.append(int(attrs.get('iterations', 1)) or 1)
+                        models.append(attrs.get('model', 'dalle'))
+                        if 'priority' in attrs:
+                            priorities.append(int(attrs['priority']))
+                        elif attrs.get('endpoint') in BULK_ENDPOINTS:
+                            priorities.append(scheduler.PRIORITY_BULK)
+                        else:
+                            priorities.append(scheduler.PRIORITY_INTERACTIVE)
+                    elif span['name'] == 'submit':
+                        submit.append(span['duration_ms'] / 1000)
+                    elif span['name'] == 'poll' and attrs.get('requests'):
+                        poll_rtt.append(span['duration_ms'] / 1000 / attrs['requests'])
+        if arrivals:
+            inputs.sources.append('traces')
+            inputs.iterations = iterations
+            inputs.priorities = priorities
+            inputs.models = models
+        inputs.submit = submit or inputs.submit
+        inputs.poll_rtt = poll_rtt or inputs.poll_rtt
+    if not arrivals:
+        # без трасс каждая попытка считается отдельным запросом
+        arrivals = [x[0] for x in attempts]
+
+    arrivals.sort()
+    inputs.interarrival = [b - a for a, b in zip(arrivals, arrivals[1:]) if 0 < b - a <= MAX_INTERARRIVAL]
+
+    if not inputs.cookies:
+        inputs.cookies = {f'cookie{i}.txt': CookieModel(f'cookie{i}.txt') for i in range(1, DEFAULT_COOKIES + 1)}
+    return inputs
+
+
+class Request:
+    def __init__(self, client_id: str, iterations: int, start: float,
+                 priority: int = scheduler.PRIORITY_INTERACTIVE, model: str = 'dalle'):
+        self.client_id = client_id
+        self.iterations = iterations
+        self.priority = priority
+        self.model = model
+        self.start = start
+        self.done = 0
+        self.enqueued = 0.0
+
+
+class Simulation:
+    """
+    Один прогон модели. Время модельное, события в куче (время, номер, функция).
+    Каждый прогон со своим состоянием куки и своим генератором случайных чисел.
+    """
+
+    def __init__(self, inputs: Inputs, params: Dict[str, float], seed: int = 0,
+                 duration: float = 24 * 3600, clients: int = 1, rate: float = 0.0):
+        self.inputs = inputs
+        self.params = params
+        self.duration = duration
+        self.clients = clients
+        # запросов в секунду, 0 - поток из истории
+        self.rate = rate
+        self.rng = random.Random(seed)
+        self.now = 0.0
+        self.events: List[Tuple[float, int, Callable[..., None], Tuple[Any, ...]]] = []
+        self.counter = itertools.count()
+
+        self.cookies = {name: CookieModel(name, x.success, x.outage_rate, x.outage_durations, x.render)
+                        for name, x in inputs.cookies.items()}
+        self.files: List[str] = []
+        self.current = ''
+        self.policy = cookie_policy.CookiePolicy(
+            max_fail=int(params['max_fail']), max_fail_for_terminate=int(params['max_fail_for_terminate']),
+            suspend_time=params['suspend_time'], rotate=self.rotate, clock=lambda: self.now,
+            on_suspend=self.suspended)
+        self.rotate()
+
+        self.queue = scheduler.FairQueue()
+        self.depth = max(1, int(params['inflight_depth']))
+        self.running = 0
+        self.per_client: Dict[str, int] = {}
+        # до какого времени занята отправка заданий (SUBMIT_LOCK)
+        self.submit_free_at = 0.0
+
+        self.stats: Dict[str, float] = {x: 0 for x in (
+            'requests', 'ok', 'failed', 'rejected_suspended', 'rejected_busy',
+            'images', 'submits', 'wasted_submits', 'polls', 'wasted_polls', 'suspended_seconds')}
+        self.latencies: List[float] = []
+        # сколько ждал ответа клиент, которому картинок так и не досталось
+        self.failed_latencies: List[float] = []
+        # время в очереди по классам приоритета
+        self.waits: Dict[int, List[float]] = {x: [] for x in scheduler.PRIORITY_NAMES}
+
+    def at(self, when: float, func: Callable[..., None], *args: Any) -> None:
+        heapq.heappush(self.events, (when, next(self.counter), func, args))
+
+    def rotate(self) -> None:
+        self.current = rotate_cookie.next_cookie(self.files, lambda: list(self.cookies), states={},
+                                                 log=lambda x: None)
+
+    def suspended(self) -> None:
+        self.stats['suspended_seconds'] += min(self.params['suspend_time'], self.duration - self.now)
+
+    def next_interarrival(self) -> float:
+        if self.rate:
+            return self.rng.expovariate(self.rate)
+        if self.inputs.interarrival:
+            return self.rng.choice(self.inputs.interarrival)
+        return self.rng.expovariate(1 / DEFAULT_INTERARRIVAL)
+
+    def arrival(self) -> None:
+        next_time = self.now + self.next_interarrival()
+        if next_time < self.duration:
+            self.at(next_time, self.arrival)
+
+        self.stats['requests'] += 1
+        client_id = f'client{self.rng.randrange(self.clients)}'
+        state, _ = self.policy.check()
+        if state != cookie_policy.ACTIVE:
+            self.stats['rejected_suspended'] += 1
+            return
+        if self.per_client.get(client_id, 0) >= scheduler.MAX_PER_CLIENT:
+            self.stats['rejected_busy'] += 1
+            return
+        self.per_client[client_id] = self.per_client.get(client_id, 0) + 1
+        # повторы, приоритет и модель берутся вместе, /bing10 это и 10 повторов и bulk
+        index = self.rng.randrange(len(self.inputs.iterations))
+        self.start_iteration(Request(client_id, self.inputs.iterations[index], self.now,
+                                     self.inputs.priorities[index], self.inputs.models[index]))
+
+    def start_iteration(self, request: Request) -> None:
+        request.enqueued = self.now
+        self.queue.push(request, request.client_id, request.priority)
+        self.dispatch()
+
+    def dispatch(self) -> None:
+        while self.running < self.depth and len(self.queue):
+            request = self.queue.pop()
+            self.running += 1
+            self.waits.setdefault(request.priority, []).append(self.now - request.enqueued)
+            self.submit(request)
+
+    def submit(self, request: Request) -> None:
+        """
+        Отправка (по одной), потом рисование и опрос раз в poll_interval.
+        Неудача двух видов: бинг не принял задание (нет Location, после rt=4 еще попытка rt=3)
+        или принял, но не дорисовал - тогда опрос идет до ошибки или до max_wait_time модели.
+        """
+        start = max(self.now, self.submit_free_at)
+        submitted = start + self.rng.choice(self.inputs.submit)
+        self.submit_free_at = submitted
+        self.stats['submits'] += 1
+
+        cookie = self.cookies[self.current]
+        if cookie.attempt(start, self.rng):
+            self.poll(request, submitted, submitted + self.rng.choice(cookie.render), True)
+            return
+
+        self.stats['wasted_submits'] += 1
+        if self.rng.random() < self.inputs.render_fail_share:
+            self.poll(request, submitted, submitted + self.rng.choice(self.inputs.render_fail_times(request.model)),
+                      False)
+            return
+        rejected = submitted + self.rng.choice(self.inputs.submit)
+        self.submit_free_at = rejected
+        self.stats['submits'] += 1
+        self.stats['wasted_submits'] += 1
+        self.at(rejected, self.iteration_done, request, False)
+
+    def poll(self, request: Request, submitted: float, ready: float, ok: bool) -> None:
+        """Опрос раз в poll_interval пока задание не дорисуется (или не кончится срок)."""
+        rtt = self.rng.choice(self.inputs.poll_rtt)
+        step = rtt + self.params['poll_interval']
+        # первый опрос сразу после отправки, потом через poll_interval после ответа
+        polls = max(0, math.ceil((ready - submitted) / step)) + 1
+        self.stats['polls'] += polls
+        if not ok:
+            self.stats['wasted_polls'] += polls
+        self.at(submitted + (polls - 1) * step + rtt, self.iteration_done, request, ok)
+
+    def iteration_done(self, request: Request, ok: bool) -> None:
+        self.running -= 1
+        self.dispatch()
+        if not ok:
+            self.finish(request)
+            return
+        request.done += 1
+        self.stats['images'] += 1
+        # пауза после удачного задания, и перед следующим повтором и перед ответом
+        if request.done < request.iterations:
+            self.at(self.now + self.params['pause'], self.start_iteration, request)
+        else:
+            self.at(self.now + self.params['pause'], self.finish, request)
+
+    def finish(self, request: Request) -> None:
+        self.per_client[request.client_id] -= 1
+        if request.done:
+            self.policy.success()
+            self.stats['ok'] += 1
+            self.latencies.append(self.now - request.start)
+        else:
+            self.policy.failure()
+            self.stats['failed'] += 1
+            self.failed_latencies.append(self.now - request.start)
+
+    def run(self) -> 'Simulation':
+        self.at(0.0, self.arrival)
+        while self.events:
+            self.now, _, func, args = heapq.heappop(self.events)
+            func(*args)
+        return self
+
+
+def summarize(runs: List[Simulation]) -> Dict[str, Any]:
+    """Сводка по нескольким прогоном одного набора параметров (счетчики суммируются)."""
+    hours = sum(x.duration for x in runs) / 3600
+    total = {key: sum(x.stats[key] for x in runs) for key in runs[0].stats}
+    latencies = [y for x in runs for y in x.latencies]
+    failed_latencies = [y for x in runs for y in x.failed_latencies]
+    waits = {priority: [z for x in runs for z in x.waits.get(priority, [])] for priority in scheduler.PRIORITY_NAMES}
+    all_waits = [y for x in waits.values() for y in x]
+    result: Dict[str, Any] = {
+        "ok_per_hour": round(total['ok'] / hours, 2),
+        "images_per_hour": round(total['images'] / hours, 2),
+        "success_share": round(total['ok'] / total['requests'], 4) if total['requests'] else None,
+        "latency_p50": round(percentile(latencies, 50), 2),
+        "latency_p95": round(percentile(latencies, 95), 2),
+        "latency_p99": round(percentile(latencies, 99), 2),
+        "failed_latency_p95": round(percentile(failed_latencies, 95), 2),
+        "queue_wait_p95": round(percentile(all_waits, 95), 2),
+        "wasted_submits": int(total['wasted_submits']),
+        "wasted_share": round(total['wasted_submits'] / total['submits'], 4) if total['submits'] else None,
+        "wasted_polls": int(total['wasted_polls']),
+        "extra_polls_per_image": round((total['polls'] - total['images']) / total['images'], 2)
+        if total['images'] else None,
+        "rejected_suspended": int(total['rejected_suspended']),
+        "rejected_busy": int(total['rejected_busy']),
+        "rotations": sum(x.policy.rotations for x in runs),
+        "suspensions": sum(x.policy.suspensions for x in runs),
+        "suspended_share": round(total['suspended_seconds'] / (hours * 3600), 4),
+        "requests": int(total['requests']),
+    }
+    # /bing и /bing10 ждут в очереди по-разному, bulk пропускает interactive вперед
+    for priority, name in scheduler.PRIORITY_NAMES.items():
+        result[f'queue_wait_{name}_p50'] = round(percentile(waits[priority], 50), 2)
+        result[f'queue_wait_{name}_p95'] = round(percentile(waits[priority], 95), 2)
+    return result
+
+
+def parse_grid(items: List[str]) -> Dict[str, List[float]]:
+    grid: Dict[str, List[float]] = {}
+    for item in items:
+        name, _, values = item.partition('=')
+        if name not in PARAMS or not values:
+            raise SystemExit(f'bad --grid {item!r}, expected one of {", ".join(PARAMS)} as name=v1,v2')
+        grid[name] = [float(x) for x in values.split(',')]
+    return grid
+
+
+def run_grid(inputs: Inputs, grid: Dict[str, List[float]], seeds: int = 3, duration: float = 24 * 3600,
+             clients: int = 1, rate: float = 0.0) -> List[Dict[str, Any]]:
+    """Прогоняет все сочетания параметров из grid (остальные как в сервисе), seeds прогонов на каждое."""
+    names = list(grid)
+    results = []
+    for values in itertools.product(*(grid[x] for x in names)):
+        params = dict(PARAMS, **dict(zip(names, values)))
+        runs = [Simulation(inputs, params, seed, duration, clients, rate).run() for seed in range(seeds)]
+        results.append({"params": {x: params[x] for x in names}, **summarize(runs)})
+    results.sort(key=lambda x: (-x['ok_per_hour'], x['wasted_submits'], x['latency_p95']))
+    return results
+
+
+def print_results(results: List[Dict[str, Any]]) -> None:
+    columns = ('ok_per_hour', 'latency_p50', 'latency_p95', 'latency_p99', 'failed_latency_p95', 'wasted_submits',
+               'wasted_polls', 'extra_polls_per_image', 'rejected_suspended', 'suspended_share',
+               'queue_wait_interactive_p95', 'queue_wait_bulk_p95')
+    names = [','.join(f'{k}={v:g}' for k, v in x['params'].items()) or 'current' for x in results]
+    width = max([len('params')] + [len(x) for x in names])
+    print(f'{"params":<{width}} ' + ' '.join(f'{x:>{len(x)}}' for x in columns))
+    for name, item in zip(names, results):
+        print(f'{name:<{width}} ' + ' '.join(f'{str(item[x]):>{len(x)}}' for x in columns))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Capacity simulator for cookie rotation and suspend thresholds')
+    parser.add_argument('--logs', default='logs', help='folder with debug.log and debug_bing_api.log')
+    parser.add_argument('--jobs', default=job_journal.DB_PATH, help='job journal database')
+    parser.add_argument('--traces', default=os.path.join('logs', 'traces.jsonl'))
+    parser.add_argument('--fit-only', action='store_true', help='only print the fitted model')
+    parser.add_argument('--grid', action='append', default=[],
+                        help=f'name=v1,v2,... to try, names: {", ".join(PARAMS)}')
+    parser.add_argument('--hours', type=float, default=24, help='simulated time per run')
+    parser.add_argument('--seeds', type=int, default=3, help='runs per parameter set')
+    parser.add_argument('--clients', type=int, default=1)
+    parser.add_argument('--rate', type=float, default=0.0,
+                        help='requests per minute (Poisson), default - replay recorded inter-arrival times')
+    parser.add_argument('--out', help='write the report to this JSON file')
+    args = parser.parse_args()
+
+    inputs = fit_inputs(args.logs, args.jobs, args.traces)
+    if args.fit_only:
+        print(json.dumps(inputs.to_dict(), indent=2, ensure_ascii=False))
+        return
+
+    results = run_grid(inputs, parse_grid(args.grid), seeds=args.seeds, duration=args.hours * 3600,
+                       clients=args.clients, rate=args.rate / 60)
+    print_results(results)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump({"inputs": inputs.to_dict(), "defaults": PARAMS, "results": results},
+                      f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
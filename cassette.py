@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# Запись и воспроизведение обменов с бингом (кассеты) для офлайн тестов и бенчмарков.
+#
+# Запись: в cfg.py BING_CASSETTE_DIR = 'cassettes' - каждый BingBrush пишет свою кассету
+# (отправка, редирект, все опросы) в отдельный json файл. Куки и прочие заголовки запроса
+# не сохраняются, из заголовков ответа остаются только Location и Content-Type.
+#
+# Воспроизведение: BingBrush(cookie='', adapter=ReplayAdapter('cassettes/xxx.json', speed=0))
+
+
+import io
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+
+# заголовки ответа которые нужны BingBrush, остальное не пишем (там куки)
+KEEP_HEADERS = ('Location', 'Content-Type')
+
+
+def relative_url(url: str) -> str:
+    """Путь и query без схемы и хоста, чтобы кассета не зависела от BING_BASE_URL."""
+    parts = urlsplit(url)
+    return parts.path + ('?' + parts.query if parts.query else '')
+
+
+class RecordingAdapter(HTTPAdapter):
+    """Обычный транспорт, который дополнительно пишет все запросы и ответы в кассету."""
+
+    def __init__(self, cassette_dir: str, **kwargs):
+        super().__init__(**kwargs)
+        os.makedirs(cassette_dir, exist_ok=True)
+        self.path = os.path.join(cassette_dir, f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:8]}.json')
+        self.started = time.time()
+        self.interactions: List[Dict[str, Any]] = []
+        self.lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        start = time.time()
+        response = super().send(request, **kwargs)
+        # читаем тело целиком, дальше requests отдаст его из памяти
+        body = response.content
+        with self.lock:
+            self.interactions.append({
+                "t": round(start - self.started, 3),
+                "elapsed": round(time.time() - start, 3),
+                "method": request.method,
+                "url": relative_url(request.url),
+                "status": response.status_code,
+                "headers": {k: response.headers[k] for k in KEEP_HEADERS if k in response.headers},
+                "body": body.decode(response.encoding or 'utf-8', errors='replace'),
+            })
+            self.save()
+        return response
+
+    def save(self) -> None:
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({"recorded": self.started, "interactions": self.interactions}, f, ensure_ascii=False)
+
+
+def load(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)['interactions']
+
+
+class ReplayAdapter(HTTPAdapter):
+    """
+    Отдает ответы из кассеты вместо похода в сеть.
+
+    Запросы сопоставляются по методу и пути (без query), по порядку записи. Если запросов
+    к какому-то пути больше чем в кассете (например опросов), повторяется последний ответ.
+    speed - множитель времени ответа сервера: 1 - как при записи, 0 - без задержек.
+    """
+
+    def __init__(self, path: str, speed: float = 0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.speed = speed
+        self.by_key: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        for interaction in load(path):
+            key = (interaction['method'], urlsplit(interaction['url']).path)
+            self.by_key.setdefault(key, []).append(interaction)
+        self.positions: Dict[Tuple[str, str], int] = {}
+        self.requests_count = 0
+        self.lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        key = (request.method, urlsplit(request.url).path)
+        with self.lock:
+            self.requests_count += 1
+            interactions = self.by_key.get(key)
+            if interactions:
+                position = self.positions.get(key, 0)
+                interaction = interactions[min(position, len(interactions) - 1)]
+                self.positions[key] = position + 1
+            else:
+                interaction = None
+
+        if interaction is None:
+            interaction = {"status": 404, "headers": {}, "body": "cassette: no recorded interaction", "elapsed": 0}
+        if self.speed:
+            time.sleep(interaction.get('elapsed', 0) * self.speed)
+
+        body = interaction['body'].encode('utf-8')
+        response = requests.Response()
+        response.status_code = interaction['status']
+        response.headers = CaseInsensitiveDict(interaction['headers'])
+        response.raw = io.BytesIO(body)
+        response._content = body
+        response._content_consumed = True
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        response.reason = 'OK' if response.status_code < 400 else 'ERROR'
+        return response
+
+    def close(self):
+        pass
+
+
+if __name__ == '__main__':
+    pass
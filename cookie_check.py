@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# Проверка всех куки файлов до того как на них попадут запросы пользователей.
+# Без нее мертвый куки обнаруживается только после MAX_COOKIE_FAIL неудачных запросов.
+# Все cookie*.txt проверяются параллельно дешевым запросом (страница /images/create,
+# без отправки задания) при запуске и потом периодически в фоне. Результат - состояние
+# каждого файла (valid / expired / boost_exhausted) в rotate_cookie.COOKIE_STATES,
+# просроченные файлы rotate_cookie пропускает.
+
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict
+
+from requests.adapters import HTTPAdapter
+
+import bing_genimg_v3
+import cfg  # type: ignore
+import my_log
+import rotate_cookie
+
+
+# как часто перепроверять куки, секунд
+CHECK_INTERVAL = getattr(cfg, 'COOKIE_CHECK_INTERVAL', 30 * 60)
+WORKERS = 8
+TIMEOUT = 20
+
+# {имя файла: {"state": ..., "boosts": ..., "checked": время проверки, "error": ...}}
+STATUS: Dict[str, Dict[str, Any]] = {}
+STATUS_LOCK = threading.Lock()
+
+
+def check_cookie(name: str) -> Dict[str, Any]:
+    """Проверяет один куки файл."""
+    try:
+        # обычный транспорт, чтобы проверки не писались в кассеты
+        brush = bing_genimg_v3.BingBrush(cookie=name, adapter=HTTPAdapter())
+        result = brush.check_account(timeout=TIMEOUT)
+        result["error"] = ''
+    except Exception as error:
+        result = {"state": rotate_cookie.COOKIE_UNKNOWN, "boosts": None, "error": str(error)}
+    result["checked"] = time.time()
+    return result
+
+
+def check_all() -> Dict[str, Dict[str, Any]]:
+    """Параллельно проверяет все cookie*.txt и обновляет их состояния."""
+    files = rotate_cookie.find_cookie_files()
+    if not files:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(WORKERS, len(files)), thread_name_prefix='cookie_check') as pool:
+        results = dict(zip(files, pool.map(check_cookie, files)))
+
+    with STATUS_LOCK:
+        for name, result in results.items():
+            STATUS[name] = result
+            # сетевые ошибки не повод менять прежнее состояние
+            if result["state"] != rotate_cookie.COOKIE_UNKNOWN:
+                rotate_cookie.COOKIE_STATES[name] = result["state"]
+        # удаленные файлы
+        for name in set(STATUS) - set(files):
+            STATUS.pop(name, None)
+            rotate_cookie.COOKIE_STATES.pop(name, None)
+
+    summary = ', '.join(f'{name}: {result["state"]}' for name, result in results.items())
+    my_log.log2(f'cookie_check: {summary}')
+    return results
+
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    """Копия STATUS для /status."""
+    with STATUS_LOCK:
+        return {name: dict(result) for name, result in STATUS.items()}
+
+
+if __name__ == '__main__':
+    for name, result in check_all().items():
+        print(name, result)
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# Реакция сервиса на неудачные запросы к бингу:
+#   MAX_COOKIE_FAIL неудач подряд - сменить куки,
+#   MAX_COOKIE_FAIL_FOR_TERMINATE неудач подряд - выключить сервис на SUSPEND_TIME_SET секунд.
+# Вынесено из bing10api в класс, чтобы ту же самую логику можно было гонять в симуляторе
+# (capacity_sim.py) с модельным временем и модельной сменой куки.
+
+
+import threading
+import time
+from typing import Callable, Optional, Tuple
+
+import cfg  # type: ignore
+
+
+# сколько раз подряд должно быть фейлов что бы принять меры - сменить куки
+MAX_COOKIE_FAIL = getattr(cfg, 'MAX_COOKIE_FAIL', 5)
+# сколько раз подряд должно быть фейлов что бы принять меры - выключить сервис
+MAX_COOKIE_FAIL_FOR_TERMINATE = getattr(cfg, 'MAX_COOKIE_FAIL_FOR_TERMINATE', 10)
+# время в секундах до следующего запуска сервиса (12 часов)
+SUSPEND_TIME_SET = getattr(cfg, 'SUSPEND_TIME_SET', 12 * 60 * 60)
+
+# результаты CookiePolicy.check()
+ACTIVE = 'active'
+SUSPENDED = 'suspended'            # сервис выключен, еще не время включаться
+JUST_SUSPENDED = 'just_suspended'  # сервис выключился прямо сейчас
+
+
+class CookiePolicy:
+    """
+    Счетчики неудач и время выключения сервиса.
+
+    rotate - сменить куки, clock - текущее время (time.time или часы симулятора),
+    on_suspend / on_resume - вызываются когда сервис выключается и снова включается.
+    Как и раньше, сервис выключается не сразу после последней неудачи, а на следующем
+    запросе (check()), и включается тоже на первом запросе после SUSPEND_TIME_SET.
+    """
+
+    def __init__(self, max_fail: int = MAX_COOKIE_FAIL,
+                 max_fail_for_terminate: int = MAX_COOKIE_FAIL_FOR_TERMINATE,
+                 suspend_time: float = SUSPEND_TIME_SET,
+                 rotate: Callable[[], None] = lambda: None,
+                 clock: Callable[[], float] = time.time,
+                 on_suspend: Optional[Callable[[], None]] = None,
+                 on_resume: Optional[Callable[[], None]] = None):
+        self.max_fail = max_fail
+        self.max_fail_for_terminate = max_fail_for_terminate
+        self.suspend_time = suspend_time
+        self.rotate = rotate
+        self.clock = clock
+        self.on_suspend = on_suspend
+        self.on_resume = on_resume
+        # неудач подряд на текущем куки и всего
+        self.fail = 0
+        self.total_fail = 0
+        # время когда можно снова запустить сервис, 0 - не выключен
+        self.suspend_until = 0.0
+        self.rotations = 0
+        self.suspensions = 0
+        self.lock = threading.RLock()
+
+    def check(self) -> Tuple[str, float]:
+        """
+        Вызывается перед каждым запросом. Возвращает (ACTIVE | SUSPENDED | JUST_SUSPENDED,
+        сколько секунд осталось до включения).
+        """
+        with self.lock:
+            if self.total_fail < self.max_fail_for_terminate:
+                return ACTIVE, 0.0
+            now = self.clock()
+            if self.suspend_until and self.suspend_until > now:
+                return SUSPENDED, self.suspend_until - now
+            if not self.suspend_until:
+                self.suspend_until = now + self.suspend_time
+                self.suspensions += 1
+                if self.on_suspend is not None:
+                    self.on_suspend()
+                return JUST_SUSPENDED, self.suspend_time
+            # время вышло, включаемся
+            self.suspend_until = 0.0
+            self.total_fail = 0
+            self.fail = 0
+            if self.on_resume is not None:
+                self.on_resume()
+            return ACTIVE, 0.0
+
+    def success(self) -> None:
+        with self.lock:
+            self.fail = 0
+            self.total_fail = 0
+
+    def failure(self) -> bool:
+        """Запрос не дал картинок. Возвращает True если после этого сменили куки."""
+        with self.lock:
+            self.fail += 1
+            self.total_fail += 1
+            if self.fail < self.max_fail:
+                return False
+            self.fail = 0
+            self.rotations += 1
+            self.rotate()
+            return True
+
+    def cookie_changed(self) -> None:
+        """Куки сменили снаружи (проверка куки, /reload_cookies), счетчик текущего куки с нуля."""
+        with self.lock:
+            self.fail = 0
+
+    def reset(self) -> None:
+        with self.lock:
+            self.fail = 0
+            self.total_fail = 0
+
+    def seconds_to_restart(self) -> float:
+        """Сколько осталось до включения, 0 если сервис не выключен."""
+        with self.lock:
+            if self.total_fail >= self.max_fail_for_terminate and self.suspend_until > self.clock():
+                return self.suspend_until - self.clock()
+            return 0.0
+
+
+if __name__ == '__main__':
+    pass
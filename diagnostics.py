@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# Диагностика работающего инстанса без перезапуска (для /admin/* эндпоинтов).
+#   profile()       - семплирующий профайлер по всем потокам, результат в формате collapsed stacks
+#                     (flamegraph.pl, speedscope, inferno), ограничен по времени
+#   thread_dump()   - стеки всех потоков, чего они ждут и кто держит слоты очереди к бингу
+#   memory_report() - память процесса и, если включен tracemalloc, самые большие места выделения
+#
+# Все функции кроме tracemalloc_start() / tracemalloc_stop() только читают состояние процесса.
+# Профайлер и tracemalloc замедляют работу, поэтому профайлер работает ограниченное время
+# и только один за раз, а tracemalloc включается и выключается отдельно (POST /admin/memory).
+
+
+import gc
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+
+MAX_PROFILE_SECONDS = 60
+MIN_PROFILE_INTERVAL = 0.001
+# сколько кадров tracemalloc хранит для каждого выделения
+TRACEMALLOC_FRAMES = 10
+
+PROFILE_LOCK = threading.Lock()
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# предыдущий снимок памяти для сравнения
+LAST_SNAPSHOT: Optional[tracemalloc.Snapshot] = None
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def frame_label(frame) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})'
+
+
+def profile(seconds: float = 10, interval: float = 0.005) -> str:
+    """
+    Каждые interval секунд снимает стеки всех потоков (кроме своего) и считает
+    одинаковые стеки. Возвращает строки "поток;внешний;...;внутренний количество".
+    Бросает ProfilerBusy если профайлер уже запущен.
+    """
+    seconds = min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+    interval = max(interval, MIN_PROFILE_INTERVAL)
+    if not PROFILE_LOCK.acquire(blocking=False):
+        raise ProfilerBusy('Profiler is already running')
+    try:
+        me = threading.get_ident()
+        stacks: Counter = Counter()
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            names = {x.ident: x.name for x in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                labels = []
+                while frame is not None:
+                    code = frame.f_code
+                    labels.append(f'{code.co_name} ({os.path.basename(code.co_filename)})')
+                    frame = frame.f_back
+                labels.append(names.get(thread_id, str(thread_id)))
+                stacks[';'.join(reversed(labels))] += 1
+            time.sleep(interval)
+        return '\n'.join(f'{stack} {count}' for stack, count in stacks.most_common()) + '\n'
+    finally:
+        PROFILE_LOCK.release()
+
+
+def waiting_on(frame) -> str:
+    """
+    Грубо определяет чего ждет поток: самый внутренний кадр и ближайший кадр из кода проекта,
+    например "wait (threading.py:355) <- slot (scheduler.py:140)".
+    """
+    inner = frame_label(frame)
+    current = frame
+    while current is not None:
+        if os.path.dirname(os.path.abspath(current.f_code.co_filename)) == BASE_DIR:
+            if current is frame:
+                return inner
+            return f'{inner} <- {frame_label(current)}'
+        current = current.f_back
+    return inner
+
+
+def thread_dump(resources: Optional[Dict[int, Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+    """
+    Стеки всех потоков. resources - {thread_id: описание} для потоков которые держат
+    или ждут общие ресурсы (слоты очереди к бингу и т.п.), добавляется в поле "resources".
+    """
+    resources = resources or {}
+    threads = {x.ident: x for x in threading.enumerate()}
+    result = []
+    for thread_id, frame in sys._current_frames().items():
+        thread = threads.get(thread_id)
+        stack = []
+        current = frame
+        while current is not None:
+            stack.append(frame_label(current))
+            current = current.f_back
+        item = {
+            "id": thread_id,
+            "name": thread.name if thread else str(thread_id),
+            "daemon": thread.daemon if thread else None,
+            "waiting_on": waiting_on(frame),
+            "stack": stack,
+        }
+        if thread_id in resources:
+            item["resources"] = resources[thread_id]
+        result.append(item)
+    result.sort(key=lambda x: ('resources' not in x, x['name']))
+    return result
+
+
+def rss_bytes() -> int:
+    """Резидентная память процесса, 0 если не удалось узнать."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == 'darwin' else usage * 1024
+    except Exception:
+        return 0
+
+
+def tracemalloc_start() -> None:
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+
+
+def tracemalloc_stop() -> None:
+    global LAST_SNAPSHOT
+    LAST_SNAPSHOT = None
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def memory_report(top: int = 20) -> Dict[str, Any]:
+    """
+    Память процесса, счетчики сборщика мусора и, если tracemalloc включен,
+    top мест с наибольшим объемом выделенной памяти и рост с прошлого отчета.
+    """
+    global LAST_SNAPSHOT
+    report: Dict[str, Any] = {
+        "rss_bytes": rss_bytes(),
+        "gc_counts": gc.get_count(),
+        "gc_collections": [x['collections'] for x in gc.get_stats()],
+        "threads": threading.active_count(),
+        "tracemalloc": tracemalloc.is_tracing(),
+    }
+    if not tracemalloc.is_tracing():
+        return report
+
+    current, peak = tracemalloc.get_traced_memory()
+    report["traced_bytes"] = current
+    report["traced_peak_bytes"] = peak
+
+    snapshot = tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    ))
+    report["top"] = [
+        {"where": str(x.traceback[0]), "size_bytes": x.size, "count": x.count}
+        for x in snapshot.statistics('lineno')[:top]
+    ]
+    if LAST_SNAPSHOT is not None:
+        report["growth"] = [
+            {"where": str(x.traceback[0]), "size_diff_bytes": x.size_diff, "count_diff": x.count_diff}
+            for x in snapshot.compare_to(LAST_SNAPSHOT, 'lineno')[:top]
+        ]
+    LAST_SNAPSHOT = snapshot
+    return report
+
+
+if __name__ == '__main__':
+    pass
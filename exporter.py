@@ -0,0 +1,147 @@
+# exporter.py
+# HTTP endpoint for the headless monitor (monitor.py --serve).
+#
+# The monitor polls every instance once per refresh and keeps the aggregated fleet view
+# (instances, failed prompts, log queue, ping) in a FleetExporter. Scrapers read that
+# cached view, so any number of clients costs one round of /status requests per refresh
+# instead of one per client and instance.
+#
+#   GET /fleet    - the fleet view as JSON (also GET /)
+#   GET /metrics  - the same data in Prometheus text format
+
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+PREFIX = "bing_fleet"
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class FleetExporter:
+    """Holds the latest fleet snapshot, updated by the collector and read by HTTP handlers."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snapshot: Dict[str, Any] = {}
+
+    def update(self, snapshot: Dict[str, Any]) -> None:
+        with self.lock:
+            self.snapshot = snapshot
+
+    def get(self) -> Dict[str, Any]:
+        with self.lock:
+            return self.snapshot
+
+
+def escape_label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def prometheus_text(snapshot: Dict[str, Any]) -> str:
+    """Renders a fleet snapshot in the Prometheus text exposition format. Missing values are skipped."""
+    # name -> (type, help, [(labels, value)])
+    metrics: Dict[str, Tuple[str, str, List[Tuple[Dict[str, Any], float]]]] = {}
+
+    def add(name: str, kind: str, help_text: str, labels: Dict[str, Any], value: Optional[float]) -> None:
+        entry = metrics.setdefault(name, (kind, help_text, []))
+        if value is not None:
+            entry[2].append((labels, float(value)))
+
+    for instance in snapshot.get("instances", []):
+        labels = {"instance": instance["name"]}
+        online = instance["online"]
+        add("instance_up", "gauge", "1 if the instance answered /status", labels, 1 if online else 0)
+        if not online:
+            continue
+        add("instance_ok", "gauge", "1 if service_status is OK", labels,
+            1 if instance.get("service_status") == "OK" else 0)
+        add("instance_suspended", "gauge", "1 if the instance is suspended after too many failures", labels,
+            1 if instance.get("service_status") == "SUSPENDED" else 0)
+        add("cookie_fail_count", "gauge", "Failures with the current cookie", labels,
+            instance.get("cookie_fail_count"))
+        add("cookie_fail_max", "gauge", "Failures before the cookie is rotated", labels,
+            instance.get("max_fail_for_rotate"))
+        add("total_fail_count", "gauge", "Failures counted towards suspension", labels,
+            instance.get("total_fail_count"))
+        add("total_fail_max", "gauge", "Failures before the instance is suspended", labels,
+            instance.get("max_fail_for_suspend"))
+        add("active_requests", "gauge", "Requests in progress", labels, instance.get("active_requests"))
+        add("recent_success_ratio", "gauge", "Share of successful attempts among the last attempts", labels,
+            instance.get("success_rate"))
+
+    add("failed_prompts", "gauge", "Distinct recently failed prompts across the fleet", {},
+        len(snapshot.get("failed_prompts", [])))
+
+    queue = snapshot.get("queue")
+    if queue is not None and queue["size"] != -1:
+        add("queue_size", "gauge", "Rows in the log queue", {}, queue["size"])
+        add("queue_rate", "gauge", "Log queue growth, rows per second (negative when draining)", {}, queue["rate"])
+
+    for target, stats in (snapshot.get("ping") or {}).items():
+        labels = {"target": target, "method": stats["method"]}
+        if stats["status"] == "unknown":
+            continue
+        add("ping_up", "gauge", "1 if the last probe got a reply", labels, 1 if stats["status"] == "online" else 0)
+        add("ping_latency_ms", "gauge", "Last ping round trip time", labels, stats["latency"])
+        for quantile in (50, 95, 99):
+            add("ping_latency_quantile_ms", "gauge", "Ping round trip time over the rolling window",
+                dict(labels, quantile=str(quantile / 100)), stats[f"p{quantile}"])
+        add("ping_loss_ratio", "gauge", "Lost probes over the rolling window", labels, stats["loss"])
+        add("ping_jitter_ms", "gauge", "Mean difference between consecutive round trip times", labels,
+            stats["jitter"])
+
+    add("snapshot_timestamp_seconds", "gauge", "When the fleet view was collected", {},
+        snapshot.get("timestamp"))
+
+    lines = []
+    for name, (kind, help_text, samples) in metrics.items():
+        if not samples:
+            continue
+        lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+        for labels, value in samples:
+            label_str = ",".join(f'{key}="{escape_label(val)}"' for key, val in labels.items())
+            lines.append(f"{PREFIX}_{name}{{{label_str}}} {value:.15g}" if label_str else f"{PREFIX}_{name} {value:.15g}")
+    return "\n".join(lines) + "\n"
+
+
+def make_handler(exporter: FleetExporter):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            path = self.path.split("?", 1)[0].rstrip("/")
+            snapshot = exporter.get()
+            if not snapshot:
+                self.reply(503, "application/json", b'{"error": "no data yet"}')
+            elif path in ("", "/fleet"):
+                self.reply(200, "application/json", json.dumps(snapshot, ensure_ascii=False).encode("utf-8"))
+            elif path == "/metrics":
+                self.reply(200, PROMETHEUS_CONTENT_TYPE, prometheus_text(snapshot).encode("utf-8"))
+            else:
+                self.reply(404, "application/json", b'{"error": "not found"}')
+
+        def reply(self, code: int, content_type: str, body: bytes) -> None:
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            # scrapers hit this every few seconds, keep stderr quiet
+            pass
+
+    return Handler
+
+
+def serve(exporter: FleetExporter, addr: str, port: int) -> ThreadingHTTPServer:
+    """Starts the HTTP server on a daemon thread and returns it."""
+    server = ThreadingHTTPServer((addr, port), make_handler(exporter))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="exporter", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    pass
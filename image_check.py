@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# Проверка ссылок на готовые картинки до отдачи клиенту.
+# Иногда бинг отдает битые ссылки или заглушки вместо картинок, клиенты получают мусор
+# и отправляют запрос заново. Здесь все ссылки проверяются параллельно (HEAD, а если сервер
+# не сообщил размер - GET первого байта) через общий с image_store пул соединений:
+# код ответа, тип содержимого и минимальный размер. На всю проверку дается ограниченное время,
+# проверенные ссылки запоминаются.
+# Проверки идут в своем пуле потоков, чтобы не занимать потоки скачивания image_store.
+
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
+
+import cfg  # type: ignore
+import image_store
+import my_log
+
+
+ENABLED = getattr(cfg, 'IMAGE_VALIDATE', True)
+# заглушки у бинга маленькие, настоящие картинки от 50кб
+MIN_BYTES = getattr(cfg, 'IMAGE_VALIDATE_MIN_BYTES', 5000)
+# сколько секунд можно потратить на проверку всех картинок одного задания
+TIME_BUDGET = getattr(cfg, 'IMAGE_VALIDATE_TIME_BUDGET', 5)
+# таймаут одного запроса (HEAD или GET), не больше остатка времени на проверку
+CALL_TIMEOUT = getattr(cfg, 'IMAGE_VALIDATE_CALL_TIMEOUT', 1.5)
+# сколько секунд помнить хорошие ссылки
+CACHE_TTL = getattr(cfg, 'IMAGE_VALIDATE_CACHE_TTL', 3600)
+CACHE_MAX = 10000
+WORKERS = 8
+
+POOL = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='image_check')
+
+# {url: до какого времени считать проверенной}
+CACHE: Dict[str, float] = {}
+CACHE_LOCK = threading.Lock()
+
+
+def remaining(deadline: float) -> float:
+    """Таймаут для следующего запроса: остаток времени до deadline (time.monotonic()), не больше CALL_TIMEOUT."""
+    return min(CALL_TIMEOUT, deadline - time.monotonic())
+
+
+def probe(url: str, deadline: float) -> Optional[bool]:
+    """
+    Проверяет одну ссылку. True - картинка, False - точно не картинка,
+    None - не удалось проверить (сеть или кончилось время), такие ссылки не выбрасываются.
+    Каждый запрос получает только остаток времени до deadline, так что поток пула
+    освобождается вместе с validate(), а не через несколько бюджетов.
+    """
+    try:
+        timeout = remaining(deadline)
+        if timeout <= 0:
+            return None
+        response = image_store.SESSION.head(url, timeout=timeout, allow_redirects=True)
+        if response.status_code == 405:
+            response = None
+        elif response.status_code != 200:
+            return False
+        size = int(response.headers.get('Content-Length', 0)) if response is not None else 0
+        content_type = response.headers.get('Content-Type', '') if response is not None else ''
+
+        if not size:
+            # HEAD не сказал размер, спрашиваем первый байт, размер будет в Content-Range
+            timeout = remaining(deadline)
+            if timeout <= 0:
+                return None
+            with image_store.SESSION.get(url, timeout=timeout, stream=True, headers={'Range': 'bytes=0-0'}) as response:
+                if response.status_code not in (200, 206):
+                    return False
+                content_type = response.headers.get('Content-Type', '')
+                content_range = response.headers.get('Content-Range', '')
+                if '/' in content_range and content_range.rsplit('/', 1)[1].isdigit():
+                    size = int(content_range.rsplit('/', 1)[1])
+                else:
+                    size = int(response.headers.get('Content-Length', 0))
+
+        if not content_type.startswith('image/'):
+            return False
+        if size and size < MIN_BYTES:
+            return False
+        return True
+    except Exception as error:
+        my_log.log_bing_api(f'image_check:probe: {url} {error}')
+        return None
+
+
+def validate(urls: List[str], budget: float = TIME_BUDGET) -> Tuple[List[str], List[str]]:
+    """
+    Параллельно проверяет ссылки, возвращает (хорошие, плохие) в исходном порядке.
+    Ссылки которые не успели или не смогли проверить считаются хорошими.
+    """
+    if not ENABLED or not urls:
+        return urls, []
+
+    now = time.time()
+    with CACHE_LOCK:
+        unchecked = [x for x in urls if CACHE.get(x, 0) <= now]
+    deadline = time.monotonic() + budget
+    futures = {url: POOL.submit(probe, url, deadline) for url in unchecked}
+    if futures:
+        wait(list(futures.values()), timeout=budget)
+
+    good, bad = [], []
+    for url in urls:
+        future = futures.get(url)
+        if future is None:
+            good.append(url)
+            continue
+        result = future.result() if future.done() else None
+        if result is False:
+            bad.append(url)
+        else:
+            good.append(url)
+            if result:
+                with CACHE_LOCK:
+                    CACHE[url] = now + CACHE_TTL
+
+    with CACHE_LOCK:
+        if len(CACHE) > CACHE_MAX:
+            for url in [x for x, until in CACHE.items() if until <= now]:
+                del CACHE[url]
+            if len(CACHE) > CACHE_MAX:
+                CACHE.clear()
+
+    return good, bad
+
+
+if __name__ == '__main__':
+    pass
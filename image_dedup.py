@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# Поиск почти одинаковых картинок среди результатов нескольких повторов.
+# /bing10 и /bing20 убирают только одинаковые ссылки, а бинг часто рисует на разных
+# повторах визуально одно и то же. Тут считаются перцептивные хеши (pHash) картинок
+# в пуле потоков и сравниваются векторно по расстоянию Хэмминга.
+#
+# Нужны numpy и Pillow, без них модуль выключен (AVAILABLE = False).
+
+
+import io
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional
+
+import cfg  # type: ignore
+import image_store
+import my_log
+
+try:
+    import numpy as np
+    from PIL import Image
+    AVAILABLE = True
+except ImportError:
+    AVAILABLE = False
+
+
+# картинки с расстоянием между хешами не больше этого считаются одинаковыми (из 64 бит)
+MAX_DISTANCE = getattr(cfg, 'IMAGE_DEDUP_MAX_DISTANCE', 10)
+WORKERS = 4
+DOWNLOAD_TIMEOUT = 30
+# сколько всего ждать хеши в distinct() / groups_list(), потом отдаются картинки без сравнения
+DEDUP_TIMEOUT = getattr(cfg, 'IMAGE_DEDUP_TIMEOUT', 30)
+
+HASH_SIZE = 8
+IMG_SIZE = 32
+
+POOL = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='image_dedup')
+
+
+def _dct_matrix(n: int):
+    """Матрица DCT-II, dct(x) = D @ x."""
+    k = np.arange(n).reshape(-1, 1)
+    i = np.arange(n).reshape(1, -1)
+    d = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    d[0] /= np.sqrt(2.0)
+    return d
+
+
+DCT = _dct_matrix(IMG_SIZE) if AVAILABLE else None
+
+
+def phash(data: bytes) -> int:
+    """64-битный перцептивный хеш картинки."""
+    image = Image.open(io.BytesIO(data)).convert('L').resize((IMG_SIZE, IMG_SIZE), Image.LANCZOS)
+    pixels = np.asarray(image, dtype=np.float64)
+    dct = DCT @ pixels @ DCT.T
+    low = dct[:HASH_SIZE, :HASH_SIZE].flatten()
+    # постоянная составляющая не несет информации о форме
+    median = np.median(low[1:])
+    bits = low > median
+    return int(np.packbits(bits).view('>u8')[0])
+
+
+def image_hash(url: str, use_store: bool = False) -> Optional[int]:
+    """
+    Скачивает картинку и считает ее хеш. use_store - скачать через image_store,
+    тогда картинка заодно попадет в локальное хранилище и второй раз качать не придется.
+    """
+    try:
+        if use_store:
+            digest = image_store.download(url)
+            path = image_store.acquire(digest) if digest else None
+            if path is None:
+                return None
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            finally:
+                image_store.release(digest)
+        else:
+            response = image_store.SESSION.get(url, timeout=DOWNLOAD_TIMEOUT)
+            if response.status_code != 200:
+                return None
+            data = response.content
+        return phash(data)
+    except Exception as error:
+        my_log.log_bing_api(f'image_dedup:image_hash: {url} {error}')
+        return None
+
+
+def hamming(hashes, value: int):
+    """Расстояния Хэмминга от value до каждого хеша из массива uint64."""
+    xor = hashes ^ np.uint64(value)
+    return np.unpackbits(xor.view(np.uint8)).reshape(-1, 64).sum(axis=1)
+
+
+class NearDupFilter:
+    """
+    Группирует почти одинаковые картинки.
+
+    add() сразу отправляет новые ссылки считать хеши в пул и не ждет,
+    distinct_count(wait=False) учитывает только уже посчитанные, чтобы решить
+    можно ли остановить повторы пораньше, не задерживая следующий повтор.
+    Ссылки разбираются строго в порядке добавления, первая картинка группы - ее представитель.
+    Картинки для которых не удалось посчитать хеш считаются уникальными.
+    """
+
+    def __init__(self, max_distance: int = MAX_DISTANCE, use_store: bool = False):
+        self.max_distance = max_distance
+        self.use_store = use_store
+        self.futures: 'OrderedDict[str, Future]' = OrderedDict()
+        self.processed = 0
+        self.rep_hashes = np.zeros(0, dtype=np.uint64)
+        self.rep_urls: List[str] = []
+        self.groups: Dict[str, List[str]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def add(self, urls: List[str]) -> None:
+        with self.lock:
+            for url in urls:
+                if url not in self.futures:
+                    self.futures[url] = POOL.submit(image_hash, url, self.use_store)
+
+    def _collect(self, wait: bool) -> None:
+        with self.lock:
+            items = list(self.futures.items())[self.processed:]
+            for url, future in items:
+                if not wait and not future.done():
+                    break
+                try:
+                    value = future.result()
+                except Exception:
+                    value = None
+                self._place(url, value)
+                self.processed += 1
+
+    def _place(self, url: str, value: Optional[int]) -> None:
+        if value is not None and len(self.rep_hashes):
+            distances = hamming(self.rep_hashes, value)
+            best = int(distances.argmin())
+            if distances[best] <= self.max_distance:
+                self.groups[self.rep_urls[best]].append(url)
+                return
+        self.groups[url] = [url]
+        if value is not None:
+            self.rep_hashes = np.append(self.rep_hashes, np.uint64(value))
+            self.rep_urls.append(url)
+
+    def distinct_count(self, wait: bool = False) -> int:
+        self._collect(wait)
+        return len(self.groups)
+
+    def _wait(self, timeout: float) -> bool:
+        """Ждет все хеши не дольше timeout, False если не дождались."""
+        with self.lock:
+            futures = list(self.futures.values())[self.processed:]
+        _, not_done = wait(futures, timeout=timeout)
+        if not_done:
+            my_log.log_bing_api(f'image_dedup: {len(not_done)} of {len(self.futures)} hashes not ready '
+                                f'after {timeout}s, images are not deduplicated')
+            return False
+        self._collect(True)
+        return True
+
+    def distinct(self, timeout: float = DEDUP_TIMEOUT) -> List[str]:
+        """
+        Представители групп, по одной картинке из каждой.
+        Если хеши не посчитались за timeout (медленный хост картинок) - все картинки как есть.
+        """
+        if not self._wait(timeout):
+            return list(self.futures)
+        return list(self.groups)
+
+    def groups_list(self, timeout: float = DEDUP_TIMEOUT) -> List[List[str]]:
+        if not self._wait(timeout):
+            return [[x] for x in self.futures]
+        return [list(x) for x in self.groups.values()]
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# Локальные копии готовых картинок.
+# Ссылки бинга th/id со временем протухают, а боты скачивают одну и ту же картинку заново
+# при каждом повторном использовании. Здесь картинки скачиваются параллельно через общий
+# пул соединений, потоком пишутся на диск и хранятся по sha256 содержимого (одинаковые
+# картинки хранятся один раз). Отдаются через /img/<hash>, размер хранилища ограничен,
+# давно не использованные файлы удаляются первыми (LRU).
+
+
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import cfg  # type: ignore
+import my_log
+
+
+# включить зеркалирование для всех запросов (иначе только если в запросе "mirror": true)
+ENABLED = getattr(cfg, 'IMAGE_MIRROR', False)
+STORE_DIR = getattr(cfg, 'IMAGE_STORE_DIR', 'images')
+MAX_STORE_BYTES = getattr(cfg, 'IMAGE_STORE_MAX_BYTES', 2 * 1024 * 1024 * 1024)
+# адрес по которому клиенты видят сервис, например https://example.com/bingapi, по умолчанию относительные ссылки
+PUBLIC_URL = getattr(cfg, 'IMAGE_STORE_PUBLIC_URL', '').rstrip('/')
+
+WORKERS = 8
+DOWNLOAD_TIMEOUT = 30
+CHUNK_SIZE = 64 * 1024
+# больше этого не бывает, что-то не то
+MAX_IMAGE_BYTES = 30 * 1024 * 1024
+# сколько последних скачанных ссылок помнить
+MAX_URL_CACHE = getattr(cfg, 'IMAGE_STORE_MAX_URLS', 100000)
+
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=WORKERS))
+SESSION.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=WORKERS))
+SESSION.headers['user-agent'] = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                                 '(KHTML, like Gecko) Chrome/132.0.0.0 Safari/537.36')
+POOL = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='image_store')
+
+LOCK = threading.Lock()
+# {hash: размер файла}, от давно использованных к недавним
+INDEX: 'OrderedDict[str, int]' = OrderedDict()
+TOTAL_BYTES = 0
+INDEX_LOADED = False
+# какие ссылки уже скачаны, {url: hash}, от давно скачанных к недавним, не больше MAX_URL_CACHE
+URL_CACHE: 'OrderedDict[str, str]' = OrderedDict()
+# обратно, {hash: ссылки}, чтобы evict() забывал ссылки на удаленные файлы
+HASH_URLS: Dict[str, Set[str]] = {}
+# файлы которые сейчас читаются (отдаются через /img), {hash: сколько раз}, evict их пропускает
+READERS: Dict[str, int] = {}
+
+# сигнатуры форматов для Content-Type при отдаче
+MAGIC = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG', 'image/png'),
+    (b'GIF8', 'image/gif'),
+)
+
+
+def path_for(digest: str) -> str:
+    return os.path.join(STORE_DIR, digest[:2], digest)
+
+
+def load_index() -> None:
+    """Читает содержимое хранилища с диска, порядок LRU по времени изменения файлов."""
+    global INDEX_LOADED, TOTAL_BYTES
+    with LOCK:
+        if INDEX_LOADED:
+            return
+        files = []
+        if os.path.isdir(STORE_DIR):
+            for root, _, names in os.walk(STORE_DIR):
+                for name in names:
+                    if len(name) != 64:
+                        # недокачанные временные файлы
+                        if name.startswith('tmp-'):
+                            os.remove(os.path.join(root, name))
+                        continue
+                    stat = os.stat(os.path.join(root, name))
+                    files.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(files):
+            INDEX[name] = size
+            TOTAL_BYTES += size
+        INDEX_LOADED = True
+
+
+def touch(digest: str) -> bool:
+    """Отмечает файл как недавно использованный. False если его нет в хранилище."""
+    with LOCK:
+        if digest not in INDEX:
+            return False
+        INDEX.move_to_end(digest)
+    try:
+        os.utime(path_for(digest))
+    except OSError:
+        pass
+    return True
+
+
+def evict() -> None:
+    """
+    Удаляет самые давно использованные файлы пока хранилище больше лимита.
+    Файлы которые сейчас читаются пропускаются, их удалит следующий evict().
+    """
+    global TOTAL_BYTES
+    with LOCK:
+        excess = TOTAL_BYTES - MAX_STORE_BYTES
+        if excess <= 0:
+            return
+        victims = []
+        for digest, size in INDEX.items():
+            if excess <= 0:
+                break
+            if READERS.get(digest):
+                continue
+            victims.append(digest)
+            excess -= size
+        for digest in victims:
+            TOTAL_BYTES -= INDEX.pop(digest)
+            for url in HASH_URLS.pop(digest, ()):
+                URL_CACHE.pop(url, None)
+            try:
+                os.remove(path_for(digest))
+            except OSError:
+                pass
+
+
+def remember_url(url: str, digest: str) -> None:
+    """Запоминает что ссылка скачана в digest. Вызывать под LOCK."""
+    forget_url(url)
+    URL_CACHE[url] = digest
+    HASH_URLS.setdefault(digest, set()).add(url)
+    while len(URL_CACHE) > MAX_URL_CACHE:
+        forget_url(next(iter(URL_CACHE)))
+
+
+def forget_url(url: str) -> None:
+    """Вызывать под LOCK."""
+    digest = URL_CACHE.pop(url, None)
+    if digest is not None and digest in HASH_URLS:
+        HASH_URLS[digest].discard(url)
+        if not HASH_URLS[digest]:
+            del HASH_URLS[digest]
+
+
+def download(url: str) -> Optional[str]:
+    """Скачивает картинку потоком на диск, возвращает ее sha256 или None."""
+    global TOTAL_BYTES
+    load_index()
+
+    with LOCK:
+        cached = URL_CACHE.get(url)
+        if cached is not None and cached not in INDEX:
+            # файл уже вытеснен, качаем заново
+            forget_url(url)
+            cached = None
+    if cached is not None and touch(cached):
+        return cached
+
+    os.makedirs(STORE_DIR, exist_ok=True)
+    tmp_path = os.path.join(STORE_DIR, f'tmp-{uuid.uuid4().hex}')
+    try:
+        with SESSION.get(url, timeout=DOWNLOAD_TIMEOUT, stream=True) as response:
+            if response.status_code != 200 or not response.headers.get('Content-Type', '').startswith('image/'):
+                return None
+            sha = hashlib.sha256()
+            size = 0
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > MAX_IMAGE_BYTES:
+                        return None
+                    sha.update(chunk)
+                    f.write(chunk)
+        digest = sha.hexdigest()
+
+        path = path_for(digest)
+        with LOCK:
+            if digest in INDEX:
+                # такая картинка уже есть
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+                INDEX[digest] = size
+                TOTAL_BYTES += size
+            remember_url(url, digest)
+        touch(digest)
+        evict()
+        return digest
+    except Exception as error:
+        my_log.log_bing_api(f'image_store:download: {url} {error}')
+        return None
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def mirror(urls: List[str], timeout: float = 60) -> Dict[str, str]:
+    """Параллельно скачивает картинки, возвращает {url: hash} для скачанных."""
+    start = time.time()
+    futures = {url: POOL.submit(download, url) for url in urls}
+    result = {}
+    for url, future in futures.items():
+        try:
+            digest = future.result(timeout=max(0.0, timeout - (time.time() - start)))
+        except Exception:
+            digest = None
+        if digest:
+            result[url] = digest
+    return result
+
+
+def local_url(digest: str) -> str:
+    return f'{PUBLIC_URL}/img/{digest}'
+
+
+def acquire(digest: str) -> Optional[str]:
+    """
+    Путь к файлу картинки для чтения или None если такой нет.
+    Пока не вызван release(digest) файл не удаляется при вытеснении.
+    """
+    load_index()
+    if len(digest) != 64 or any(c not in '0123456789abcdef' for c in digest):
+        return None
+    with LOCK:
+        if digest not in INDEX:
+            return None
+        INDEX.move_to_end(digest)
+        READERS[digest] = READERS.get(digest, 0) + 1
+    path = path_for(digest)
+    try:
+        os.utime(path)
+    except OSError:
+        # файл удалили мимо хранилища
+        release(digest)
+        return None
+    return path
+
+
+def release(digest: str) -> None:
+    """Файл из acquire() больше не читается."""
+    with LOCK:
+        READERS[digest] -= 1
+        if not READERS[digest]:
+            del READERS[digest]
+
+
+def guess_mimetype(path: str) -> str:
+    with open(path, 'rb') as f:
+        head = f.read(16)
+    for magic, mimetype in MAGIC:
+        if head.startswith(magic):
+            return mimetype
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'application/octet-stream'
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+# Журнал заданий отправленных в бинг (SQLite WAL).
+# Если процесс перезапустился пока бинг рисовал, после старта опрос результатов
+# продолжается по сохраненному request_id, а повторный запрос того же клиента с тем же
+# промптом получает эти картинки вместо новой отправки в бинг.
+
+
+import json
+import os
+import threading
+import time
+import traceback
+from typing import Any, Dict, List, Optional
+
+import cfg  # type: ignore
+import my_log
+from utils import async_run, open_sqlite_wal
+
+
+DB_PATH = getattr(cfg, 'JOB_JOURNAL_PATH', 'jobs.db')
+# сколько хранить завершенные задания, секунд
+KEEP_FINISHED = 24 * 60 * 60
+# как часто чистить старые задания, секунд
+PRUNE_INTERVAL = 60 * 60
+
+# состояния задания
+STATE_POLLING = 'polling'    # отправлено в бинг, ждем картинки
+STATE_DONE = 'done'          # дорисовано после перезапуска, ждет клиента
+STATE_CONSUMED = 'consumed'  # результат отдан клиенту
+STATE_FAILED = 'failed'
+STATE_EXPIRED = 'expired'    # не успели дождаться до перезапуска
+
+LOCK = threading.Lock()
+CONN = None
+# когда последний раз чистили журнал
+LAST_PRUNE = 0.0
+
+# задания которые сейчас дорисовываются после перезапуска, {job_id: Event}
+RESUMED: Dict[int, threading.Event] = {}
+
+
+def get_conn():
+    global CONN
+    if CONN is None:
+        CONN = open_sqlite_wal(DB_PATH)
+        CONN.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                prompt TEXT NOT NULL,
+                model TEXT NOT NULL,
+                ar TEXT,
+                cookie TEXT,
+                redirect_url TEXT NOT NULL,
+                request_id TEXT NOT NULL,
+                url_encoded_prompt TEXT NOT NULL,
+                created REAL NOT NULL,
+                deadline REAL NOT NULL,
+                finished REAL,
+                state TEXT NOT NULL,
+                result TEXT,
+                client_id TEXT
+            )''')
+        # журнал от старой версии, без client_id
+        if 'client_id' not in [x[1] for x in CONN.execute('PRAGMA table_info(jobs)')]:
+            CONN.execute('ALTER TABLE jobs ADD COLUMN client_id TEXT')
+        CONN.execute('CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, prompt)')
+        CONN.commit()
+    return CONN
+
+
+def _prune(conn, now: float) -> None:
+    """Удаляет старые завершенные задания. Вызывать под LOCK."""
+    global LAST_PRUNE
+    conn.execute('DELETE FROM jobs WHERE created < ? AND state != ?', (now - KEEP_FINISHED, STATE_POLLING))
+    LAST_PRUNE = now
+
+
+def submitted(prompt: str, model: str, ar: Optional[str], cookie: str, redirect_url: str,
+              request_id: str, url_encoded_prompt: str, max_wait_time: int, client_id: str = '') -> Optional[int]:
+    """
+    Записывает задание принятое бингом, возвращает его id или None если журнал недоступен.
+    client_id - чей это запрос, результат после перезапуска получит только он.
+    """
+    try:
+        now = time.time()
+        with LOCK:
+            conn = get_conn()
+            # процесс может работать неделями, журнал чистится не только при старте
+            if now - LAST_PRUNE > PRUNE_INTERVAL:
+                _prune(conn, now)
+            cursor = conn.execute(
+                'INSERT INTO jobs (prompt, model, ar, cookie, redirect_url, request_id, url_encoded_prompt,'
+                ' created, deadline, state, client_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (prompt, model, None if ar is None else str(ar), cookie, redirect_url, request_id,
+                 url_encoded_prompt, now, now + max_wait_time, STATE_POLLING, client_id))
+            conn.commit()
+            return cursor.lastrowid
+    except Exception as error:
+        my_log.log_bing_api(f'job_journal:submitted: {error}')
+        return None
+
+
+def finish(job_id: Optional[int], urls: List[str], state: str = STATE_CONSUMED) -> None:
+    """Отмечает задание завершенным. Пустой список картинок - неудача."""
+    if job_id is None:
+        return
+    if not urls:
+        state = STATE_FAILED
+    try:
+        with LOCK:
+            conn = get_conn()
+            conn.execute('UPDATE jobs SET state = ?, result = ?, finished = ? WHERE id = ?',
+                         (state, json.dumps(urls), time.time(), job_id))
+            conn.commit()
+    except Exception as error:
+        my_log.log_bing_api(f'job_journal:finish: {error}')
+
+
+def take_result(prompt: str, model: str, ar: Optional[str], client_id: str = '') -> Optional[List[str]]:
+    """
+    Если этот же клиент отправил задание с таким же промптом до перезапуска, ждет пока оно
+    дорисуется и возвращает картинки (один раз). Иначе None - надо рисовать заново.
+    Чужие задания и задания без client_id не отдаются: у популярного промпта картинки
+    иначе достались бы первому попавшемуся клиенту, а не тому кто их заказал.
+    """
+    if not client_id or not os.path.exists(DB_PATH):
+        return None
+    try:
+        with LOCK:
+            rows = get_conn().execute(
+                'SELECT id, deadline, state FROM jobs WHERE prompt = ? AND model = ? AND ar IS ? AND client_id = ?'
+                ' AND state IN (?, ?) ORDER BY id',
+                (prompt, model, None if ar is None else str(ar), client_id, STATE_DONE, STATE_POLLING)).fetchall()
+        # в состоянии polling бывают и обычные текущие задания, ждать можно только дорисовку
+        rows = [x for x in rows if x[2] == STATE_DONE or x[0] in RESUMED]
+        if not rows:
+            return None
+        job_id, deadline, _ = rows[0]
+
+        event = RESUMED.get(job_id)
+        if event is not None:
+            event.wait(max(0.0, deadline - time.time()))
+
+        with LOCK:
+            conn = get_conn()
+            result = conn.execute('SELECT result FROM jobs WHERE id = ? AND state = ?',
+                                  (job_id, STATE_DONE)).fetchone()
+            if not result:
+                return None
+            # результат отдается только одному клиенту
+            cursor = conn.execute('UPDATE jobs SET state = ? WHERE id = ? AND state = ?',
+                                  (STATE_CONSUMED, job_id, STATE_DONE))
+            conn.commit()
+            if not cursor.rowcount:
+                return None
+        my_log.log_bing_api(f'job_journal:take_result: job {job_id} reused after restart: {prompt}')
+        return json.loads(result[0])
+    except Exception as error:
+        my_log.log_bing_api(f'job_journal:take_result: {error}')
+        return None
+
+
+@async_run
+def _resume_job(job: Dict[str, Any]) -> None:
+    """Продолжает опрос результатов задания по его request_id."""
+    import bing_genimg_v3
+
+    try:
+        cookie = job['cookie'] if job['cookie'] and os.path.exists(job['cookie']) else 'cookie.txt'
+        brush = bing_genimg_v3.BingBrush(cookie=cookie)
+        brush.max_wait_time = max(1, int(job['deadline'] - time.time()))
+        brush.deadline = job['deadline']
+        urls = brush.poll(job['redirect_url'], job['request_id'], job['url_encoded_prompt'], job['model'])
+        finish(job['id'], urls, state=STATE_DONE)
+    except Exception as error:
+        traceback_error = traceback.format_exc()
+        my_log.log_bing_api(f'job_journal:_resume_job: {error}\n\n{traceback_error}')
+        finish(job['id'], [])
+    finally:
+        RESUMED.pop(job['id']).set()
+
+
+def resume_unfinished() -> int:
+    """
+    Вызывается при старте. Задания у которых не вышел срок продолжают опрашиваться,
+    остальные помечаются просроченными. Возвращает сколько заданий продолжено.
+    """
+    try:
+        now = time.time()
+        with LOCK:
+            conn = get_conn()
+            conn.execute('UPDATE jobs SET state = ? WHERE state = ? AND deadline <= ?',
+                         (STATE_EXPIRED, STATE_POLLING, now))
+            _prune(conn, now)
+            conn.commit()
+            cursor = conn.execute(
+                'SELECT id, model, cookie, redirect_url, request_id, url_encoded_prompt, deadline'
+                ' FROM jobs WHERE state = ?', (STATE_POLLING,))
+            columns = [x[0] for x in cursor.description]
+            jobs = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+        for job in jobs:
+            RESUMED[job['id']] = threading.Event()
+            _resume_job(job)
+        if jobs:
+            my_log.log_bing_api(f'job_journal:resume_unfinished: resumed {len(jobs)} jobs')
+        return len(jobs)
+    except Exception as error:
+        my_log.log_bing_api(f'job_journal:resume_unfinished: {error}')
+        return 0
+
+
+if __name__ == '__main__':
+    pass
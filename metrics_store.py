@@ -0,0 +1,143 @@
+# metrics_store.py
+# Compact round-robin time-series store for monitor.py (RRD-like, on top of SQLite).
+#
+# Every series is kept in three tiers: raw samples, 1-minute and 1-hour buckets.
+# Each tier has a fixed number of slots per series, slot = (ts // step) % capacity,
+# so the file never grows beyond series * sum(capacities) rows. A sample is
+# consolidated into all tiers at write time (count/sum/min/max per bucket), which
+# means there is no separate downsampling pass and old data simply gets overwritten.
+#
+# None values are counted as "missing" (e.g. ping loss, instance offline), so the
+# store can report availability next to the value statistics.
+
+
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from utils import open_sqlite_wal, percentile
+
+
+# (name, step in seconds, slots per series)
+TIERS: Tuple[Tuple[str, int, int], ...] = (
+    ('raw', 2, 1800),          # 1 hour at the default 2 s refresh
+    ('1m', 60, 7 * 24 * 60),   # 7 days
+    ('1h', 3600, 365 * 24),    # 1 year
+)
+
+# (bucket start, samples incl. missing, non-missing count, sum, min, max)
+Row = Tuple[int, int, int, Optional[float], Optional[float], Optional[float]]
+
+
+class MetricsStore:
+    """Round-robin store with raw -> 1 min -> 1 h tiers. Safe to share between threads."""
+
+    def __init__(self, path: str, raw_step: int = 2):
+        self.tiers = ((TIERS[0][0], max(1, int(raw_step)), TIERS[0][2]),) + TIERS[1:]
+        self.lock = threading.Lock()
+        self.conn = open_sqlite_wal(path)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS samples (
+                series TEXT NOT NULL,
+                tier INTEGER NOT NULL,
+                slot INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                total INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                sum REAL,
+                min REAL,
+                max REAL,
+                PRIMARY KEY (series, tier, slot)
+            ) WITHOUT ROWID''')
+        self.conn.commit()
+
+    def add(self, samples: Dict[str, Optional[float]], ts: Optional[float] = None) -> None:
+        """Writes one sample per series (None = missing) into all tiers in one transaction."""
+        ts = int(ts if ts is not None else time.time())
+        rows = []
+        for series, value in samples.items():
+            count = 0 if value is None else 1
+            for tier, (_, step, capacity) in enumerate(self.tiers):
+                bucket = ts - ts % step
+                rows.append((series, tier, (bucket // step) % capacity, bucket, count, value, value, value))
+        with self.lock:
+            self.conn.executemany('''
+                INSERT INTO samples (series, tier, slot, bucket, total, count, sum, min, max)
+                VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?)
+                ON CONFLICT (series, tier, slot) DO UPDATE SET
+                    total = CASE WHEN bucket = excluded.bucket THEN total + 1 ELSE 1 END,
+                    count = CASE WHEN bucket = excluded.bucket THEN count + excluded.count ELSE excluded.count END,
+                    sum = CASE WHEN bucket = excluded.bucket
+                          THEN coalesce(sum, 0) + coalesce(excluded.sum, 0) ELSE excluded.sum END,
+                    min = CASE WHEN bucket = excluded.bucket
+                          THEN min(coalesce(min, excluded.min), coalesce(excluded.min, min)) ELSE excluded.min END,
+                    max = CASE WHEN bucket = excluded.bucket
+                          THEN max(coalesce(max, excluded.max), coalesce(excluded.max, max)) ELSE excluded.max END,
+                    bucket = excluded.bucket''', rows)
+            self.conn.commit()
+
+    def tier_for(self, seconds: float) -> int:
+        """The finest tier that still covers the whole window."""
+        for tier, (_, step, capacity) in enumerate(self.tiers):
+            if step * capacity >= seconds:
+                return tier
+        return len(self.tiers) - 1
+
+    def rows(self, series: str, seconds: float, tier: Optional[int] = None) -> List[Row]:
+        """Buckets of the last `seconds`, oldest first."""
+        if tier is None:
+            tier = self.tier_for(seconds)
+        since = int(time.time() - seconds)
+        with self.lock:
+            return self.conn.execute(
+                'SELECT bucket, total, count, sum, min, max FROM samples'
+                ' WHERE series = ? AND tier = ? AND bucket >= ? ORDER BY bucket',
+                (series, tier, since)).fetchall()
+
+    def series(self, series: str, seconds: float, points: int) -> List[Optional[float]]:
+        """
+        Averages for the last `seconds` split into `points` equal intervals (for sparklines),
+        None where there is no data.
+        """
+        tier = self.tier_for(seconds)
+        now = time.time()
+        width = seconds / points
+        sums = [0.0] * points
+        counts = [0] * points
+        for bucket, _, count, total_sum, _, _ in self.rows(series, seconds, tier):
+            if not count:
+                continue
+            index = min(points - 1, max(0, int((bucket - (now - seconds)) / width)))
+            sums[index] += total_sum or 0.0
+            counts[index] += count
+        return [sums[i] / counts[i] if counts[i] else None for i in range(points)]
+
+    def summary(self, series: str, seconds: float, percentiles: Sequence[int] = (50, 95, 99)) -> Dict[str, Optional[float]]:
+        """
+        Last value, percentiles, min/max and share of missing samples over the window.
+        Percentiles are exact on the raw tier and computed over bucket averages on coarser tiers.
+        """
+        rows = self.rows(series, seconds)
+        values = [x[3] / x[2] for x in rows if x[2]]
+        total = sum(x[1] for x in rows)
+        result: Dict[str, Optional[float]] = {
+            "last": values[-1] if values else None,
+            "min": min((x[4] for x in rows if x[4] is not None), default=None),
+            "max": max((x[5] for x in rows if x[5] is not None), default=None),
+            "missing": 1 - sum(x[2] for x in rows) / total if total else None,
+        }
+        for p in percentiles:
+            result[f"p{p}"] = percentile(values, p) if values else None
+        return result
+
+    def names(self) -> List[str]:
+        with self.lock:
+            return [x[0] for x in self.conn.execute('SELECT DISTINCT series FROM samples WHERE tier = 0')]
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+if __name__ == "__main__":
+    pass
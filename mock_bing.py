@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+# Локальная замена Bing Image Creator для нагрузочных тестов без расхода настоящих куки.
+# Отвечает на те же адреса что использует BingBrush:
+#   POST /images/create                       - 302 с Location (rt=4) или 200 без Location (бусты кончились / промпт заблокирован)
+#   GET  /images/create?...&id=<id>           - страница редиректа
+#   GET  /images/create                       - страница с остатком бустов для cookie_check
+#                                               (без куки или с куки expired=1 - не залогинен)
+#   GET  /images/create/async/results/<id>    - пусто / strm пока рисуется, errorMessage при ошибке, картинки когда готово
+#   GET  /__stats, POST /__reset              - счетчики запросов для bench.py
+#
+# Запуск: python mock_bing.py --port 58800 --render-median 15 --fail-rate 0.05
+# и в cfg.py: BING_BASE_URL = 'http://127.0.0.1:58800'
+
+
+import argparse
+import math
+import random
+import threading
+import time
+import uuid
+from typing import Any, Dict
+
+from flask import Flask, jsonify, request
+
+
+FLASK_APP = Flask(__name__)
+
+# параметры поведения, заполняются из командной строки
+SETTINGS: Dict[str, Any] = {
+    "submit_latency": 0.3,      # медиана задержки ответа на отправку задания, секунд
+    "render_median": 15.0,      # медиана времени рисования, секунд
+    "render_sigma": 0.5,        # разброс времени рисования (sigma логнормального распределения)
+    "fail_rate": 0.0,           # доля заданий на которых results отвечает 500
+    "render_error_rate": 0.0,   # доля заданий которые заканчиваются errorMessage
+    "block_rate": 0.0,          # доля заблокированных промптов
+    "no_boost_rate": 0.0,       # доля отправок rt=4 без Location (бусты кончились, дальше rt=3)
+    "slow_factor": 3.0,         # во сколько раз медленнее рисует rt=3
+    "images": 4,                # картинок в готовом задании
+    "page_padding": 60000,      # байт лишней разметки в страницах результатов (у бинга они большие)
+    "boosts": 15,               # остаток бустов на странице /images/create
+}
+
+JOBS: Dict[str, Dict[str, Any]] = {}
+STATS: Dict[str, int] = {}
+LOCK = threading.Lock()
+
+BLOCKED_PAGE = ('<html><body><div id="gilen_son" class="block_icon">'
+                'Your prompt has been blocked by Bing. Try to change any bad words and try again.'
+                '</div></body></html>')
+NO_BOOST_PAGE = '<html><body><div id="giloader">Please wait</div></body></html>'
+
+
+def count(name: str) -> None:
+    with LOCK:
+        STATS[name] = STATS.get(name, 0) + 1
+
+
+def lognormal(median: float, sigma: float) -> float:
+    if median <= 0:
+        return 0.0
+    return random.lognormvariate(math.log(median), sigma)
+
+
+def padding() -> str:
+    """Балласт похожий на встроенные скрипты и стили страниц бинга."""
+    size = SETTINGS['page_padding']
+    if size <= 0:
+        return ''
+    block = '<script type="text/javascript">var _G={ST:1,Mkt:"en-US",IG:"0"};</script>'
+    return block * (size // len(block) + 1)
+
+
+def result_page(job_id: str, n: int) -> str:
+    """Страница с готовыми картинками, похожая на ответ бинга (с лишними src для проверки фильтров)."""
+    images = ''.join(
+        f'<div class="img_cont hoff"><img class="mimg" style="background-color:#1a2b3c;color:#1a2b3c" '
+        f'height="270" width="270" src="https://tse{i % 4 + 1}.mm.bing.net/th/id/OIG{i}.{job_id}{i}'
+        f'?w=270&amp;h=270&amp;c=6&amp;r=0&amp;o=5&amp;pid=ImgGn" alt="mock image" /></div>'
+        for i in range(n)
+    )
+    return (f'<html><head><script type="text/javascript" src="/rp/mock.js"></script></head>'
+            f'<body><div id="gir_async" class="giric">{images}</div>'
+            f'<img src="/rp/mock-logo.png" />{padding()}</body></html>')
+
+
+@FLASK_APP.route('/images/create', methods=['POST'])
+def create_api() -> Any:
+    count('submit')
+    time.sleep(lognormal(SETTINGS['submit_latency'], 0.3))
+
+    prompt = request.args.get('q', '')
+    rt = request.args.get('rt', '4')
+    model = request.args.get('mdl', '0')
+
+    if 'blocked' in prompt.lower() or random.random() < SETTINGS['block_rate']:
+        count('blocked')
+        return BLOCKED_PAGE, 200
+
+    if rt == '4' and random.random() < SETTINGS['no_boost_rate']:
+        count('no_boost')
+        return NO_BOOST_PAGE, 200
+
+    job_id = uuid.uuid4().hex
+    render_time = lognormal(SETTINGS['render_median'], SETTINGS['render_sigma'])
+    if rt == '3':
+        render_time *= SETTINGS['slow_factor']
+    with LOCK:
+        JOBS[job_id] = {
+            "ready_at": time.time() + render_time,
+            "model": model,
+            "fail": random.random() < SETTINGS['fail_rate'],
+            "render_error": random.random() < SETTINGS['render_error_rate'],
+        }
+    count('jobs')
+    location = f'/images/create?q={prompt}&rt={rt}&FORM=GENCRE&id={job_id}&nfy=1'
+    return '', 302, {'Location': location}
+
+
+@FLASK_APP.route('/images/create', methods=['GET'])
+def redirect_page_api() -> Any:
+    if 'id' not in request.args:
+        count('probe')
+        if not request.cookies or 'expired' in request.cookies:
+            return '<html><body><a id="id_l" href="/fd/auth/signin">Join &amp; Create</a></body></html>', 200
+        return (f'<html><body><span id="id_n" class="id_name">Mock User</span>'
+                f'<div id="token_bal" aria-label="{SETTINGS["boosts"]} coins available">{SETTINGS["boosts"]}</div>'
+                f'{padding()}</body></html>'), 200
+    count('redirect')
+    return '<html><body><div id="giloader">Creating...</div></body></html>', 200
+
+
+@FLASK_APP.route('/images/create/async/results/<job_id>', methods=['GET'])
+def results_api(job_id: str) -> Any:
+    count('poll')
+    with LOCK:
+        job = JOBS.get(job_id)
+    if job is None:
+        return 'not found', 404
+    if job['fail']:
+        return 'internal error', 500
+    if time.time() < job['ready_at']:
+        # gpt4o отдает страницу с классом strm пока рисует, dalle - пустой ответ
+        if job['model'] == '1':
+            return f'<div class="strm"><div class="gir_mmimg"></div></div>{padding()}', 200
+        return '', 200
+    if job['render_error']:
+        return f'<div id="girer" class="errorMessage">Something went wrong</div>{padding()}', 200
+    return result_page(job_id, SETTINGS['images']), 200
+
+
+@FLASK_APP.route('/__stats', methods=['GET'])
+def stats_api() -> Any:
+    with LOCK:
+        return jsonify(dict(STATS, requests=sum(v for k, v in STATS.items() if k in ('submit', 'redirect', 'poll'))))
+
+
+@FLASK_APP.route('/__reset', methods=['POST'])
+def reset_api() -> Any:
+    with LOCK:
+        STATS.clear()
+        JOBS.clear()
+    return jsonify({"message": "reset"})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local Bing Image Creator stand-in')
+    parser.add_argument('--addr', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=58800)
+    parser.add_argument('--seed', type=int, default=None)
+    for name, value in SETTINGS.items():
+        parser.add_argument('--' + name.replace('_', '-'), type=type(value), default=value)
+    args = parser.parse_args()
+
+    for name in SETTINGS:
+        SETTINGS[name] = getattr(args, name)
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    FLASK_APP.run(debug=False, use_reloader=False, host=args.addr, port=args.port, threaded=True)
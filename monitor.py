@@ -1,86 +1,311 @@
 # monitor.py
 
 
+import argparse
+import json
 import sqlite3
+import sys
+import threading
 import time
 
 from collections import deque
-from typing import Any, Deque, Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple
 
 import cfg  # Import config file
 import requests
-from icmplib import ping
-from icmplib.exceptions import ICMPLibError
 from rich.console import Console, Group
 from rich.live import Live
 from rich.panel import Panel
 from rich.table import Table
 
+from exporter import FleetExporter, serve
+from metrics_store import MetricsStore
+from pinger import Pinger, targets_from_config
+
 # Take instance URLs from the config file
 INSTANCES: List[Dict[str, Any]] = cfg.MONITOR_INSTANCES
 
+# Where the history for trend views is kept (round-robin, bounded size)
+HISTORY_PATH: str = getattr(cfg, "MONITOR_HISTORY_PATH", "monitor_history.db")
+# Seconds between samples
+REFRESH_INTERVAL = 2
+# Trend views are read from the store only this often, not on every refresh
+TRENDS_REFRESH_INTERVAL = 30
+# Per request timeout for /status, and the time all instances together get per refresh,
+# so one hung instance cannot hold up the dashboard or the /fleet and /metrics view
+STATUS_TIMEOUT = 2
+STATUS_DEADLINE = 3
+STATUS_POOL = ThreadPoolExecutor(max_workers=max(4, len(INSTANCES)), thread_name_prefix="status")
+
+SPARKLINE_CHARS = [' ', '▂', '▃', '▄', '▅', '▆', '▇', '█']
+
 
-def get_queue_size(db_path: str) -> int:
+class QueueProbe:
     """
-    Safely gets the number of records from the log queue SQLite DB.
-    Connects in read-only mode to prevent locking the database.
-    Returns -1 if the database or table cannot be accessed.
+    Tracks the depth of the SqliteDict log queue on its own thread, independent of rendering.
+
+    Keeps one read-only connection open instead of reconnecting on every refresh and
+    estimates the depth as max(rowid) - min(rowid) + 1, two index lookups instead of the
+    full table scan of count(*). The queue is consumed from the head and appended at the
+    tail, so the estimate only overcounts if rows are removed from the middle. Small
+    queues (below EXACT_BELOW) are counted exactly since that is cheap anyway.
+    Also reports how fast the queue grows (positive) or drains (negative), rows/s.
     """
-    # Build a URI for read-only connection
-    db_uri = f"file:{db_path}?mode=ro"
-    try:
-        # Use the URI connection string
-        with sqlite3.connect(db_uri, uri=True, timeout=1) as conn:
-            cursor = conn.cursor()
-            # The table 'unnamed' is the default name used by SqliteDict
-            cursor.execute("SELECT count(*) FROM unnamed;")
-            # fetchone() returns a tuple, e.g., (123,)
-            count = cursor.fetchone()[0]
-            return count
-    except (sqlite3.OperationalError, FileNotFoundError):
-        # Return -1 to indicate an error (e.g., DB not found, table missing)
-        return -1
+
+    EXACT_BELOW = 1000
+
+    def __init__(self, db_path: str, interval: float = 1.0, window: float = 30.0):
+        self.db_path = db_path
+        self.interval = interval
+        self.window = window
+        self.conn: Optional[sqlite3.Connection] = None
+        self.size = -1
+        self.rate = 0.0
+        self.history: Deque[Tuple[float, int]] = deque()
+        self.lock = threading.Lock()
+        # first measurement right away so the dashboard does not start with an error
+        self.sample()
+        self.thread = threading.Thread(target=self.run, name="queue_probe", daemon=True)
+        self.thread.start()
+
+    def connect(self) -> sqlite3.Connection:
+        # Build a URI for read-only connection
+        conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True, timeout=1, check_same_thread=False)
+        # Read-only: never take write locks, no need to wait on the writer
+        conn.execute("PRAGMA query_only = 1;")
+        return conn
+
+    def measure(self) -> int:
+        if self.conn is None:
+            self.conn = self.connect()
+        # The table 'unnamed' is the default name used by SqliteDict.
+        # Separate queries, SQLite only optimizes a lone min() or max() into an index lookup.
+        high = self.conn.execute("SELECT max(rowid) FROM unnamed;").fetchone()[0]
+        if high is None:
+            return 0
+        low = self.conn.execute("SELECT min(rowid) FROM unnamed;").fetchone()[0]
+        estimate = high - low + 1
+        if estimate < self.EXACT_BELOW:
+            return self.conn.execute("SELECT count(*) FROM unnamed;").fetchone()[0]
+        return estimate
+
+    def sample(self) -> None:
+        try:
+            size = self.measure()
+        except (sqlite3.Error, FileNotFoundError):
+            # DB not found, table missing or locked - reconnect next time
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+            size = -1
+        now = time.time()
+        with self.lock:
+            self.size = size
+            if size == -1:
+                self.history.clear()
+                self.rate = 0.0
+                return
+            self.history.append((now, size))
+            while now - self.history[0][0] > self.window:
+                self.history.popleft()
+            first_time, first_size = self.history[0]
+            self.rate = (size - first_size) / (now - first_time) if now > first_time else 0.0
+
+    def run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            self.sample()
+
+    def snapshot(self) -> Tuple[int, float]:
+        """Last known (size, rows per second), size -1 if the queue could not be read."""
+        with self.lock:
+            return self.size, self.rate
 
 
 def get_status(url: str) -> Dict[str, Any]:
     """Fetches status from a service instance."""
     try:
-        response = requests.get(url, timeout=2)
+        response = requests.get(url, timeout=STATUS_TIMEOUT)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
         return {"error": str(e)}
 
 
-def ping_host(host: str, timeout: int = 2, count: int = 1) -> Dict[str, Any]:
+def fetch_statuses(deadline: float = STATUS_DEADLINE) -> Dict[str, Dict[str, Any]]:
     """
-    Pings a host using ICMP packets via the icmplib library.
-    This requires privileged access (run with sudo or use setcap).
+    Fetches /status of every instance concurrently, keyed by instance name.
+    Instances that have not answered within `deadline` seconds are reported as errors.
     """
-    try:
-        # This MUST be True to work on your system, as proven by testing.
-        result = ping(host, count=count, timeout=timeout, privileged=True)
+    futures = {instance["name"]: STATUS_POOL.submit(get_status, instance["url"]) for instance in INSTANCES}
+    wait(list(futures.values()), timeout=deadline)
+    return {
+        name: future.result() if future.done() else {"error": f"no answer in {deadline:g} s"}
+        for name, future in futures.items()
+    }
 
-        if result.is_alive:
-            # result.avg_rtt is in milliseconds
-            return {"status": "online", "latency": result.avg_rtt}
-        else:
-            return {"status": "offline", "error": "Host unreachable"}
 
-    except (ICMPLibError, PermissionError) as e:
-        # Catch permission errors if not run with sudo/setcap
-        return {"status": "offline", "error": str(e)}
+def success_rate(data: Dict[str, Any]) -> Optional[float]:
+    """Share of successful attempts among the last attempts of an instance, None if there are none."""
+    attempts = [x for x in data.get("last_attempts", []) if x.get("status") in ("OK", "FAIL")]
+    return sum(1 for x in attempts if x["status"] == "OK") / len(attempts) if attempts else None
+
+
+def merge_failed_prompts(statuses: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Failed prompts of all instances, newest first, each prompt text only once."""
+    all_failed_prompts: List[Dict[str, Any]] = []
+    for instance in INSTANCES:
+        data = statuses.get(instance["name"], {})
+        # Failed prompts are dicts with timestamps, add the instance name to each
+        for prompt_data in data.get("last_failed_prompts", []):
+            all_failed_prompts.append(dict(prompt_data, instance=instance["name"]))
+
+    # Sort all collected prompts by timestamp, newest first
+    all_failed_prompts.sort(key=lambda x: x.get('timestamp', 0), reverse=True)
+
+    # Remove duplicates based on prompt text, keeping the newest entry
+    unique_prompts = []
+    seen_prompts = set()
+    for item in all_failed_prompts:
+        prompt_text = item.get("prompt")
+        if prompt_text and prompt_text not in seen_prompts:
+            unique_prompts.append(item)
+            seen_prompts.add(prompt_text)
+    return unique_prompts
+
+
+def fleet_snapshot(
+    statuses: Dict[str, Dict[str, Any]],
+    queue_size: Optional[int],
+    queue_rate: float,
+    ping_stats: Optional[Dict[str, Dict[str, Any]]],
+) -> Dict[str, Any]:
+    """Aggregated view of the whole fleet for the JSON and Prometheus endpoints."""
+    instances = []
+    for instance in INSTANCES:
+        data = statuses.get(instance["name"], {"error": "no data"})
+        online = "error" not in data
+        item = dict(data, name=instance["name"], url=instance["url"], online=online)
+        item.pop("last_failed_prompts", None)
+        if online:
+            item["success_rate"] = success_rate(data)
+        instances.append(item)
+    return {
+        "timestamp": time.time(),
+        "instances": instances,
+        "failed_prompts": merge_failed_prompts(statuses),
+        "queue": {"size": queue_size, "rate": queue_rate} if queue_size is not None else None,
+        "ping": ping_stats,
+    }
+
+
+def collect_samples(
+    statuses: Dict[str, Dict[str, Any]],
+    queue_size: Optional[int],
+    ping_stats: Optional[Dict[str, Dict[str, Any]]],
+    queue_rate: float = 0.0,
+) -> Dict[str, Optional[float]]:
+    """
+    Turns one refresh worth of data into time-series samples for the history store.
+    None means "no value" (instance offline, ping lost) and is counted as missing.
+    """
+    samples: Dict[str, Optional[float]] = {}
+    for name, data in statuses.items():
+        online = "error" not in data
+        samples[f"{name}.up"] = 1.0 if online and data.get("service_status") == "OK" else 0.0
+        samples[f"{name}.success_rate"] = success_rate(data) if online else None
+        samples[f"{name}.active_requests"] = float(data["active_requests"]) if online and "active_requests" in data else None
+    if queue_size is not None:
+        samples["queue.size"] = float(queue_size) if queue_size != -1 else None
+        samples["queue.rate"] = queue_rate if queue_size != -1 else None
+    for name, stats in (ping_stats or {}).items():
+        samples[f"ping.{name}.latency"] = stats["latency"] if stats["status"] == "online" else None
+        samples[f"ping.{name}.loss"] = stats["loss"]
+    return samples
+
+
+def render_sparkline(values: Sequence[Optional[float]], max_value: Optional[float] = None) -> str:
+    """Sparkline markup for a series, gaps (None) are shown as dim dots."""
+    present = [x for x in values if x is not None]
+    if max_value is None:
+        max_value = max(present, default=0)
+    bars = []
+    for value in values:
+        if value is None:
+            bars.append("[dim]·[/dim]")
+            continue
+        index = int(min(value, max_value) / max_value * (len(SPARKLINE_CHARS) - 1)) if max_value > 0 else 0
+        bars.append(SPARKLINE_CHARS[index])
+    return "".join(bars)
 
 
-def generate_table() -> Tuple[Table, List[Dict[str, Any]]]:
+def generate_trends_table(store: MetricsStore, width: int, ping_names: Sequence[str] = ()) -> Table:
+    """
+    Trend view from the history store: last hour and last day sparklines,
+    percentiles over the last hour and the share of missing samples over the day.
+    """
+    points = max(10, min(60, (width - 70) // 2))
+    table = Table(title="[bold cyan]Trends[/bold cyan]")
+    table.add_column("Series", style="cyan", no_wrap=True)
+    table.add_column("Last", style="yellow")
+    table.add_column("p50 / p95 (1h)", style="yellow")
+    table.add_column("Last hour", style="green", no_wrap=True)
+    table.add_column("Last day", style="green", no_wrap=True)
+    table.add_column("Missing (24h)", style="red")
+
+    series = ([f"{x['name']}.success_rate" for x in INSTANCES] + ["queue.size"]
+              + [f"ping.{x}.latency" for x in ping_names])
+    for name in series:
+        day = store.summary(name, 86400)
+        if day["last"] is None:
+            continue
+        hour = store.summary(name, 3600)
+        # success rate is a fraction, everything else is scaled to its own maximum
+        scale = 1.0 if name.endswith(".success_rate") else None
+
+        def fmt(value: Optional[float]) -> str:
+            if value is None:
+                return "N/A"
+            return f"{value * 100:.0f}%" if scale else f"{value:.1f}"
+
+        table.add_row(
+            name,
+            fmt(hour["last"]),
+            f"{fmt(hour['p50'])} / {fmt(hour['p95'])}",
+            render_sparkline(store.series(name, 3600, points), scale),
+            render_sparkline(store.series(name, 86400, 24), scale),
+            f"{day['missing'] * 100:.0f}%" if day["missing"] is not None else "N/A",
+        )
+    return table
+
+
+QUEUE_PROBE: Optional[QueueProbe] = None
+
+
+def read_queue() -> Tuple[Optional[int], float]:
+    """
+    (queue size, growth rows/s) if queue monitoring is enabled in the config, otherwise (None, 0).
+    The probe is started on first use and keeps measuring on its own thread.
+    """
+    global QUEUE_PROBE
+    if not (hasattr(cfg, "QUEUE_DB_PATH") and cfg.QUEUE_DB_PATH):
+        return None, 0.0
+    if QUEUE_PROBE is None:
+        QUEUE_PROBE = QueueProbe(cfg.QUEUE_DB_PATH)
+    return QUEUE_PROBE.snapshot()
+
+
+def generate_table(
+    statuses: Dict[str, Dict[str, Any]], queue_size: Optional[int] = None, queue_rate: float = 0.0
+) -> Tuple[Table, List[Dict[str, Any]]]:
     """
     Generates a Rich Table with instance data and a dynamic title with queue size.
     """
     title = "[bold cyan]Bing API Instances Status[/bold cyan]"
 
-    # Check if queue monitoring is enabled in the config
-    if hasattr(cfg, "QUEUE_DB_PATH") and cfg.QUEUE_DB_PATH:
-        queue_size = get_queue_size(cfg.QUEUE_DB_PATH)
+    # Queue monitoring is enabled in the config
+    if queue_size is not None:
         if queue_size != -1:  # -1 indicates an error
             if queue_size > 1000:
                 color = "bold red"
@@ -91,6 +316,9 @@ def generate_table() -> Tuple[Table, List[Dict[str, Any]]]:
             else:
                 color = "green"
             title += f" | Log Queue: [{color}]{queue_size}[/{color}]"
+            if abs(queue_rate) >= 0.1:
+                rate_color = "red" if queue_rate > 0 else "green"
+                title += f" [{rate_color}]({queue_rate:+.1f}/s)[/{rate_color}]"
         else:
             # Display an error if the queue size could not be determined
             title += " | Log Queue: [bold red]ERROR[/bold red]"
@@ -103,10 +331,8 @@ def generate_table() -> Tuple[Table, List[Dict[str, Any]]]:
     table.add_column("Total Fails", style="red")
     table.add_column("Last 10 Attempts", style="green")
 
-    all_failed_prompts: List[Dict[str, Any]] = []
-
     for instance in INSTANCES:
-        data = get_status(instance["url"])
+        data = statuses.get(instance["name"], {"error": "no data"})
         if "error" in data:
             table.add_row(
                 instance["name"],
@@ -142,77 +368,61 @@ def generate_table() -> Tuple[Table, List[Dict[str, Any]]]:
             attempts,
         )
 
-        # Collect failed prompts, which are now dicts with timestamps
-        failed_prompts = data.get("last_failed_prompts", [])
-        for prompt_data in failed_prompts:
-            # Add instance name to each prompt's data
-            prompt_data['instance'] = instance['name']
-            all_failed_prompts.append(prompt_data)
+    return table, merge_failed_prompts(statuses)
 
-    # Sort all collected prompts by timestamp, newest first
-    all_failed_prompts.sort(key=lambda x: x.get('timestamp', 0), reverse=True)
 
-    # Remove duplicates based on prompt text, keeping the newest entry
-    unique_prompts = []
-    seen_prompts = set()
-    for item in all_failed_prompts:
-        prompt_text = item.get("prompt")
-        if prompt_text and prompt_text not in seen_prompts:
-            unique_prompts.append(item)
-            seen_prompts.add(prompt_text)
-
-    return table, unique_prompts
-
-
-def generate_ping_table(ping_target: str, history: Deque[Dict[str, Any]]) -> Table:
-    """Generates a Rich Table for ping status with a latency sparkline."""
-    # Characters from low to high latency
-    SPARKLINE_CHARS = [' ', '▂', '▃', '▄', '▅', '▆', '▇', '█']
+def generate_ping_table(pinger: Pinger, points: int) -> Table:
+    """
+    Ping status of every target from the background pinger: last latency, percentiles,
+    loss and jitter over its rolling window and a latency sparkline. Never waits on the network.
+    """
     # We'll scale latency up to this value. Anything higher gets the max block.
     MAX_LATENCY_FOR_SCALE = 500  # ms
 
-    table = Table(title="[bold cyan]Ping Status[/bold cyan]")
+    stats = pinger.stats()
+    method = next(iter(stats.values()))["method"] if stats else ""
+    table = Table(title=f"[bold cyan]Ping Status[/bold cyan] [dim]({method})[/dim]")
     table.add_column("Target", style="cyan", no_wrap=True)
     table.add_column("Status", style="white")
     table.add_column("Latency (ms)", style="yellow")
+    table.add_column("p50 / p95 / p99", style="yellow", no_wrap=True)
+    table.add_column("Loss", style="red")
+    table.add_column("Jitter", style="magenta")
     # The column must not wrap lines to keep the sparkline intact
     table.add_column("Latency History", style="green", no_wrap=True)
 
-    if not history:
-        table.add_row(ping_target, "[yellow]INITIALIZING...[/yellow]", "N/A", "")
-        return table
+    def fmt(value: Optional[float]) -> str:
+        return f"{value:.1f}" if value is not None else "N/A"
 
-    last_result = history[-1]
-    status = last_result.get("status", "unknown")
-    status_str = (
-        f"[bold green]ONLINE[/bold green]"
-        if status == "online"
-        else f"[bold red]OFFLINE[/bold red]"
-    )
+    for target in pinger.targets:
+        name = target["name"]
+        data = stats[name]
+        if data["status"] == "unknown":
+            table.add_row(name, "[yellow]INITIALIZING...[/yellow]", "N/A", "N/A", "N/A", "N/A", "")
+            continue
 
-    latency = last_result.get("latency")
-    latency_str = f"{latency:.2f}" if latency is not None else "N/A"
+        status_str = "[bold green]ONLINE[/bold green]" if data["status"] == "online" else "[bold red]OFFLINE[/bold red]"
+        loss = data["loss"]
+        loss_color = "green" if loss == 0 else ("yellow" if loss < 0.05 else "bold red")
 
-    # --- Sparkline generation logic ---
-    bars = []
-    for attempt in history:
-        if attempt.get("status") == "online":
-            ping_ms = attempt.get("latency", 0)
-            # Clamp latency to our max scale value
-            clamped_ping = min(ping_ms, MAX_LATENCY_FOR_SCALE)
-            # Calculate index for the character list
-            index = int(
-                (clamped_ping / MAX_LATENCY_FOR_SCALE) * (len(SPARKLINE_CHARS) - 1)
-            )
-            char = SPARKLINE_CHARS[index]
-            bars.append(f"[green]{char}[/green]")
-        else:
-            # A full, red block for failures
-            bars.append(f"[red]█[/red]")
-    sparkline = "".join(bars)
-    # --- End of sparkline logic ---
+        # Lost probes are shown as a full, red block
+        bars = []
+        for rtt in pinger.history(name, points):
+            if rtt is None:
+                bars.append("[red]█[/red]")
+            else:
+                index = int(min(rtt, MAX_LATENCY_FOR_SCALE) / MAX_LATENCY_FOR_SCALE * (len(SPARKLINE_CHARS) - 1))
+                bars.append(f"[green]{SPARKLINE_CHARS[index]}[/green]")
 
-    table.add_row(ping_target, status_str, latency_str, sparkline)
+        table.add_row(
+            name,
+            status_str,
+            fmt(data["latency"]),
+            f"{fmt(data['p50'])} / {fmt(data['p95'])} / {fmt(data['p99'])}",
+            f"[{loss_color}]{loss * 100:.1f}%[/{loss_color}]",
+            fmt(data["jitter"]),
+            "".join(bars),
+        )
     return table
 
 
@@ -237,48 +447,150 @@ def generate_failed_prompts_panel(prompts: List[Dict[str, str]], width: int) ->
     )
 
 
+def start_pinger() -> Optional[Pinger]:
+    """Background pinger for all configured targets, None if there is nothing to ping."""
+    targets = targets_from_config(cfg)
+    if not targets:
+        return None
+    return Pinger(targets, interval=getattr(cfg, "PING_INTERVAL", REFRESH_INTERVAL))
+
+
+def collect_forever(
+    store: Optional[MetricsStore], pinger: Optional[Pinger], exporter: Optional[FleetExporter] = None
+) -> None:
+    """
+    Headless collector without any UI: writes samples to the history store
+    and, when serving, publishes the fleet view to the exporter.
+    """
+    while True:
+        try:
+            statuses = fetch_statuses()
+            queue_size, queue_rate = read_queue()
+            ping_stats = pinger.stats() if pinger is not None else None
+            if store is not None:
+                store.add(collect_samples(statuses, queue_size, ping_stats, queue_rate))
+            if exporter is not None:
+                exporter.update(fleet_snapshot(statuses, queue_size, queue_rate, ping_stats))
+        except KeyboardInterrupt:
+            break
+        except Exception as error:
+            # one bad cycle (locked history db, odd /status reply) must not stop the collector
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} collect_forever: {error!r}", file=sys.stderr, flush=True)
+        try:
+            time.sleep(REFRESH_INTERVAL)
+        except KeyboardInterrupt:
+            break
+
+
+# Fields of /status shown in the instances table, the rest changes all the time but is not displayed
+DISPLAYED_FIELDS = ("error", "service_status", "time_to_restart", "current_cookie", "cookie_fail_count",
+                    "max_fail_for_rotate", "total_fail_count", "max_fail_for_suspend", "last_attempts")
+
+
+class SectionCache:
+    """
+    Keeps the last renderable of every dashboard section and rebuilds a section only
+    when its input changed, so an idle fleet costs almost nothing per refresh.
+    """
+
+    def __init__(self):
+        self.keys: Dict[str, str] = {}
+        self.renderables: Dict[str, Any] = {}
+        self.changed = False
+
+    def get(self, name: str, key: Any, build) -> Any:
+        key_str = json.dumps(key, sort_keys=True, default=str)
+        if self.keys.get(name) != key_str:
+            self.keys[name] = key_str
+            self.renderables[name] = build()
+            self.changed = True
+        return self.renderables[name]
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bing API instances dashboard")
+    parser.add_argument("--collect", action="store_true",
+                        help="headless mode: only write samples to the history store")
+    parser.add_argument("--serve", type=int, metavar="PORT",
+                        help="headless mode: serve the fleet view as JSON (/fleet) and Prometheus metrics (/metrics)")
+    parser.add_argument("--bind", default=getattr(cfg, "MONITOR_SERVE_ADDR", "127.0.0.1"),
+                        help="address for --serve")
+    parser.add_argument("--history", default=HISTORY_PATH,
+                        help="history store path, empty string disables history")
+    args = parser.parse_args()
+
     console = Console()
 
-    # Check if ping target is configured
-    ping_enabled = hasattr(cfg, "PING_TARGET") and cfg.PING_TARGET
+    # Pings run on their own thread, the dashboard only reads the latest stats
+    pinger = start_pinger()
+
+    store: Optional[MetricsStore] = MetricsStore(args.history, raw_step=REFRESH_INTERVAL) if args.history else None
 
-    # --- Dynamic deque size based on terminal width ---
-    # Reserve ~55 characters for other columns, borders, and padding
-    sparkline_width = max(10, console.width - 55)
-    ping_history: Deque[Dict[str, Any]] = deque(maxlen=sparkline_width)
-    # --- End of dynamic deque logic ---
+    if args.serve:
+        exporter = FleetExporter()
+        serve(exporter, args.bind, args.serve)
+        console.print(f"Serving fleet view on http://{args.bind}:{args.serve}/fleet and /metrics")
+        collect_forever(store, pinger, exporter)
+        raise SystemExit(0)
 
-    def generate_layout() -> Group:
-        """Generates the complete layout with all tables and panels."""
-        api_table, failed_prompts = generate_table()
+    if args.collect:
+        if store is None:
+            parser.error("--collect needs a history store")
+        collect_forever(store, pinger)
+        raise SystemExit(0)
 
+    sections = SectionCache()
+    trends_updated = 0.0
+
+    def generate_layout(statuses: Dict[str, Dict[str, Any]], queue_size: Optional[int], queue_rate: float) -> Group:
+        """Generates the complete layout, sections whose data did not change are reused as is."""
+        global trends_updated
+
+        width = console.width
+        shown = {name: {k: data.get(k) for k in DISPLAYED_FIELDS} for name, data in statuses.items()}
+        api_table = sections.get("instances", (shown, queue_size, round(queue_rate, 1)),
+                                 lambda: generate_table(statuses, queue_size, queue_rate)[0])
         elements = [api_table]
 
-        if ping_enabled:
-            ping_table = generate_ping_table(cfg.PING_TARGET, ping_history)
-            elements.append(ping_table)
+        if pinger is not None:
+            # Reserve ~95 characters for other columns, borders, and padding
+            points = max(10, width - 95)
+            elements.append(sections.get("ping", (pinger.rounds, points), lambda: generate_ping_table(pinger, points)))
+
+        if store is not None:
+            if time.time() - trends_updated > TRENDS_REFRESH_INTERVAL:
+                trends_updated = time.time()
+            ping_names = [x["name"] for x in pinger.targets] if pinger is not None else []
+            elements.append(sections.get("trends", (trends_updated, width),
+                                         lambda: generate_trends_table(store, width, ping_names)))
 
+        failed_prompts = merge_failed_prompts(statuses)
         if failed_prompts:
             # Pass console width to handle prompt truncation
-            prompts_panel = generate_failed_prompts_panel(failed_prompts, console.width)
-            elements.append(prompts_panel)
+            elements.append(sections.get("prompts", (failed_prompts[:4], width),
+                                         lambda: generate_failed_prompts_panel(failed_prompts, width)))
 
         return Group(*elements)
 
-    with Live(generate_layout(), screen=True, auto_refresh=False) as live:
+    with Live(console=console, screen=True, auto_refresh=False) as live:
+        shown_sections: List[int] = []
+        shown_size = console.size
         while True:
             try:
-                if ping_enabled:
-                    result = ping_host(cfg.PING_TARGET)
-                    ping_history.append(result)
-
-                # Dynamically adjust sparkline width if terminal is resized
-                new_sparkline_width = max(10, console.width - 55)
-                if new_sparkline_width != ping_history.maxlen:
-                    ping_history = deque(ping_history, maxlen=new_sparkline_width)
-
-                live.update(generate_layout(), refresh=True)
-                time.sleep(2)  # Refresh rate
+                statuses = fetch_statuses()
+                queue_size, queue_rate = read_queue()
+                if store is not None:
+                    ping_stats = pinger.stats() if pinger is not None else None
+                    store.add(collect_samples(statuses, queue_size, ping_stats, queue_rate))
+
+                sections.changed = False
+                layout = generate_layout(statuses, queue_size, queue_rate)
+                # Redraw only if some section was rebuilt, one appeared/disappeared or the terminal was resized
+                section_ids = [id(x) for x in layout.renderables]
+                if sections.changed or section_ids != shown_sections or console.size != shown_size:
+                    live.update(layout, refresh=True)
+                    shown_sections = section_ids
+                    shown_size = console.size
+                time.sleep(REFRESH_INTERVAL)  # Refresh rate
             except KeyboardInterrupt:
-                break
\ No newline at end of file
+                break
@@ -2,31 +2,51 @@
 
 
 import re
-import time
 import threading
+import time
 from typing import Optional
 
 import bing_genimg_v3
+import cfg  # type: ignore
+import image_dedup
 import my_log
+import scheduler
+import tracing
+
 
+# сколько заданий одновременно может быть в работе на одном (текущем) куки.
+# 1 - как раньше, следующее задание отправляется только когда предыдущее дорисовано,
+# 2-3 - следующее задание отправляется пока предыдущие еще опрашиваются
+INFLIGHT_DEPTH = getattr(cfg, 'BING_INFLIGHT_DEPTH', 1)
 
-# попробовать заблокировать параллельные вызовы бинга
-BING_LOCK = threading.Lock()
+# порядок заданий определяет очередь с приоритетами, глубина конвейера - ее емкость
+SCHEDULER = scheduler.FairScheduler(capacity=INFLIGHT_DEPTH)
+# отправка заданий в бинг (POST + редирект) всегда строго по одной
+SUBMIT_LOCK = threading.Lock()
+# пауза после каждого удачного задания перед следующим запросом, секунд
+PAUSE_BETWEEN_REQUESTS = getattr(cfg, 'BING_PAUSE_BETWEEN_REQUESTS', 4)
 
 
-def bing(prompt: str, model: str = 'dalle', ar: Optional[str] = None) -> list:
+def bing(prompt: str, model: str = 'dalle', ar: Optional[str] = None,
+         client_id: str = '', priority: int = scheduler.PRIORITY_INTERACTIVE) -> list:
     """
-    Рисует бингом, не больше 1 потока и 20 секунд пауза между запросами
+    Рисует бингом, не больше INFLIGHT_DEPTH заданий в работе и PAUSE_BETWEEN_REQUESTS (4) секунды пауза между запросами
     Ограничение на размер промпта 950, хз почему
 
     Предполагается что промпт уже прошел модерацию
+
+    client_id и priority определяют место в очереди (см. scheduler.FairScheduler),
+    если у клиента слишком много запросов то бросает scheduler.SchedulerBusy
     """
 
     # prompt = prompt[:950] # нельзя больше 950?
 
     try:
-        with BING_LOCK:
-            images = bing_genimg_v3.gen_images(prompt, model=model, ar=ar)
+        with SCHEDULER.slot(client_id, priority) as ticket:
+            tracing.add_span('scheduler_wait', ticket.enqueued, ticket.started - ticket.enqueued,
+                             priority=scheduler.PRIORITY_NAMES.get(priority, priority))
+            images = bing_genimg_v3.gen_images(prompt, model=model, ar=ar, submit_lock=SUBMIT_LOCK,
+                                                client_id=client_id)
 
             # если нет картинок (есть только ошибки) то сразу вернуть отказ
             if any([x for x in images if not x.startswith('https://')]):
@@ -34,16 +54,26 @@ def bing(prompt: str, model: str = 'dalle', ar: Optional[str] = None) -> list:
 
         if type(images) == list:
             # пауза между запросами
-            time.sleep(4)
+            with tracing.span('pause'):
+                time.sleep(PAUSE_BETWEEN_REQUESTS)
             return list(set(images))
 
+    except scheduler.SchedulerBusy:
+        raise
     except Exception as error_bing_img:
         my_log.log_bing_img(f'my_genimg:bing: {error_bing_img}')
 
     return []
 
 
-def gen_images_bing_only(prompt: str, iterations: int = 1, model: str = 'dalle', ar: Optional[str] = None) -> list:
+def gen_images_bing_only(prompt: str, iterations: int = 1, model: str = 'dalle', ar: Optional[str] = None,
+                         client_id: str = '', priority: int = scheduler.PRIORITY_INTERACTIVE,
+                         dedup: Optional['image_dedup.NearDupFilter'] = None, distinct: int = 0) -> list:
+    '''
+    dedup - фильтр почти одинаковых картинок, ему передаются все нарисованные картинки.
+    distinct - остановить повторы когда набралось столько разных картинок
+    (учитываются только уже посчитанные хеши, следующий повтор их не ждет)
+    '''
     if iterations == 0:
         iterations = 1
 
@@ -54,13 +84,25 @@ def gen_images_bing_only(prompt: str, iterations: int = 1, model: str = 'dalle',
 
     images = []
 
-    for _ in range(iterations):
-        r = bing(prompt, model=model, ar=ar)
+    for i in range(iterations):
+        try:
+            with tracing.span('iteration', index=i):
+                r = bing(prompt, model=model, ar=ar, client_id=client_id, priority=priority)
+        except scheduler.SchedulerBusy:
+            # если что-то уже нарисовали то отдаем что есть
+            if images:
+                break
+            raise
         if r:
             images += r
         else:
             break
 
+        if dedup is not None:
+            dedup.add(r)
+            if distinct and dedup.distinct_count() >= distinct:
+                break
+
     return images
 
 
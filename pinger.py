@@ -0,0 +1,222 @@
+# pinger.py
+# Background multi-target pinger for monitor.py.
+#
+# Pings every target (instance hosts, PING_TARGET, extra upstream hops) concurrently with
+# icmplib's async_multiping on its own thread and cadence, so a dead host never delays a
+# dashboard refresh. Keeps a rolling window of RTTs per target and reports loss, jitter
+# and p50/p95/p99 latency. Resolved addresses are refreshed every RESOLVE_TTL seconds and
+# after RERESOLVE_AFTER_LOST rounds without a reply, so a host that moved is found again.
+#
+# ICMP method is chosen automatically: raw sockets (root or cap_net_raw), then unprivileged
+# ICMP datagram sockets (Linux needs net.ipv4.ping_group_range to include the user's group),
+# then TCP connect time to the target's port, which works everywhere.
+
+
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from icmplib import async_multiping, async_resolve
+from icmplib.exceptions import ICMPLibError, SocketPermissionError
+
+from utils import percentile
+
+
+METHOD_ICMP = "icmp"
+METHOD_ICMP_UNPRIVILEGED = "icmp-unprivileged"
+METHOD_TCP = "tcp"
+
+# how long a resolved address is trusted, hosts may move to a new IP
+RESOLVE_TTL = 300.0
+# resolve again right away after this many rounds without a single reply
+RERESOLVE_AFTER_LOST = 3
+
+
+def targets_from_config(cfg: Any) -> List[Dict[str, Any]]:
+    """
+    Ping targets: PING_TARGET, PING_TARGETS (a list of hosts or {"name", "host", "port"} dicts,
+    e.g. upstream hops) and every instance host from MONITOR_INSTANCES unless PING_INSTANCES
+    is False. The same host is pinged only once.
+    """
+    targets: List[Dict[str, Any]] = []
+    seen = set()
+
+    def add(name: str, host: str, port: int) -> None:
+        if host and host not in seen:
+            seen.add(host)
+            targets.append({"name": name, "host": host, "port": port})
+
+    if getattr(cfg, "PING_TARGET", None):
+        add(cfg.PING_TARGET, cfg.PING_TARGET, 443)
+    for item in getattr(cfg, "PING_TARGETS", []):
+        if isinstance(item, dict):
+            add(item.get("name", item["host"]), item["host"], int(item.get("port", 443)))
+        else:
+            add(item, item, 443)
+    for instance in getattr(cfg, "MONITOR_INSTANCES", []) if getattr(cfg, "PING_INSTANCES", True) else []:
+        parts = urlsplit(instance["url"])
+        if parts.hostname:
+            add(instance["name"], parts.hostname, parts.port or (443 if parts.scheme == "https" else 80))
+    return targets
+
+
+class TargetStats:
+    """Rolling window of probe results for one target, None = lost."""
+
+    def __init__(self, window: int):
+        self.samples: Deque[Tuple[float, Optional[float]]] = deque(maxlen=window)
+
+    def add(self, rtts: List[Optional[float]]) -> None:
+        now = time.time()
+        for rtt in rtts:
+            self.samples.append((now, rtt))
+
+    def summary(self) -> Dict[str, Any]:
+        rtts = [x[1] for x in self.samples]
+        received = [x for x in rtts if x is not None]
+        result: Dict[str, Any] = {
+            "status": "online" if rtts and rtts[-1] is not None else ("offline" if rtts else "unknown"),
+            "latency": received[-1] if received else None,
+            "sent": len(rtts),
+            "loss": 1 - len(received) / len(rtts) if rtts else None,
+            # mean absolute difference between consecutive replies (RFC 3550 style)
+            "jitter": (sum(abs(a - b) for a, b in zip(received, received[1:])) / (len(received) - 1)
+                       if len(received) > 1 else None),
+        }
+        for p in (50, 95, 99):
+            result[f"p{p}"] = percentile(received, p) if received else None
+        return result
+
+    def history(self, points: int) -> List[Optional[float]]:
+        """Last `points` results, for sparklines."""
+        return [x[1] for x in list(self.samples)[-points:]]
+
+
+class Pinger:
+    """
+    Pings all targets every `interval` seconds on a background thread with its own event loop.
+    stats() and history() never block on the network.
+    """
+
+    def __init__(self, targets: List[Dict[str, Any]], interval: float = 2.0, count: int = 3,
+                 timeout: float = 1.0, window: int = 300, resolve_ttl: float = RESOLVE_TTL):
+        self.targets = targets
+        self.interval = interval
+        self.count = count
+        self.timeout = timeout
+        self.method = METHOD_ICMP
+        self.stats_by_name: Dict[str, TargetStats] = {x["name"]: TargetStats(window) for x in targets}
+        self.resolve_ttl = resolve_ttl
+        # host -> (address, when resolved)
+        self.addresses: Dict[str, Tuple[str, float]] = {}
+        # host -> rounds in a row without a reply
+        self.lost_rounds: Dict[str, int] = {}
+        # completed rounds, lets callers see cheaply whether anything changed
+        self.rounds = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=lambda: asyncio.run(self.run()), name="pinger", daemon=True)
+        self.thread.start()
+
+    async def resolve(self, host: str) -> Optional[str]:
+        """Cached address of host, refreshed after resolve_ttl. A failed lookup keeps the old address."""
+        cached = self.addresses.get(host)
+        if cached is None or time.monotonic() - cached[1] >= self.resolve_ttl:
+            try:
+                self.addresses[host] = ((await async_resolve(host))[0], time.monotonic())
+            except (ICMPLibError, OSError, IndexError):
+                return cached[0] if cached else None
+        return self.addresses[host][0]
+
+    def note_replies(self, results: Dict[str, List[Optional[float]]]) -> None:
+        """Forgets the address of hosts that stopped answering, the next round resolves them again."""
+        for target in self.targets:
+            host = target["host"]
+            rtts = results.get(target["name"], [])
+            if any(x is not None for x in rtts):
+                self.lost_rounds.pop(host, None)
+                continue
+            self.lost_rounds[host] = self.lost_rounds.get(host, 0) + 1
+            if self.lost_rounds[host] >= RERESOLVE_AFTER_LOST:
+                self.lost_rounds[host] = 0
+                self.addresses.pop(host, None)
+
+    async def icmp_round(self) -> Dict[str, List[Optional[float]]]:
+        by_address: Dict[str, List[str]] = {}
+        results: Dict[str, List[Optional[float]]] = {}
+        for target in self.targets:
+            address = await self.resolve(target["host"])
+            if address is None:
+                results[target["name"]] = [None]
+            else:
+                by_address.setdefault(address, []).append(target["name"])
+        if not by_address:
+            return results
+
+        while True:
+            try:
+                hosts = await async_multiping(
+                    list(by_address), count=self.count, interval=0.2, timeout=self.timeout,
+                    privileged=self.method == METHOD_ICMP)
+                break
+            except SocketPermissionError:
+                # no raw sockets: try unprivileged ICMP, then give up on ICMP altogether
+                if self.method == METHOD_ICMP:
+                    self.method = METHOD_ICMP_UNPRIVILEGED
+                else:
+                    self.method = METHOD_TCP
+                    return await self.tcp_round()
+
+        for host in hosts:
+            # packets without a reply are lost
+            rtts: List[Optional[float]] = list(host.rtts) + [None] * (host.packets_sent - host.packets_received)
+            for name in by_address.get(host.address, []):
+                results[name] = rtts
+        self.note_replies(results)
+        return results
+
+    async def tcp_probe(self, target: Dict[str, Any]) -> Optional[float]:
+        start = time.perf_counter()
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(target["host"], target["port"]), self.timeout)
+        except (OSError, asyncio.TimeoutError):
+            return None
+        rtt = (time.perf_counter() - start) * 1000
+        writer.close()
+        return rtt
+
+    async def tcp_round(self) -> Dict[str, List[Optional[float]]]:
+        rtts = await asyncio.gather(*(self.tcp_probe(x) for x in self.targets))
+        return {target["name"]: [rtt] for target, rtt in zip(self.targets, rtts)}
+
+    async def run(self) -> None:
+        while True:
+            started = time.monotonic()
+            try:
+                if self.method == METHOD_TCP:
+                    results = await self.tcp_round()
+                else:
+                    results = await self.icmp_round()
+                with self.lock:
+                    for name, rtts in results.items():
+                        self.stats_by_name[name].add(rtts)
+                    self.rounds += 1
+            except Exception:
+                # never let one bad round kill the pinger thread
+                pass
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """{target name: summary} for every target, plus the probing method."""
+        with self.lock:
+            return {name: dict(stats.summary(), method=self.method) for name, stats in self.stats_by_name.items()}
+
+    def history(self, name: str, points: int) -> List[Optional[float]]:
+        with self.lock:
+            return self.stats_by_name[name].history(points)
+
+
+if __name__ == "__main__":
+    pass
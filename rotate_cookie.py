@@ -3,6 +3,7 @@
 
 import os
 import traceback
+from typing import Callable, Dict, List, Optional
 
 from natsort import natsorted
 
@@ -11,6 +12,55 @@ import my_log
 
 # список найденных куки файлов
 FILES = []
+# из какого файла скопирован текущий cookie.txt
+CURRENT_COOKIE = ''
+
+# состояния куки файлов по результатам проверки cookie_check
+COOKIE_VALID = 'valid'
+COOKIE_EXPIRED = 'expired'
+COOKIE_BOOST_EXHAUSTED = 'boost_exhausted'
+COOKIE_UNKNOWN = 'unknown'
+# {имя файла: состояние}, файлы которых тут нет еще не проверялись
+COOKIE_STATES: Dict[str, str] = {}
+
+
+def find_cookie_files() -> List[str]:
+    '''Все cookie*.txt кроме cookie.txt, в натуральном порядке'''
+    return natsorted([f for f in os.listdir('.') if f.startswith('cookie') and f.endswith('.txt') and os.path.isfile(f) and f != 'cookie.txt'])
+
+
+def is_expired(name: str) -> bool:
+    return COOKIE_STATES.get(name) == COOKIE_EXPIRED
+
+
+def next_cookie(files: List[str], find: Callable[[], List[str]], states: Optional[Dict[str, str]] = None,
+                log: Callable[[str], None] = my_log.log2) -> str:
+    '''
+    Выбирает следующий куки: первый из очереди files (список меняется на месте), просроченные
+    по states пропускаются, когда очередь пустеет она заново заполняется из find(), log - куда писать.
+    Возвращает имя файла или '' если файлов нет. Файлы не трогает, поэтому то же
+    самое используется в симуляторе (capacity_sim.py).
+    '''
+    states = COOKIE_STATES if states is None else states
+
+    # просроченные куки пропускаем
+    while files and states.get(files[0]) == COOKIE_EXPIRED:
+        log(f'rotate_cookie: skip expired {files.pop(0)}')
+
+    if not files:
+        found = find()
+        alive = [f for f in found if states.get(f) != COOKIE_EXPIRED]
+        if alive:
+            files.extend(alive)
+        elif found:
+            # если проверка говорит что все просрочены то работаем как раньше, по кругу
+            log('rotate_cookie: all cookie files are expired')
+            files.extend(found)
+
+    if not files:
+        return ''
+    log('rotate_cookie: \n\n' + '\n'.join(files))
+    return files.pop(0)
 
 
 def rotate_cookie():
@@ -18,21 +68,18 @@ def rotate_cookie():
     Ищет .txt файлы с именем начинающимся на cookie и добавляет их все в список FILES
     из списка берет первый и копирует в cookie.txt
     Если список пустеет то снова ищет все файлы
+    Файлы которые cookie_check пометил как просроченные пропускаются
     '''
     try:
-        global FILES
-
-        if not FILES:
-            FILES = [f for f in os.listdir('.') if f.startswith('cookie') and f.endswith('.txt') and os.path.isfile(f) and f != 'cookie.txt']
-            FILES = natsorted(FILES)
+        global CURRENT_COOKIE
 
-        if FILES:
-            my_log.log2('rotate_cookie: \n\n' + '\n'.join(FILES))
-            source_name = FILES.pop(0)
+        source_name = next_cookie(FILES, find_cookie_files)
+        if source_name:
             with open(source_name, 'r') as source:
                 with open('cookie.txt', 'w') as target:
                     target.write(source.read())
                     my_log.log2(f'rotate_cookie: {source_name} -> cookie.txt')
+            CURRENT_COOKIE = source_name
         else:
             my_log.log2('rotate_cookie: no cookie files found')
 
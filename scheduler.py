@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# Очередь запросов к бингу с приоритетами и честным разделением между клиентами.
+# Заменяет простой BING_LOCK у которого не было никакого порядка - кто первый схватил тот и рисует.
+
+
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+import cfg  # type: ignore
+from utils import percentile
+
+
+# классы приоритета, меньше - важнее
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: 'interactive', PRIORITY_BULK: 'bulk'}
+
+# сколько запросов один клиент может держать в очереди и в работе одновременно
+MAX_PER_CLIENT = getattr(cfg, 'SCHEDULER_MAX_PER_CLIENT', 10)
+# веса клиентов, {client_id: weight}, по умолчанию у всех 1
+CLIENT_WEIGHTS: Dict[str, float] = getattr(cfg, 'SCHEDULER_CLIENT_WEIGHTS', {})
+# минимальная доля слотов для ждущих запросов менее важного класса (bulk), даже если
+# интерактивные запросы идут без перерыва; 0 - строгий приоритет
+BULK_SHARE = getattr(cfg, 'SCHEDULER_BULK_SHARE', 0.2)
+
+# сколько последних времен ожидания хранить для перцентилей
+WAIT_HISTORY_SIZE = 500
+
+
+class SchedulerBusy(Exception):
+    """У клиента уже слишком много запросов в очереди."""
+
+
+class FairQueue:
+    """
+    Очередь с классами приоритета и weighted fair queuing по клиентам внутри класса.
+
+    Каждому элементу назначается виртуальное время окончания
+    finish = max(virtual_time, последний finish клиента) + 1 / weight,
+    внутри класса из очереди берется элемент с наименьшим finish. Клиент который
+    завалил очередь своими запросами получает свою долю, но не больше.
+
+    Из классов берется самый важный, но класс который ждет и которого обошли
+    max_passes раз подряд обслуживается вне очереди: при lower_share = 0.2 ждущие bulk
+    запросы получают хотя бы каждый пятый слот и не ждут вечно под постоянным потоком
+    интерактивных. lower_share = 0 - строгий приоритет.
+
+    Потоков тут нет, блокировки на стороне вызывающего (FairScheduler, симулятор).
+    """
+
+    def __init__(self, weights: Optional[Dict[str, float]] = None, lower_share: float = BULK_SHARE):
+        self.weights = weights or {}
+        # (finish, seq, item) по классам
+        self.heaps: Dict[int, List[Tuple[float, int, Any]]] = {}
+        self.max_passes: Optional[int] = max(0, round(1 / lower_share) - 1) if lower_share > 0 else None
+        # сколько раз подряд ждущий класс обошли более важным
+        self.passed_over: Dict[int, int] = {}
+        self.counter = itertools.count()
+        # виртуальное время и последние finish клиентов, отдельно для каждого класса
+        self.virtual_time: Dict[int, float] = {}
+        self.last_finish: Dict[Tuple[int, str], float] = {}
+        self.start_tags: Dict[int, float] = {}
+        # (finish, client_id) по классам, чтобы удалять из last_finish клиентов которые
+        # отстали от виртуального времени - их finish уже ни на что не влияет
+        self.finish_heaps: Dict[int, List[Tuple[float, str]]] = {}
+        self.queued: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return sum(len(x) for x in self.heaps.values())
+
+    def items(self) -> List[Any]:
+        return [x[2] for heap in self.heaps.values() for x in heap]
+
+    def push(self, item: Any, client_id: str, priority: int = PRIORITY_INTERACTIVE) -> None:
+        weight = self.weights.get(client_id, 1.0) or 1.0
+        start = max(self.virtual_time.get(priority, 0.0), self.last_finish.get((priority, client_id), 0.0))
+        finish = start + 1.0 / weight
+        self.last_finish[(priority, client_id)] = finish
+        heapq.heappush(self.finish_heaps.setdefault(priority, []), (finish, client_id))
+        self.queued[priority] = self.queued.get(priority, 0) + 1
+        seq = next(self.counter)
+        self.start_tags[seq] = start
+        heapq.heappush(self.heaps.setdefault(priority, []), (finish, seq, item))
+
+    def pop(self) -> Any:
+        waiting = sorted(x for x, heap in self.heaps.items() if heap)
+        priority = waiting[0]
+        if self.max_passes is not None:
+            for lower in waiting[1:]:
+                if self.passed_over.get(lower, 0) >= self.max_passes:
+                    priority = lower
+                    break
+        for other in waiting:
+            self.passed_over[other] = 0 if other == priority else self.passed_over.get(other, 0) + 1
+
+        _, seq, item = heapq.heappop(self.heaps[priority])
+        virtual_time = max(self.virtual_time.get(priority, 0.0), self.start_tags.pop(seq))
+        self.queued[priority] -= 1
+        if not self.queued[priority]:
+            # класс опустел - все клиенты получили свое, следующие начинают с одного места
+            virtual_time = max([virtual_time] + [x[0] for x in self.finish_heaps.get(priority, [])])
+        self.virtual_time[priority] = virtual_time
+        self._prune(priority, virtual_time)
+        return item
+
+    def _prune(self, priority: int, virtual_time: float) -> None:
+        """
+        Забывает клиентов класса у которых последний finish не больше виртуального времени,
+        для них start = virtual_time и без записи. Иначе каждый новый client_id (ключ, IP)
+        оставался бы в last_finish навсегда.
+        """
+        heap = self.finish_heaps.get(priority, [])
+        while heap and heap[0][0] <= virtual_time:
+            finish, client_id = heapq.heappop(heap)
+            # у клиента мог появиться более поздний finish, тогда запись еще нужна
+            if self.last_finish.get((priority, client_id)) == finish:
+                del self.last_finish[(priority, client_id)]
+
+    def length_by_priority(self) -> Dict[int, int]:
+        return {priority: len(heap) for priority, heap in self.heaps.items() if heap}
+
+
+class Ticket:
+    """Один запрос в очереди."""
+
+    def __init__(self, client_id: str, priority: int):
+        self.client_id = client_id
+        self.priority = priority
+        self.enqueued = time.time()
+        self.started = 0.0
+        self.granted = False
+        self.thread_id = threading.get_ident()
+
+
+class FairScheduler:
+    """
+    Выдает слоты на работу с бингом в порядке FairQueue.
+
+    capacity - сколько запросов могут рисовать одновременно (1 - как старый BING_LOCK).
+    """
+
+    def __init__(self, capacity: int = 1, max_per_client: int = MAX_PER_CLIENT,
+                 weights: Optional[Dict[str, float]] = None):
+        self.capacity = capacity
+        self.max_per_client = max_per_client
+        self.queue = FairQueue(weights if weights is not None else CLIENT_WEIGHTS)
+        self.cond = threading.Condition()
+        self.running: List[Ticket] = []
+        self.per_client: Dict[str, int] = {}
+        self.served: Dict[str, int] = {}
+        self.rejected = 0
+        self.wait_times: Dict[int, Deque[float]] = {
+            x: deque(maxlen=WAIT_HISTORY_SIZE) for x in PRIORITY_NAMES
+        }
+
+    def _dispatch(self) -> None:
+        """Раздает свободные слоты следующим в очереди. Вызывать под self.cond."""
+        while len(self.running) < self.capacity and len(self.queue):
+            ticket = self.queue.pop()
+            ticket.granted = True
+            ticket.started = time.time()
+            self.running.append(ticket)
+            self.wait_times.setdefault(ticket.priority, deque(maxlen=WAIT_HISTORY_SIZE)).append(
+                ticket.started - ticket.enqueued)
+        self.cond.notify_all()
+
+    @contextmanager
+    def slot(self, client_id: str = '', priority: int = PRIORITY_INTERACTIVE) -> Iterator[Ticket]:
+        """
+        Ждет своей очереди и держит слот пока выполняется блок with.
+        Бросает SchedulerBusy если у клиента уже max_per_client запросов.
+        """
+        with self.cond:
+            if self.per_client.get(client_id, 0) >= self.max_per_client:
+                self.rejected += 1
+                raise SchedulerBusy(f'Too many requests in queue for client {client_id}')
+            self.per_client[client_id] = self.per_client.get(client_id, 0) + 1
+            ticket = Ticket(client_id, priority)
+            self.queue.push(ticket, client_id, priority)
+            self._dispatch()
+            while not ticket.granted:
+                self.cond.wait()
+
+        try:
+            yield ticket
+        finally:
+            with self.cond:
+                self.running.remove(ticket)
+                self.per_client[client_id] -= 1
+                if not self.per_client[client_id]:
+                    del self.per_client[client_id]
+                self.served[client_id] = self.served.get(client_id, 0) + 1
+                self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        """Состояние очереди и время ожидания по классам приоритета для /status."""
+        with self.cond:
+            queued = self.queue.length_by_priority()
+            now = time.time()
+            return {
+                "capacity": self.capacity,
+                "running": [
+                    {"client": x.client_id, "priority": PRIORITY_NAMES.get(x.priority, x.priority),
+                     "running_for": round(now - x.started, 1)}
+                    for x in self.running
+                ],
+                "queued": {PRIORITY_NAMES.get(k, k): v for k, v in queued.items()},
+                "clients": dict(self.per_client),
+                "served": dict(self.served),
+                "rejected": self.rejected,
+                "queue_time": {
+                    PRIORITY_NAMES.get(k, k): {
+                        "p50": round(percentile(list(v), 50), 2),
+                        "p95": round(percentile(list(v), 95), 2),
+                        "count": len(v),
+                    }
+                    for k, v in self.wait_times.items()
+                },
+            }
+
+    def threads(self) -> Dict[int, Dict[str, Any]]:
+        """Какие потоки держат слоты и какие ждут в очереди, {thread_id: описание} для /admin/threads."""
+        with self.cond:
+            now = time.time()
+            result = {}
+            for ticket in self.queue.items():
+                result[ticket.thread_id] = {
+                    "scheduler": "queued", "client": ticket.client_id,
+                    "priority": PRIORITY_NAMES.get(ticket.priority, ticket.priority),
+                    "for": round(now - ticket.enqueued, 1),
+                }
+            for ticket in self.running:
+                result[ticket.thread_id] = {
+                    "scheduler": "holds_slot", "client": ticket.client_id,
+                    "priority": PRIORITY_NAMES.get(ticket.priority, ticket.priority),
+                    "for": round(now - ticket.started, 1),
+                }
+            return result
+
+
+if __name__ == '__main__':
+    pass
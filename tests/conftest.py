@@ -0,0 +1,20 @@
+# Тесты запускаются из корня репозитория: python -m pytest -q
+# cfg.py у каждого свой и в репозиторий не входит, поэтому если его нет то подставляется
+# пустой модуль - у всех настроек, которые нужны тестируемым модулям, есть значения по умолчанию.
+# Модули пишут logs/, jobs.db и т.п. в текущий каталог, поэтому тесты идут во временном.
+
+
+import os
+import sys
+import tempfile
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+os.chdir(tempfile.mkdtemp(prefix='bing10api-tests-'))
+
+try:
+    import cfg  # type: ignore  # noqa: F401
+except ImportError:
+    sys.modules['cfg'] = types.ModuleType('cfg')
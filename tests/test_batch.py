@@ -0,0 +1,143 @@
+import json
+import threading
+import time
+from collections import deque
+
+import pytest
+
+import bing10api
+import cookie_policy
+import my_genimg
+import scheduler
+
+
+@pytest.fixture
+def service(monkeypatch):
+    """generate() без бинга: gen_images_bing_only подменяется, куки уже выбран."""
+    calls = []
+    lock = threading.Lock()
+    state = {"running": 0, "max_running": 0, "fail": set()}
+
+    def gen_images_bing_only(prompt, iterations=1, model='dalle', ar=None, client_id='',
+                             priority=scheduler.PRIORITY_INTERACTIVE, dedup=None, distinct=0):
+        with lock:
+            calls.append({"prompt": prompt, "iterations": iterations, "model": model, "ar": ar,
+                          "priority": priority, "dedup": dedup is not None, "distinct": distinct})
+            state['running'] += 1
+            state['max_running'] = max(state['max_running'], state['running'])
+        time.sleep(0.05)
+        with lock:
+            state['running'] -= 1
+        if prompt in state['fail']:
+            return []
+        return [f'https://img/{prompt}/{x}' for x in range(iterations)]
+
+    monkeypatch.setattr(my_genimg, 'gen_images_bing_only', gen_images_bing_only)
+    monkeypatch.setattr(bing10api, 'COOKIE_INITIALIZED', True)
+    monkeypatch.setattr(bing10api, 'POLICY', cookie_policy.CookiePolicy())
+    monkeypatch.setattr(bing10api, 'FAILED_PROMPTS', deque(maxlen=100))
+    monkeypatch.setattr(bing10api.image_store, 'ENABLED', False)
+    return calls, state
+
+
+def test_parse_defaults_and_limits():
+    items, error = bing10api.parse_batch_items([{"prompt": "cat", "iterations": 100}, {"prompt": "dog", "iterations": 0}])
+    assert error == ''
+    assert [x['iterations'] for x in items] == [bing10api.MAX_BATCH_ITERATIONS, 1]
+    assert items[0]['model'] == 'dalle'
+    assert items[0]['dedup_images'] == '' and items[0]['distinct'] == 0
+    assert [x['index'] for x in items] == [0, 1]
+
+
+@pytest.mark.parametrize('items, error', [
+    ([], 'items must be a non-empty list'),
+    ({"prompt": "cat"}, 'items must be a non-empty list'),
+    ([{"prompt": "cat"}] * (bing10api.MAX_BATCH_ITEMS + 1), 'Too many items'),
+    ([{"prompt": "cat"}, {"model": "dalle"}], 'Item 1: prompt is required'),
+    ([{"prompt": "cat", "model": "sd"}], 'Item 0: unknown model sd'),
+    ([{"prompt": "cat", "iterations": "x"}], 'Item 0: iterations and distinct must be integers'),
+    ([{"prompt": "cat", "dedup_images": "keep"}], "Item 0: dedup_images must be 'drop' or 'group'"),
+    ([{"prompt": "cat", "distinct": 2}], 'Item 0: distinct requires dedup_images'),
+])
+def test_parse_errors(items, error):
+    assert bing10api.parse_batch_items(items)[1].startswith(error)
+
+
+def test_one_generate_per_item_with_all_iterations(service):
+    calls, _ = service
+    items, _ = bing10api.parse_batch_items([{"prompt": "cat", "iterations": 10}, {"prompt": "dog", "model": "gpt4o"}])
+    results = sorted(bing10api.run_batch(items, 'client'), key=lambda x: x['index'])
+    assert len(calls) == 2
+    cat = next(x for x in calls if x['prompt'] == 'cat')
+    assert cat['iterations'] == 10 and cat['priority'] == scheduler.PRIORITY_BULK
+    assert len(results[0]['urls']) == 10
+    assert results[1]['urls'] == ['https://img/dog/0']
+
+
+def test_failed_item_is_one_cookie_failure(service):
+    calls, state = service
+    state['fail'].add('cat')
+    items, _ = bing10api.parse_batch_items([{"prompt": "cat", "iterations": 10}])
+    results = list(bing10api.run_batch(items, 'client'))
+    assert results == [{"index": 0, "error": "No images generated"}]
+    assert bing10api.POLICY.total_fail == 1
+    assert [x['prompt'] for x in bing10api.FAILED_PROMPTS] == ['cat']
+
+
+def test_same_items_drawn_once(service):
+    calls, _ = service
+    items, _ = bing10api.parse_batch_items([{"prompt": "cat"}, {"prompt": "dog"}, {"prompt": "cat"}])
+    results = sorted(bing10api.run_batch(items), key=lambda x: x['index'])
+    assert len(calls) == 2
+    assert results[0]['urls'] == results[2]['urls']
+
+
+def test_items_dispatched_up_to_inflight_depth(service, monkeypatch):
+    _, state = service
+    monkeypatch.setattr(my_genimg, 'INFLIGHT_DEPTH', 3)
+    items, _ = bing10api.parse_batch_items([{"prompt": f"p{x}"} for x in range(6)])
+    assert len(list(bing10api.run_batch(items))) == 6
+    assert state['max_running'] == 3
+
+
+def test_item_options_forwarded(service, monkeypatch):
+    calls, _ = service
+    monkeypatch.setattr(bing10api.image_dedup, 'AVAILABLE', True)
+    monkeypatch.setattr(bing10api.image_dedup, 'NearDupFilter', lambda use_store: FakeFilter())
+    items, _ = bing10api.parse_batch_items([{"prompt": "cat", "iterations": 3, "dedup_images": "drop", "distinct": 2}])
+    results = list(bing10api.run_batch(items))
+    assert calls[0]['dedup'] and calls[0]['distinct'] == 2
+    assert results[0]['urls'] == ['https://img/cat/0']
+
+
+class FakeFilter:
+    def distinct(self):
+        return ['https://img/cat/0']
+
+
+def test_endpoint_results_in_request_order(service):
+    client = bing10api.FLASK_APP.test_client()
+    response = client.post('/bing_batch', json={"items": [{"prompt": "cat"}, {"prompt": "dog"}]})
+    assert response.status_code == 200
+    assert [x['index'] for x in response.get_json()['results']] == [0, 1]
+
+
+def test_endpoint_stream(service):
+    client = bing10api.FLASK_APP.test_client()
+    response = client.post('/bing_batch', json={"items": [{"prompt": "cat"}, {"prompt": "dog"}], "stream": True})
+    lines = [json.loads(x) for x in response.get_data(as_text=True).splitlines()]
+    assert sorted(x['index'] for x in lines) == [0, 1]
+
+
+def test_endpoint_bad_items():
+    client = bing10api.FLASK_APP.test_client()
+    response = client.post('/bing_batch', json={"items": []})
+    assert response.status_code == 400
+
+
+def test_distinct_requires_dedup_images(service):
+    calls, _ = service
+    result, code = bing10api.generate({"prompt": "cat", "distinct": 2}, 10)
+    assert code == 400
+    assert 'distinct requires dedup_images' in result['error']
+    assert not calls
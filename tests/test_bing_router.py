@@ -0,0 +1,85 @@
+import cfg  # type: ignore
+import pytest
+
+if not hasattr(cfg, 'MONITOR_INSTANCES'):
+    cfg.MONITOR_INSTANCES = []
+
+import bing_router
+
+
+class FakeResponse:
+    def __init__(self, status_code):
+        self.status_code = status_code
+        self.headers = {'Content-Type': 'application/json'}
+        self.closed = False
+
+    def iter_content(self, chunk_size=None):
+        yield b'{"code": %d}' % self.status_code
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession:
+    def __init__(self, codes):
+        # base_url -> код ответа
+        self.codes = codes
+        self.calls = []
+
+    def post(self, url, **kwargs):
+        base = url.rsplit('/', 1)[0]
+        self.calls.append(base)
+        return FakeResponse(self.codes[base])
+
+
+@pytest.fixture
+def instances(monkeypatch):
+    items = [bing_router.Instance(f'i{x}', f'http://i{x}/status') for x in range(3)]
+    for item in items:
+        item.online = True
+        item.service_status = 'OK'
+    monkeypatch.setattr(bing_router, 'INSTANCES', items)
+    monkeypatch.setattr(bing_router, 'MAX_RETRIES', 1)
+    return items
+
+
+def post(session, monkeypatch):
+    monkeypatch.setattr(bing_router, 'SESSION', session)
+    client = bing_router.FLASK_APP.test_client()
+    response = client.post('/bing', json={"prompt": "cat"})
+    response.close()
+    return response
+
+
+def test_404_retried_on_other_instance(instances, monkeypatch):
+    session = FakeSession({'http://i0': 404, 'http://i1': 200, 'http://i2': 200})
+    response = post(session, monkeypatch)
+    assert response.status_code == 200
+    assert session.calls == ['http://i0', 'http://i1']
+    assert all(x.in_flight == 0 for x in instances)
+
+
+def test_retries_are_bounded(instances, monkeypatch):
+    session = FakeSession({'http://i0': 404, 'http://i1': 500, 'http://i2': 200})
+    response = post(session, monkeypatch)
+    assert response.status_code == 500
+    assert session.calls == ['http://i0', 'http://i1']
+    assert all(x.in_flight == 0 for x in instances)
+
+
+def test_404_not_retried_on_unhealthy_instance(instances, monkeypatch):
+    instances[1].service_status = 'SUSPENDED'
+    instances[2].online = False
+    session = FakeSession({'http://i0': 404, 'http://i1': 200, 'http://i2': 200})
+    response = post(session, monkeypatch)
+    assert response.status_code == 404
+    assert session.calls == ['http://i0']
+
+
+def test_5xx_retried_on_any_online_instance(instances, monkeypatch):
+    instances[1].service_status = 'SUSPENDED'
+    instances[2].online = False
+    session = FakeSession({'http://i0': 502, 'http://i1': 200, 'http://i2': 200})
+    response = post(session, monkeypatch)
+    assert response.status_code == 200
+    assert session.calls == ['http://i0', 'http://i1']
@@ -0,0 +1,99 @@
+import json
+import sqlite3
+
+import pytest
+
+capacity_sim = pytest.importorskip('capacity_sim')
+import scheduler
+
+
+def test_few_attempts_fall_back_to_defaults():
+    model = capacity_sim.fit_cookie('cookie1.txt', [(1.0, True), (2.0, True)])
+    assert model.success == capacity_sim.DEFAULT_SUCCESS
+    assert model.outage_rate == capacity_sim.DEFAULT_OUTAGE_RATE
+    assert model.attempts == 2
+
+
+def test_enough_attempts_are_fitted():
+    attempts = [(float(x), True) for x in range(capacity_sim.MIN_ATTEMPTS)]
+    model = capacity_sim.fit_cookie('cookie1.txt', attempts)
+    assert model.success == 1.0
+
+
+def write_traces(path, endpoints):
+    with open(path, 'w', encoding='utf-8') as f:
+        for i, endpoint in enumerate(endpoints):
+            attrs = {"endpoint": endpoint, "iterations": 10 if endpoint == '/bing10' else 1}
+            span = {"name": "request", "parent_id": 0, "start": 1000.0 + i * 30, "duration_ms": 1000, "attrs": attrs}
+            f.write(json.dumps({"spans": [span]}) + '\n')
+
+
+def test_priority_mix_from_traced_endpoints(tmp_path):
+    traces = tmp_path / 'traces.jsonl'
+    write_traces(traces, ['/bing', '/bing10', '/bing', '/bing10'])
+    inputs = capacity_sim.fit_inputs(str(tmp_path / 'logs'), str(tmp_path / 'jobs.db'), str(traces))
+    assert inputs.priorities == [scheduler.PRIORITY_INTERACTIVE, scheduler.PRIORITY_BULK] * 2
+    assert inputs.iterations == [1, 10, 1, 10]
+    assert inputs.to_dict()['bulk_share'] == 0.5
+
+
+def test_queue_wait_per_priority(tmp_path):
+    traces = tmp_path / 'traces.jsonl'
+    write_traces(traces, ['/bing', '/bing10'] * 20)
+    inputs = capacity_sim.fit_inputs(str(tmp_path / 'logs'), str(tmp_path / 'jobs.db'), str(traces))
+    runs = [capacity_sim.Simulation(inputs, dict(capacity_sim.PARAMS, inflight_depth=1), 0, 3600, 4, 1.0).run()]
+    summary = capacity_sim.summarize(runs)
+    assert summary['queue_wait_interactive_p95'] <= summary['queue_wait_bulk_p95']
+    assert runs[0].waits[scheduler.PRIORITY_BULK]
+
+
+def write_log(path, attempts):
+    entries = []
+    for ts, ok in attempts:
+        stamp = capacity_sim.datetime.datetime.fromtimestamp(ts).strftime(capacity_sim.LOG_TIME_FORMAT)
+        message = "bing_genimg_v3:process: ['https://x']" if ok else 'bing_genimg_v3:process: []'
+        entries.append(f'{stamp}\n\n{message}\n')
+    path.write_text(('\n' + capacity_sim.LOG_SEPARATOR + '\n').join(entries), encoding='utf-8')
+
+
+def test_render_fail_share_and_times_from_journal(tmp_path):
+    logs = tmp_path / 'logs'
+    logs.mkdir()
+    # 4 неудачи в логе, 1 из них - принятое бингом и не дорисованное задание
+    write_log(logs / 'debug_bing_api.log', [(2000.0 + x * 100, x % 2 == 0) for x in range(8)])
+    conn = sqlite3.connect(tmp_path / 'jobs.db')
+    conn.execute('CREATE TABLE jobs (cookie TEXT, model TEXT, created REAL, finished REAL, state TEXT)')
+    conn.execute('INSERT INTO jobs VALUES (?, ?, ?, ?, ?)', ('cookie.txt', 'gpt4o', 1000.0, 1240.0, 'failed'))
+    conn.execute('INSERT INTO jobs VALUES (?, ?, ?, ?, ?)', ('cookie.txt', 'dalle', 1000.0, 1020.0, 'consumed'))
+    conn.commit()
+    conn.close()
+    inputs = capacity_sim.fit_inputs(str(logs), str(tmp_path / 'jobs.db'), str(tmp_path / 'none.jsonl'))
+    assert inputs.render_fail_share == 0.25
+    assert inputs.render_fail_times('gpt4o') == [240.0]
+    # для dalle неудач в журнале нет - опрос до max_wait_time
+    assert inputs.render_fail_times('dalle') == [capacity_sim.bing_genimg_v3.DALLE_MAX_WAIT_TIME]
+
+
+def failing_inputs(render_fail_share):
+    inputs = capacity_sim.Inputs()
+    inputs.cookies = {'cookie1.txt': capacity_sim.CookieModel('cookie1.txt', success=0.0, outage_rate=0.0)}
+    inputs.render_fail_share = render_fail_share
+    return inputs
+
+
+def test_render_failures_poll_until_deadline():
+    params = dict(capacity_sim.PARAMS, max_fail_for_terminate=10 ** 6)
+    run = capacity_sim.Simulation(failing_inputs(1.0), params, 0, 3600, 1, 1 / 120).run()
+    summary = capacity_sim.summarize([run])
+    assert run.stats['wasted_polls'] == run.stats['polls'] > 0
+    assert run.stats['wasted_submits'] == run.stats['submits']
+    assert summary['failed_latency_p95'] >= capacity_sim.bing_genimg_v3.DALLE_MAX_WAIT_TIME
+
+
+def test_rejected_submits_do_not_poll():
+    params = dict(capacity_sim.PARAMS, max_fail_for_terminate=10 ** 6)
+    run = capacity_sim.Simulation(failing_inputs(0.0), params, 0, 3600, 1, 1 / 120).run()
+    assert run.stats['polls'] == 0
+    # rt=4 и повтор rt=3
+    assert run.stats['submits'] == 2 * run.stats['failed']
+    assert capacity_sim.summarize([run])['failed_latency_p95'] < 10
@@ -0,0 +1,34 @@
+import os
+
+import pytest
+
+import bing_genimg_v3
+import cassette
+import cookie_check
+import rotate_cookie
+
+CASSETTES = os.path.join(os.path.dirname(__file__), 'cassettes')
+
+
+def check(name: str):
+    adapter = cassette.ReplayAdapter(os.path.join(CASSETTES, name))
+    return bing_genimg_v3.BingBrush(cookie='', adapter=adapter).check_account()
+
+
+@pytest.mark.parametrize('name, state, boosts', [
+    ('account_signed_in.json', rotate_cookie.COOKIE_VALID, 15),
+    ('account_no_boosts.json', rotate_cookie.COOKIE_BOOST_EXHAUSTED, 0),
+    ('account_signed_out.json', rotate_cookie.COOKIE_EXPIRED, None),
+    # незнакомая страница не делает куки просроченным
+    ('account_unknown_layout.json', rotate_cookie.COOKIE_UNKNOWN, None),
+])
+def test_check_account(name, state, boosts):
+    assert check(name) == {"state": state, "boosts": boosts}
+
+
+def test_status_snapshot_is_a_copy(monkeypatch):
+    monkeypatch.setattr(cookie_check, 'STATUS', {'cookie1.txt': {"state": rotate_cookie.COOKIE_VALID}})
+    snapshot = cookie_check.snapshot()
+    cookie_check.STATUS['cookie2.txt'] = {}
+    cookie_check.STATUS['cookie1.txt']['state'] = rotate_cookie.COOKIE_EXPIRED
+    assert snapshot == {'cookie1.txt': {"state": rotate_cookie.COOKIE_VALID}}
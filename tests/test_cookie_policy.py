@@ -0,0 +1,74 @@
+from cookie_policy import ACTIVE, JUST_SUSPENDED, SUSPENDED, CookiePolicy
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def make_policy(**kwargs):
+    clock = Clock()
+    events = []
+    policy = CookiePolicy(max_fail=2, max_fail_for_terminate=4, suspend_time=60,
+                          rotate=lambda: events.append('rotate'), clock=clock,
+                          on_suspend=lambda: events.append('suspend'),
+                          on_resume=lambda: events.append('resume'), **kwargs)
+    return policy, clock, events
+
+
+def test_rotates_after_max_fail():
+    policy, _, events = make_policy()
+    assert policy.failure() is False
+    assert policy.failure() is True
+    assert events == ['rotate']
+    assert policy.fail == 0
+    assert policy.total_fail == 2
+
+
+def test_success_resets_counters():
+    policy, _, events = make_policy()
+    policy.failure()
+    policy.success()
+    assert policy.failure() is False
+    assert (policy.fail, policy.total_fail) == (1, 1)
+    assert events == []
+
+
+def test_cookie_changed_keeps_total():
+    policy, _, _ = make_policy()
+    policy.failure()
+    policy.cookie_changed()
+    assert (policy.fail, policy.total_fail) == (0, 1)
+
+
+def test_suspend_and_resume():
+    policy, clock, events = make_policy()
+    for _ in range(4):
+        assert policy.check() == (ACTIVE, 0.0)
+        policy.failure()
+    # выключается на следующем запросе, а не сразу после неудачи
+    assert events == ['rotate', 'rotate']
+    assert policy.check() == (JUST_SUSPENDED, 60)
+    assert policy.suspensions == 1
+
+    clock.now += 10
+    assert policy.check() == (SUSPENDED, 50)
+    assert policy.seconds_to_restart() == 50
+
+    clock.now += 50
+    assert policy.check() == (ACTIVE, 0.0)
+    assert events == ['rotate', 'rotate', 'suspend', 'resume']
+    assert (policy.fail, policy.total_fail, policy.suspend_until) == (0, 0, 0.0)
+    assert policy.seconds_to_restart() == 0.0
+
+
+def test_reset_cancels_pending_suspend():
+    policy, _, events = make_policy()
+    for _ in range(4):
+        policy.failure()
+    policy.reset()
+    assert policy.check() == (ACTIVE, 0.0)
+    assert 'suspend' not in events
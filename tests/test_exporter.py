@@ -0,0 +1,64 @@
+import exporter
+
+
+def metric_lines(text):
+    return [x for x in text.splitlines() if x and not x.startswith("#")]
+
+
+def test_metric_names_help_and_type():
+    snapshot = {
+        "instances": [{"name": "a", "online": True, "service_status": "OK", "cookie_fail_count": 1,
+                       "max_fail_for_rotate": 3, "total_fail_count": 2, "max_fail_for_suspend": 10,
+                       "active_requests": 0, "success_rate": 0.5}],
+        "failed_prompts": ["cat"],
+        "timestamp": 1700000000.5,
+    }
+    text = exporter.prometheus_text(snapshot)
+    assert "# HELP bing_fleet_instance_up 1 if the instance answered /status\n" in text
+    assert "# TYPE bing_fleet_instance_up gauge\n" in text
+    lines = metric_lines(text)
+    assert 'bing_fleet_instance_up{instance="a"} 1' in lines
+    assert 'bing_fleet_recent_success_ratio{instance="a"} 0.5' in lines
+    assert "bing_fleet_failed_prompts 1" in lines
+    assert "bing_fleet_snapshot_timestamp_seconds 1700000000.5" in lines
+    assert all(x.startswith(exporter.PREFIX + "_") for x in lines)
+    assert text.endswith("\n")
+
+
+def test_label_escaping():
+    assert exporter.escape_label('a\\b"c\nd') == 'a\\\\b\\"c\\nd'
+    text = exporter.prometheus_text({"instances": [{"name": 'x"y\\z\nw', "online": False}]})
+    assert 'bing_fleet_instance_up{instance="x\\"y\\\\z\\nw"} 0' in metric_lines(text)
+
+
+def test_none_and_absent_values_skipped():
+    snapshot = {
+        "instances": [{"name": "a", "online": True, "service_status": "OK", "success_rate": None},
+                      {"name": "b", "online": False}],
+        "queue": {"size": -1, "rate": 0.0},
+        "ping": {"t": {"status": "unknown", "method": "icmp"}},
+    }
+    text = exporter.prometheus_text(snapshot)
+    lines = metric_lines(text)
+    # metrics without any sample get no HELP/TYPE either
+    assert "recent_success_ratio" not in text
+    assert "cookie_fail_count" not in text
+    assert "queue_size" not in text
+    assert "ping_up" not in text
+    assert "snapshot_timestamp_seconds" not in text
+    # offline instances only report instance_up
+    assert not any('instance="b"' in x for x in lines if not x.startswith("bing_fleet_instance_up"))
+    assert 'bing_fleet_instance_up{instance="b"} 0' in lines
+
+
+def test_ping_quantiles():
+    stats = {"status": "online", "method": "tcp", "latency": 12.5, "p50": 10, "p95": None, "p99": 30,
+             "loss": 0.0, "jitter": 1.0}
+    lines = metric_lines(exporter.prometheus_text({"ping": {"gw": stats}}))
+    assert 'bing_fleet_ping_latency_quantile_ms{target="gw",method="tcp",quantile="0.5"} 10' in lines
+    assert not any('quantile="0.95"' in x for x in lines)
+    assert 'bing_fleet_ping_up{target="gw",method="tcp"} 1' in lines
+
+
+def test_empty_snapshot():
+    assert metric_lines(exporter.prometheus_text({})) == ["bing_fleet_failed_prompts 0"]
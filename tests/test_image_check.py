@@ -0,0 +1,126 @@
+import os
+import time
+
+import pytest
+
+import bing_genimg_v3
+import cassette
+import image_check
+
+CASSETTES = os.path.join(os.path.dirname(__file__), 'cassettes')
+BIG = str(image_check.MIN_BYTES * 10)
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+class FakeSession:
+    """{url: (ответ на HEAD, ответ на GET)}, запоминает запросы и таймауты."""
+
+    def __init__(self, pages, delay=0.0):
+        self.pages = pages
+        self.delay = delay
+        self.calls = []
+
+    def head(self, url, timeout, **kwargs):
+        self.calls.append(('HEAD', url, timeout))
+        time.sleep(self.delay)
+        return self.pages[url][0]
+
+    def get(self, url, timeout, **kwargs):
+        self.calls.append(('GET', url, timeout))
+        time.sleep(self.delay)
+        return self.pages[url][1]
+
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.setattr(image_check, 'ENABLED', True)
+    monkeypatch.setattr(image_check, 'CACHE', {})
+
+    def install(pages, delay=0.0):
+        fake = FakeSession(pages, delay)
+        monkeypatch.setattr(image_check.image_store, 'SESSION', fake)
+        return fake
+    return install
+
+
+def test_ranged_get_after_405(session):
+    fake = session({'https://a/1': (FakeResponse(405), FakeResponse(206, {
+        'Content-Type': 'image/jpeg', 'Content-Range': f'bytes 0-0/{BIG}'}))})
+    assert image_check.validate(['https://a/1']) == (['https://a/1'], [])
+    assert [x[0] for x in fake.calls] == ['HEAD', 'GET']
+
+
+def test_ranged_get_when_head_has_no_size(session):
+    fake = session({'https://a/1': (FakeResponse(200, {'Content-Type': 'image/jpeg'}), FakeResponse(206, {
+        'Content-Type': 'image/jpeg', 'Content-Range': 'bytes 0-0/100'}))})
+    assert image_check.validate(['https://a/1']) == ([], ['https://a/1'])
+    assert [x[0] for x in fake.calls] == ['HEAD', 'GET']
+
+
+@pytest.mark.parametrize('head, ok', [
+    (FakeResponse(200, {'Content-Type': 'image/jpeg', 'Content-Length': BIG}), True),
+    (FakeResponse(200, {'Content-Type': 'image/jpeg', 'Content-Length': '100'}), False),
+    (FakeResponse(200, {'Content-Type': 'text/html', 'Content-Length': BIG}), False),
+    (FakeResponse(404), False),
+])
+def test_size_and_content_type(session, head, ok):
+    session({'https://a/1': (head, None)})
+    good, bad = image_check.validate(['https://a/1'])
+    assert (good == ['https://a/1']) is ok
+    assert (bad == ['https://a/1']) is not ok
+
+
+def test_network_error_keeps_url(session):
+    fake = session({})
+    assert image_check.validate(['https://a/1']) == (['https://a/1'], [])
+    assert len(fake.calls) == 1
+
+
+def test_budget_expiry(session, monkeypatch):
+    monkeypatch.setattr(image_check, 'CALL_TIMEOUT', 10)
+    fake = session({'https://a/1': (FakeResponse(405), FakeResponse(206, {
+        'Content-Type': 'text/html', 'Content-Range': f'bytes 0-0/{BIG}'}))}, delay=0.3)
+    start = time.monotonic()
+    # не успели проверить - ссылка остается
+    assert image_check.validate(['https://a/1'], budget=0.2) == (['https://a/1'], [])
+    assert time.monotonic() - start < 0.3
+    time.sleep(0.2)
+    # таймаут запроса - остаток бюджета, на GET после HEAD времени уже не осталось
+    assert [x[0] for x in fake.calls] == ['HEAD']
+    assert fake.calls[0][2] <= 0.2
+
+
+def test_call_timeout_capped(session, monkeypatch):
+    monkeypatch.setattr(image_check, 'CALL_TIMEOUT', 0.5)
+    fake = session({'https://a/1': (FakeResponse(200, {'Content-Type': 'image/jpeg', 'Content-Length': BIG}), None)})
+    image_check.validate(['https://a/1'], budget=5)
+    assert fake.calls[0][2] == 0.5
+
+
+def test_cache_ttl(session, monkeypatch):
+    fake = session({'https://a/1': (FakeResponse(200, {'Content-Type': 'image/jpeg', 'Content-Length': BIG}), None)})
+    image_check.validate(['https://a/1'])
+    image_check.validate(['https://a/1'])
+    assert len(fake.calls) == 1
+    # срок вышел - проверяется заново
+    image_check.CACHE['https://a/1'] = time.time() - 1
+    image_check.validate(['https://a/1'])
+    assert len(fake.calls) == 2
+
+
+def test_validation_on_only_for_real_bing(tmp_path):
+    recording = bing_genimg_v3.BingBrush(cookie='', adapter=cassette.RecordingAdapter(str(tmp_path)))
+    assert recording.validate_images is (bing_genimg_v3.BING_BASE_URL == bing_genimg_v3.DEFAULT_BING_BASE_URL)
+    replay = cassette.ReplayAdapter(os.path.join(CASSETTES, os.listdir(CASSETTES)[0]))
+    assert bing_genimg_v3.BingBrush(cookie='', adapter=replay).validate_images is False
@@ -0,0 +1,35 @@
+import threading
+
+import pytest
+
+import image_dedup
+
+pytestmark = pytest.mark.skipif(not image_dedup.AVAILABLE, reason='numpy/Pillow are not installed')
+
+
+def test_near_duplicates_dropped(monkeypatch):
+    hashes = {'a': 0b1111, 'b': 0b1110, 'c': (1 << 64) - 1}
+    monkeypatch.setattr(image_dedup, 'image_hash', lambda url, use_store: hashes[url])
+    dedup = image_dedup.NearDupFilter(max_distance=2)
+    dedup.add(['a', 'b', 'c'])
+    assert dedup.distinct() == ['a', 'c']
+    assert dedup.groups_list() == [['a', 'b'], ['c']]
+
+
+def test_slow_host_falls_back_to_all_images(monkeypatch):
+    release = threading.Event()
+
+    def image_hash(url, use_store):
+        if url == 'slow':
+            release.wait(5)
+        return 0
+
+    monkeypatch.setattr(image_dedup, 'image_hash', image_hash)
+    dedup = image_dedup.NearDupFilter()
+    dedup.add(['a', 'slow', 'b'])
+    try:
+        assert dedup.distinct(timeout=0.2) == ['a', 'slow', 'b']
+        assert dedup.groups_list(timeout=0.2) == [['a'], ['slow'], ['b']]
+    finally:
+        release.set()
+    assert dedup.distinct(timeout=5) == ['a']
@@ -0,0 +1,116 @@
+import hashlib
+from collections import OrderedDict
+
+import pytest
+
+import image_store
+
+
+class FakeResponse:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.status_code = 200
+        self.headers = {'Content-Type': 'image/png'}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.data), chunk_size):
+            yield self.data[i:i + chunk_size]
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_store, 'STORE_DIR', str(tmp_path / 'images'))
+    monkeypatch.setattr(image_store, 'MAX_STORE_BYTES', 250)
+    monkeypatch.setattr(image_store, 'INDEX', OrderedDict())
+    monkeypatch.setattr(image_store, 'URL_CACHE', OrderedDict())
+    monkeypatch.setattr(image_store, 'HASH_URLS', {})
+    monkeypatch.setattr(image_store, 'READERS', {})
+    monkeypatch.setattr(image_store, 'TOTAL_BYTES', 0)
+    monkeypatch.setattr(image_store, 'INDEX_LOADED', False)
+    pages = {}
+    monkeypatch.setattr(image_store.SESSION, 'get', lambda url, **kwargs: FakeResponse(pages[url]))
+    return pages
+
+
+def add(pages, url: str, fill: bytes) -> str:
+    pages[url] = b'\x89PNG' + fill * 96
+    digest = image_store.download(url)
+    assert digest == hashlib.sha256(pages[url]).hexdigest()
+    return digest
+
+
+def test_same_content_stored_once(store):
+    first = add(store, 'https://a/1', b'a')
+    second = add(store, 'https://a/2', b'a')
+    assert first == second
+    assert image_store.TOTAL_BYTES == 100
+
+
+def test_lru_eviction(store):
+    a = add(store, 'https://a/1', b'a')
+    b = add(store, 'https://a/2', b'b')
+    # a использовали недавно, вытеснен будет b
+    assert image_store.download('https://a/1') == a
+    c = add(store, 'https://a/3', b'c')
+    assert list(image_store.INDEX) == [a, c]
+    assert image_store.acquire(b) is None
+    assert image_store.TOTAL_BYTES == 200
+
+
+def test_file_being_read_is_not_evicted(store):
+    a = add(store, 'https://a/1', b'a')
+    path = image_store.acquire(a)
+    add(store, 'https://a/2', b'b')
+    add(store, 'https://a/3', b'c')
+    with open(path, 'rb') as f:
+        assert f.read(4) == b'\x89PNG'
+    assert a in image_store.INDEX
+    image_store.release(a)
+    add(store, 'https://a/4', b'd')
+    assert a not in image_store.INDEX
+    assert image_store.TOTAL_BYTES <= image_store.MAX_STORE_BYTES
+
+
+def test_acquire_rejects_bad_digest(store):
+    assert image_store.acquire('../../etc/passwd') is None
+    assert image_store.acquire('0' * 64) is None
+
+
+def test_evicted_digest_forgotten(store):
+    a = add(store, 'https://a/1', b'a')
+    add(store, 'https://a/2', b'b')
+    add(store, 'https://a/3', b'c')
+    assert a not in image_store.INDEX
+    assert 'https://a/1' not in image_store.URL_CACHE
+    assert a not in image_store.HASH_URLS
+    # после вытеснения ссылка скачивается заново
+    assert add(store, 'https://a/1', b'a') == a
+    assert a in image_store.INDEX
+
+
+def test_hit_on_evicted_digest_is_a_miss(store, monkeypatch):
+    a = add(store, 'https://a/1', b'a')
+    # запись осталась, а файла в хранилище уже нет
+    image_store.INDEX.pop(a)
+    image_store.TOTAL_BYTES -= 100
+    calls = []
+    get = image_store.SESSION.get
+    monkeypatch.setattr(image_store.SESSION, 'get', lambda url, **kwargs: calls.append(url) or get(url, **kwargs))
+    assert image_store.download('https://a/1') == a
+    assert calls == ['https://a/1']
+    assert a in image_store.INDEX
+
+
+def test_url_cache_bounded(store, monkeypatch):
+    monkeypatch.setattr(image_store, 'MAX_URL_CACHE', 2)
+    digest = add(store, 'https://a/1', b'a')
+    add(store, 'https://a/2', b'a')
+    add(store, 'https://a/3', b'a')
+    assert list(image_store.URL_CACHE) == ['https://a/2', 'https://a/3']
+    assert image_store.HASH_URLS == {digest: {'https://a/2', 'https://a/3'}}
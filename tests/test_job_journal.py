@@ -0,0 +1,115 @@
+import sqlite3
+import time
+
+import pytest
+
+import bing_genimg_v3
+import job_journal
+
+
+@pytest.fixture
+def journal(tmp_path, monkeypatch):
+    monkeypatch.setattr(job_journal, 'DB_PATH', str(tmp_path / 'jobs.db'))
+    monkeypatch.setattr(job_journal, 'CONN', None)
+    monkeypatch.setattr(job_journal, 'LAST_PRUNE', 0.0)
+    resumed = []
+
+    def fake_resume(job):
+        # вместо опроса бинга сразу "дорисовываем"
+        resumed.append(job)
+        job_journal.finish(job['id'], ['https://th.bing.com/th/id/x'], state=job_journal.STATE_DONE)
+        job_journal.RESUMED.pop(job['id']).set()
+
+    monkeypatch.setattr(job_journal, '_resume_job', fake_resume)
+    yield resumed
+    if job_journal.CONN is not None:
+        job_journal.CONN.close()
+
+
+def submit(prompt='cat', wait=100, client_id='alice'):
+    return job_journal.submitted(prompt, 'dalle', None, 'cookie.txt', '/images/create?id=1', 'req1', 'cat', wait,
+                                 client_id)
+
+
+def states():
+    return dict(job_journal.get_conn().execute('SELECT id, state FROM jobs').fetchall())
+
+
+def test_resume_and_reuse(journal):
+    job_id = submit()
+    assert job_journal.resume_unfinished() == 1
+    assert journal[0]['id'] == job_id
+    assert job_journal.take_result('cat', 'dalle', None, 'alice') == ['https://th.bing.com/th/id/x']
+    # результат отдается только один раз
+    assert job_journal.take_result('cat', 'dalle', None, 'alice') is None
+    assert states()[job_id] == job_journal.STATE_CONSUMED
+
+
+def test_expired_jobs_are_not_resumed(journal):
+    job_id = submit(wait=-1)
+    assert job_journal.resume_unfinished() == 0
+    assert states()[job_id] == job_journal.STATE_EXPIRED
+
+
+def test_running_job_is_not_taken(journal):
+    submit()
+    # задание этого процесса, а не продолженное после перезапуска
+    assert job_journal.take_result('cat', 'dalle', None, 'alice') is None
+
+
+def test_result_only_for_same_client(journal):
+    job_id = submit()
+    job_journal.resume_unfinished()
+    assert job_journal.take_result('cat', 'dalle', None, 'bob') is None
+    assert job_journal.take_result('cat', 'dalle', None, '') is None
+    assert states()[job_id] == job_journal.STATE_DONE
+    assert job_journal.take_result('cat', 'dalle', None, 'alice') == ['https://th.bing.com/th/id/x']
+
+
+def test_anonymous_jobs_not_reused(journal):
+    submit(client_id='')
+    job_journal.resume_unfinished()
+    assert job_journal.take_result('cat', 'dalle', None, '') is None
+
+
+def test_old_journal_gets_client_id(tmp_path, monkeypatch):
+    path = tmp_path / 'old.db'
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, prompt TEXT NOT NULL, model TEXT NOT NULL,'
+                 ' ar TEXT, cookie TEXT, redirect_url TEXT NOT NULL, request_id TEXT NOT NULL,'
+                 ' url_encoded_prompt TEXT NOT NULL, created REAL NOT NULL, deadline REAL NOT NULL, finished REAL,'
+                 ' state TEXT NOT NULL, result TEXT)')
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(job_journal, 'DB_PATH', str(path))
+    monkeypatch.setattr(job_journal, 'CONN', None)
+    try:
+        assert submit() is not None
+    finally:
+        job_journal.CONN.close()
+
+
+def test_old_jobs_pruned_on_insert(journal, monkeypatch):
+    old = submit('old')
+    job_journal.finish(old, ['u'])
+    job_journal.get_conn().execute('UPDATE jobs SET created = ?', (time.time() - job_journal.KEEP_FINISHED - 1,))
+    job_journal.get_conn().commit()
+    submit('new')
+    assert old in states()
+    monkeypatch.setattr(job_journal, 'LAST_PRUNE', 0.0)
+    new = submit('newer')
+    assert old not in states()
+    assert new in states()
+
+
+def test_resumed_gpt4o_keeps_deadline(monkeypatch):
+    brush = bing_genimg_v3.BingBrush(cookie='')
+    brush.deadline = time.time() + 30
+    monkeypatch.setattr(brush, 'fetch_result_page', lambda url, marker: ['https://th.bing.com/th/id/x'])
+    brush.obtaion_image_url('/images/create?id=1', 'req1', 'cat')
+    assert brush.max_wait_time <= 30
+
+    brush = bing_genimg_v3.BingBrush(cookie='')
+    monkeypatch.setattr(brush, 'fetch_result_page', lambda url, marker: ['https://th.bing.com/th/id/x'])
+    brush.obtaion_image_url('/images/create?id=1', 'req1', 'cat')
+    assert brush.max_wait_time == bing_genimg_v3.GPT_MAX_WAIT_TIME
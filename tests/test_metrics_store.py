@@ -0,0 +1,75 @@
+import pytest
+
+import metrics_store
+
+# small tiers so a test can wrap every one of them: raw 2 s x 5, 10 s x 3, 60 s x 2
+TIERS = (('raw', 2, 5), ('10s', 10, 3), ('1m', 60, 2))
+NOW = 600
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    monkeypatch.setattr(metrics_store, 'TIERS', TIERS)
+    monkeypatch.setattr(metrics_store.time, 'time', lambda: NOW)
+    store = metrics_store.MetricsStore(str(tmp_path / 'history.db'), raw_step=2)
+    yield store
+    store.close()
+
+
+def stored(store, tier):
+    """{bucket: (total, count, sum, min, max)} of series "s" in a tier."""
+    return {x[0]: x[1:] for x in store.rows('s', NOW, tier)}
+
+
+def slots(store, tier):
+    return store.conn.execute('SELECT count(*) FROM samples WHERE series = ? AND tier = ?', ('s', tier)).fetchone()[0]
+
+
+def test_samples_consolidated_into_coarser_buckets(store):
+    # 10 s bucket 580: 4 values and one missing sample, bucket 590 starts a new average
+    for ts, value in ((580, 1.0), (582, 3.0), (584, None), (586, 8.0), (588, 4.0), (590, 10.0)):
+        store.add({'s': value}, ts)
+    tier = stored(store, 1)
+    assert tier[580] == (5, 4, 16.0, 1.0, 8.0)
+    assert tier[590] == (1, 1, 10.0, 10.0, 10.0)
+    # the 1 min bucket holds everything
+    assert stored(store, 2)[540] == (6, 5, 26.0, 1.0, 10.0)
+    assert store.series('s', 20, 2) == [4.0, 10.0]
+
+
+def test_bucket_of_missing_samples_only(store):
+    store.add({'s': None}, 590)
+    store.add({'s': None}, 591)
+    total, count, _, low, high = stored(store, 1)[590]
+    assert (total, count, low, high) == (2, 0, None, None)
+    assert store.summary('s', 60)['missing'] == 1.0
+
+
+def test_expired_slots_reused(store):
+    # three times around the raw tier, twice around the 10 s tier
+    for ts in range(540, 600, 2):
+        store.add({'s': float(ts)}, ts)
+    assert slots(store, 0) == 5
+    assert slots(store, 1) == 3
+    # only the newest buckets survive, overwritten slots do not keep the old sums
+    assert sorted(stored(store, 0)) == [590, 592, 594, 596, 598]
+    assert stored(store, 0)[590] == (1, 1, 590.0, 590.0, 590.0)
+    assert sorted(stored(store, 1)) == [570, 580, 590]
+    assert stored(store, 1)[570] == (5, 5, sum(range(570, 580, 2)), 570.0, 578.0)
+
+
+def test_slot_reused_across_tier_boundary(store):
+    # 60 s tier has two slots: bucket 480 is overwritten by bucket 600
+    store.add({'s': 1.0}, 480)
+    store.add({'s': 2.0}, 540)
+    store.add({'s': 5.0}, 600)
+    rows = store.conn.execute('SELECT slot, bucket, total, sum FROM samples WHERE series = ? AND tier = 2 ORDER BY slot',
+                              ('s',)).fetchall()
+    assert rows == [(0, 600, 1, 5.0), (1, 540, 1, 2.0)]
+
+
+def test_window_picks_finest_covering_tier(store):
+    assert store.tier_for(10) == 0
+    assert store.tier_for(30) == 1
+    assert store.tier_for(120) == 2
+    assert store.tier_for(10 ** 6) == 2
@@ -0,0 +1,34 @@
+import threading
+import time
+
+import cfg  # type: ignore
+
+if not hasattr(cfg, 'MONITOR_INSTANCES'):
+    cfg.MONITOR_INSTANCES = []
+
+import monitor
+
+
+def test_statuses_fetched_concurrently_with_deadline(monkeypatch):
+    release = threading.Event()
+
+    def get_status(url):
+        if url == "http://hung/status":
+            release.wait(5)
+        else:
+            time.sleep(0.2)
+        return {"service_status": "OK", "url": url}
+
+    monkeypatch.setattr(monitor, "get_status", get_status)
+    monkeypatch.setattr(monitor, "INSTANCES", [{"name": x, "url": f"http://{x}/status"} for x in ("a", "b", "hung")])
+    start = time.monotonic()
+    try:
+        statuses = monitor.fetch_statuses(deadline=0.5)
+    finally:
+        release.set()
+    # a and b answer in parallel, the hung instance costs the deadline and not its own timeout
+    assert time.monotonic() - start < 0.9
+    assert statuses["a"]["service_status"] == "OK"
+    assert statuses["b"]["service_status"] == "OK"
+    assert "error" in statuses["hung"]
+    assert list(statuses) == ["a", "b", "hung"]
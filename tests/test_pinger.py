@@ -0,0 +1,109 @@
+import asyncio
+import socket
+import time
+
+import pytest
+from icmplib.exceptions import SocketPermissionError
+
+import pinger
+
+
+def wait_rounds(p: pinger.Pinger, rounds: int = 1, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while p.rounds < rounds and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert p.rounds >= rounds
+
+
+@pytest.fixture
+def listener():
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(16)
+    yield server.getsockname()[1]
+    server.close()
+
+
+def test_falls_back_from_icmp_to_unprivileged_to_tcp(monkeypatch, listener):
+    calls = []
+
+    async def multiping(addresses, privileged, **kwargs):
+        calls.append(privileged)
+        raise SocketPermissionError(privileged)
+
+    async def resolve(host):
+        return ['127.0.0.1']
+
+    monkeypatch.setattr(pinger, 'async_multiping', multiping)
+    monkeypatch.setattr(pinger, 'async_resolve', resolve)
+    p = pinger.Pinger([{"name": "local", "host": "127.0.0.1", "port": listener}], interval=60)
+    wait_rounds(p)
+    # raw sockets, then unprivileged ICMP, then TCP connect
+    assert calls == [True, False]
+    assert p.method == pinger.METHOD_TCP
+    stats = p.stats()["local"]
+    assert stats["status"] == "online"
+    assert stats["method"] == pinger.METHOD_TCP
+
+
+class FakeHost:
+    def __init__(self, address, rtts):
+        self.address = address
+        self.rtts = rtts
+        self.packets_sent = 1
+        self.packets_received = len(rtts)
+
+
+def make_pinger(monkeypatch, addresses, replies, **kwargs):
+    """A pinger whose background thread never gets to ping, rounds are run by the test."""
+    resolved = []
+
+    async def resolve(host):
+        resolved.append(host)
+        return [addresses[host]]
+
+    async def multiping(hosts, **kwargs):
+        return [FakeHost(x, [1.0] if replies.get(x) else []) for x in hosts]
+
+    monkeypatch.setattr(pinger, 'async_resolve', resolve)
+    monkeypatch.setattr(pinger, 'async_multiping', multiping)
+    monkeypatch.setattr(pinger.Pinger, 'run', lambda self: asyncio.sleep(0))
+    p = pinger.Pinger([{"name": "h", "host": "h.example", "port": 443}], **kwargs)
+    return p, resolved
+
+
+def test_address_refreshed_after_ttl(monkeypatch):
+    addresses = {"h.example": "10.0.0.1"}
+    p, resolved = make_pinger(monkeypatch, addresses, {"10.0.0.1": True, "10.0.0.2": True}, resolve_ttl=0.05)
+    asyncio.run(p.icmp_round())
+    asyncio.run(p.icmp_round())
+    assert resolved == ["h.example"]
+    addresses["h.example"] = "10.0.0.2"
+    time.sleep(0.06)
+    asyncio.run(p.icmp_round())
+    assert p.addresses["h.example"][0] == "10.0.0.2"
+
+
+def test_address_refreshed_after_lost_rounds(monkeypatch):
+    addresses = {"h.example": "10.0.0.1"}
+    # the host moved, the old address no longer answers
+    p, resolved = make_pinger(monkeypatch, addresses, {"10.0.0.2": True})
+    assert asyncio.run(p.icmp_round())["h"] == [None]
+    addresses["h.example"] = "10.0.0.2"
+    for _ in range(pinger.RERESOLVE_AFTER_LOST - 1):
+        assert asyncio.run(p.icmp_round())["h"] == [None]
+    results = asyncio.run(p.icmp_round())
+    assert results["h"] == [1.0]
+    assert len(resolved) == 2
+
+
+def test_failed_lookup_keeps_old_address(monkeypatch):
+    addresses = {"h.example": "10.0.0.1"}
+    p, _ = make_pinger(monkeypatch, addresses, {"10.0.0.1": True}, resolve_ttl=0)
+    asyncio.run(p.icmp_round())
+
+    async def broken(host):
+        raise OSError("no dns")
+
+    monkeypatch.setattr(pinger, 'async_resolve', broken)
+    assert asyncio.run(p.icmp_round())["h"] == [1.0]
@@ -0,0 +1,91 @@
+import pytest
+
+from bing_genimg_v3 import ResultPageParser, parse_image_links
+
+PAGE = (
+    '<html><body><div class="imgpt">'
+    '<img class="mimg" src="https://th.bing.com/th/id/OIG1.aaa?w=270&h=270" alt="кот в шляпе"/>'
+    '<img class="mimg" src="https://th.bing.com/th/id/OIG1.bbb?w=270&h=270"/>'
+    '<img class="mimg" src="https://th.bing.com/th/id/OIG1.aaa?w=540"/>'
+    '<script src="/rp/script.js"></script>'
+    '</div></body></html>'
+).encode('utf-8')
+LINKS = ['https://th.bing.com/th/id/OIG1.aaa', 'https://th.bing.com/th/id/OIG1.bbb', '/rp/script.js']
+
+
+def feed_by(data: bytes, size: int, marker=None) -> ResultPageParser:
+    parser = ResultPageParser(marker)
+    for i in range(0, len(data), size):
+        if parser.feed(data[i:i + size]):
+            break
+    return parser
+
+
+def test_whole_page():
+    assert parse_image_links(PAGE.decode('utf-8')) == LINKS
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 5, 7, 64])
+def test_any_chunk_split(size):
+    # src=" и ссылки, разрезанные между кусками, в том числе внутри многобайтных символов
+    assert feed_by(PAGE, size).links() == LINKS
+
+
+@pytest.mark.parametrize('size', [1, 3, 1000])
+def test_pending_marker_split(size):
+    page = b'<div class="strm">' + PAGE
+    parser = feed_by(page, size, 'strm')
+    assert parser.pending
+    assert parser.feed(b'more') is True
+    # после маркера дальше не разбираем
+    assert parser.size <= len(page)
+
+
+def test_no_marker():
+    parser = feed_by(PAGE, 4, 'errorMessage')
+    assert not parser.pending
+    assert parser.links() == LINKS
+
+
+@pytest.fixture
+def result_server():
+    """HTTP/1.1 сервер со страницей "еще рисуется" заданного размера, считает соединения."""
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    state = {"size": 0, "connections": set()}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            state['connections'].add(self.client_address)
+            body = b'<div id="errorMessage">pending</div>' + b' ' * state['size']
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/results', state
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.parametrize('size, connections', [
+    (1000, 1),  # маленький остаток дочитан, соединение вернулось в пул
+    (200 * 1024, 3),  # большой остаток не читаем, соединение закрыто
+])
+def test_pending_page_connection_reuse(result_server, size, connections):
+    import bing_genimg_v3
+
+    url, state = result_server
+    state['size'] = size
+    brush = bing_genimg_v3.BingBrush(cookie='_U=1')
+    for _ in range(3):
+        assert brush.fetch_result_page(url, 'errorMessage') is None
+    assert len(state['connections']) == connections
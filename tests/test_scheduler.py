@@ -0,0 +1,112 @@
+import threading
+
+import pytest
+
+import scheduler
+from scheduler import PRIORITY_BULK, PRIORITY_INTERACTIVE, FairQueue, FairScheduler, SchedulerBusy
+
+
+def drain(queue: FairQueue) -> list:
+    return [queue.pop() for _ in range(len(queue))]
+
+
+def test_clients_are_interleaved():
+    queue = FairQueue()
+    for i in range(3):
+        queue.push(f'a{i}', 'a')
+    for i in range(3):
+        queue.push(f'b{i}', 'b')
+    assert drain(queue) == ['a0', 'b0', 'a1', 'b1', 'a2', 'b2']
+
+
+def test_weight_gives_bigger_share():
+    queue = FairQueue(weights={'a': 2.0})
+    for i in range(4):
+        queue.push(f'a{i}', 'a')
+    for i in range(2):
+        queue.push(f'b{i}', 'b')
+    assert drain(queue) == ['a0', 'a1', 'b0', 'a2', 'a3', 'b1']
+
+
+def test_interactive_before_bulk():
+    queue = FairQueue()
+    queue.push('bulk', 'a', PRIORITY_BULK)
+    queue.push('interactive', 'b', PRIORITY_INTERACTIVE)
+    assert drain(queue) == ['interactive', 'bulk']
+
+
+def test_bulk_runs_under_constant_interactive_load():
+    queue = FairQueue(lower_share=0.2)
+    queue.push('bulk', 'a', PRIORITY_BULK)
+    served = []
+    # интерактивная очередь никогда не пустеет
+    for i in range(20):
+        queue.push(f'i{i}', f'client{i}', PRIORITY_INTERACTIVE)
+        served.append(queue.pop())
+    assert served.index('bulk') == 4
+    assert len(queue) == 1
+
+
+def test_bulk_share_is_kept():
+    queue = FairQueue(lower_share=0.25)
+    for i in range(10):
+        queue.push(f'b{i}', 'a', PRIORITY_BULK)
+    for i in range(30):
+        queue.push(f'i{i}', 'b', PRIORITY_INTERACTIVE)
+    first = [queue.pop() for _ in range(20)]
+    assert sum(1 for x in first if x.startswith('b')) == 5
+    assert [x for x in first if x.startswith('b')] == ['b0', 'b1', 'b2', 'b3', 'b4']
+
+
+def test_strict_priority_without_share():
+    queue = FairQueue(lower_share=0)
+    queue.push('bulk', 'a', PRIORITY_BULK)
+    for i in range(20):
+        queue.push(f'i{i}', 'b', PRIORITY_INTERACTIVE)
+    assert drain(queue)[-1] == 'bulk'
+
+
+def test_late_client_does_not_wait_for_backlog():
+    queue = FairQueue()
+    for i in range(5):
+        queue.push(f'a{i}', 'a')
+    queue.pop()
+    queue.push('b0', 'b')
+    assert queue.pop() == 'b0'
+
+
+def test_idle_clients_are_forgotten():
+    queue = FairQueue()
+    for i in range(100):
+        queue.push(i, f'client{i}')
+    queue.push('last', 'other')
+    drain(queue)
+    queue.push('next', 'new')
+    queue.pop()
+    assert len(queue.last_finish) <= 2
+
+
+def test_client_limit():
+    fair = FairScheduler(capacity=1, max_per_client=1)
+    with fair.slot('a'):
+        with pytest.raises(SchedulerBusy):
+            with fair.slot('a'):
+                pass
+        # другой клиент в очередь встает
+        started = threading.Event()
+
+        def other():
+            with fair.slot('b'):
+                started.set()
+
+        thread = threading.Thread(target=other)
+        thread.start()
+        assert not started.wait(0.1)
+    thread.join(1)
+    assert started.is_set()
+    assert fair.rejected == 1
+    assert fair.stats()['served'] == {'a': 1, 'b': 1}
+
+
+def test_default_limit_from_cfg():
+    assert FairScheduler().max_per_client == scheduler.MAX_PER_CLIENT
@@ -0,0 +1,29 @@
+import tracing
+
+
+def test_client_ids_are_unique():
+    first, second = tracing.sample('my trace!'), tracing.sample('my trace!')
+    assert first.startswith('mytrace-')
+    assert first != second
+
+
+def test_sampling_off(monkeypatch):
+    monkeypatch.setattr(tracing, 'SAMPLE_RATE', 0.0)
+    assert tracing.sample() == ''
+    assert tracing.trace('request') is tracing.NULL_SPAN
+
+
+def test_spans_recorded(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, 'TRACE_FILE', str(tmp_path / 'traces.jsonl'))
+    trace_id = tracing.sample('t')
+    with tracing.trace('request', trace_id, endpoint='/bing'):
+        with tracing.span('poll'):
+            tracing.incr('requests')
+            tracing.incr('requests')
+    found = tracing.get_trace(trace_id)
+    assert [x['name'] for x in found['spans']] == ['request', 'poll']
+    assert found['spans'][1]['attrs'] == {'requests': 2}
+    assert found['spans'][1]['parent_id'] == found['spans'][0]['span_id']
+    # вне памяти не ищется
+    tracing.RECENT.clear()
+    assert tracing.get_trace(trace_id) is None
@@ -0,0 +1,16 @@
+import pytest
+
+from utils import percentile
+
+
+@pytest.mark.parametrize('p, expected', [(0, 1), (5, 1), (10, 1), (11, 2), (50, 5), (51, 6), (90, 9), (95, 10), (100, 10)])
+def test_percentile_nearest_rank(p, expected):
+    assert percentile(list(range(10, 0, -1)), p) == expected
+
+
+def test_percentile_small_samples():
+    assert percentile([], 50) == 0.0
+    assert percentile([7.0], 95) == 7.0
+    assert percentile([1.0, 2.0, 3.0, 4.0], 95) == 4.0
+    # the median of 4 values is the 2nd by rank, a rounded linear index (1.5 -> 2) would give the 3rd
+    assert percentile([1.0, 2.0, 3.0, 4.0], 50) == 2.0
@@ -0,0 +1,51 @@
+import hashlib
+import hmac
+
+import pytest
+
+import webhook
+
+
+@pytest.fixture(autouse=True)
+def secret(monkeypatch):
+    monkeypatch.setattr(webhook, 'SECRET', 'secret')
+    monkeypatch.setattr(webhook, 'ALLOWED_HOSTS', {'127.0.0.1'})
+
+
+@pytest.mark.parametrize('url', [
+    'https://8.8.8.8/hook',
+    'http://1.1.1.1:8080/hook?x=1',
+    'http://127.0.0.1:9000/hook',  # разрешен в ALLOWED_HOSTS
+])
+def test_public_or_allowed(url):
+    assert webhook.check_url(url) == ''
+
+
+@pytest.mark.parametrize('url', [
+    'http://127.0.0.2/hook',
+    'http://169.254.169.254/latest/meta-data/',
+    'http://10.0.0.1/hook',
+    'http://192.168.1.1/hook',
+    'http://[::1]/hook',
+    'http://[fe80::1]/hook',
+    'http://0.0.0.0/hook',
+    'http://100.64.0.1/hook',
+])
+def test_internal_addresses_rejected(url):
+    assert 'not a public address' in webhook.check_url(url)
+
+
+@pytest.mark.parametrize('url', ['ftp://8.8.8.8/', 'https:///x', 'http://8.8.8.8:99999/', 123])
+def test_bad_urls(url):
+    assert webhook.check_url(url) == 'callback_url must be an http(s) URL'
+
+
+def test_secret_required(monkeypatch):
+    monkeypatch.setattr(webhook, 'SECRET', '')
+    assert 'WEBHOOK_SECRET' in webhook.check_url('https://8.8.8.8/hook')
+
+
+def test_signature():
+    body = b'{"job_id": "1"}'
+    expected = hmac.new(b'secret', b'1700000000.' + body, hashlib.sha256).hexdigest()
+    assert webhook.sign(body, '1700000000') == 'sha256=' + expected
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+# Трассировка запросов по стадиям.
+# Запрос к /bing* получает trace id, каждая стадия на пути через my_genimg, BingBrush и т.д.
+# (ожидание в очереди, отправка rt=4/rt=3, редирект, опрос, пауза 4с, проверка картинок)
+# записывается как span с временем начала и длительностью. Готовые трассы пишутся
+# в logs/traces.jsonl, последние KEEP_RECENT отдаются через /traces/<id> (только админу),
+# id приходит в заголовке ответа X-Trace-Id.
+#
+# Записывается только доля запросов cfg.TRACE_SAMPLE_RATE (0 - выключено, 1 - все)
+# и запросы админа с заголовком X-Trace-Id. Если запрос не записывается, span() сразу отдает
+# пустой контекст и почти ничего не стоит.
+
+
+import contextvars
+import itertools
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import cfg  # type: ignore
+import my_log
+
+
+SAMPLE_RATE = getattr(cfg, 'TRACE_SAMPLE_RATE', 0.0)
+TRACE_FILE = getattr(cfg, 'TRACE_FILE', os.path.join('logs', 'traces.jsonl'))
+# сколько последних трасс держать в памяти для /traces/<id>
+KEEP_RECENT = 1000
+# что можно принять в X-Trace-Id от клиента
+TRACE_ID_RE = re.compile(r'[^0-9A-Za-z_-]')
+
+# текущий span в этом потоке (или None если запрос не трассируется)
+CURRENT: contextvars.ContextVar[Optional['Span']] = contextvars.ContextVar('tracing_span', default=None)
+
+LOCK = threading.Lock()
+RECENT: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+
+
+class Trace:
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans: List[Dict[str, Any]] = []
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def add(self, span: Dict[str, Any]) -> None:
+        with self.lock:
+            self.spans.append(span)
+
+
+class Span:
+    """Одна стадия. Используется как контекстный менеджер, вложенные span-ы становятся детьми."""
+
+    __slots__ = ('trace', 'name', 'span_id', 'parent_id', 'attrs', 'start', 'perf_start', 'token', 'root')
+
+    def __init__(self, trace: Trace, name: str, parent_id: int, attrs: Dict[str, Any], root: bool = False):
+        self.trace = trace
+        self.name = name
+        self.span_id = next(trace.ids)
+        self.parent_id = parent_id
+        self.attrs = attrs
+        self.root = root
+        self.start = 0.0
+        self.perf_start = 0.0
+        self.token = None
+
+    @property
+    def trace_id(self) -> str:
+        return self.trace.trace_id
+
+    def __enter__(self) -> 'Span':
+        self.token = CURRENT.set(self)
+        self.start = time.time()
+        self.perf_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        duration = time.perf_counter() - self.perf_start
+        CURRENT.reset(self.token)
+        record = {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": round(self.start, 6),
+            "duration_ms": round(duration * 1000, 3),
+        }
+        if self.attrs:
+            record["attrs"] = self.attrs
+        if exc is not None:
+            record["error"] = repr(exc)
+        self.trace.add(record)
+        if self.root:
+            finish(self.trace)
+
+
+class _NullSpan:
+    """Заглушка для запросов которые не трассируются."""
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        return None
+
+
+NULL_SPAN = _NullSpan()
+
+
+def sample(trace_id: Optional[str] = None) -> str:
+    """
+    Решает трассировать ли запрос, возвращает trace id или '' если нет.
+    Переданный trace_id (например из заголовка X-Trace-Id) трассируется всегда, к нему
+    добавляется случайный суффикс, чтобы повторный id не затер чужую трассу в RECENT.
+    Иначе запрос попадает в трассировку с вероятностью SAMPLE_RATE.
+    """
+    if trace_id:
+        trace_id = TRACE_ID_RE.sub('', str(trace_id))[:48]
+        if trace_id:
+            return f'{trace_id}-{uuid.uuid4().hex[:8]}'
+    if not SAMPLE_RATE or random.random() >= SAMPLE_RATE:
+        return ''
+    return uuid.uuid4().hex[:16]
+
+
+def trace(name: str, trace_id: Optional[str] = None, **attrs) -> Any:
+    """
+    Начинает трассу запроса. trace_id - результат sample(), '' - не трассировать,
+    None - решить здесь по SAMPLE_RATE.
+    with trace(...) as root: root - корневой Span или None если не трассируется.
+    """
+    if trace_id is None:
+        trace_id = sample()
+    if not trace_id:
+        return NULL_SPAN
+    return Span(Trace(trace_id), name, 0, attrs, root=True)
+
+
+def span(name: str, **attrs) -> Any:
+    """Стадия внутри текущей трассы, вне трассы ничего не делает."""
+    parent = CURRENT.get()
+    if parent is None:
+        return NULL_SPAN
+    return Span(parent.trace, name, parent.span_id, attrs)
+
+
+def add_span(name: str, start: float, duration: float, **attrs) -> None:
+    """Записывает уже прошедшую стадию, например ожидание в очереди, время известно задним числом."""
+    parent = CURRENT.get()
+    if parent is None:
+        return
+    record = {
+        "name": name,
+        "span_id": next(parent.trace.ids),
+        "parent_id": parent.span_id,
+        "start": round(start, 6),
+        "duration_ms": round(duration * 1000, 3),
+    }
+    if attrs:
+        record["attrs"] = attrs
+    parent.trace.add(record)
+
+
+def incr(key: str, value: int = 1) -> None:
+    """Увеличивает счетчик в атрибутах текущего span-а (число опросов, байты и т.п.)."""
+    current = CURRENT.get()
+    if current is not None:
+        current.attrs[key] = current.attrs.get(key, 0) + value
+
+
+def set_attr(key: str, value: Any) -> None:
+    current = CURRENT.get()
+    if current is not None:
+        current.attrs[key] = value
+
+
+def current_trace_id() -> str:
+    current = CURRENT.get()
+    return current.trace_id if current is not None else ''
+
+
+def finish(finished: Trace) -> None:
+    """Трасса закончилась: в память для /traces/<id> и в файл."""
+    spans = sorted(finished.spans, key=lambda x: x['start'])
+    record = {"trace_id": finished.trace_id, "spans": spans}
+    with LOCK:
+        RECENT[finished.trace_id] = record
+        while len(RECENT) > KEEP_RECENT:
+            RECENT.popitem(last=False)
+        try:
+            with open(TRACE_FILE, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        except Exception as error:
+            my_log.log_bing_api(f'tracing:finish: {error}')
+    my_log.trancate_log_file(TRACE_FILE)
+
+
+def get_trace(trace_id: str) -> Optional[Dict[str, Any]]:
+    """Трасса из памяти (последние KEEP_RECENT), более старые есть только в TRACE_FILE."""
+    with LOCK:
+        return RECENT.get(trace_id)
+
+
+if __name__ == '__main__':
+    pass
@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 
 import functools
+import math
+import sqlite3
 import threading
 import re
+from typing import List
 
 
 def async_run(func):
@@ -14,6 +17,17 @@ def async_run(func):
     return wrapper
 
 
+def open_sqlite_wal(db_path: str) -> sqlite3.Connection:
+    """
+    Opens a SQLite connection in WAL mode that can be shared between threads.
+    Callers must serialize access to the connection with their own lock.
+    """
+    conn = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+    conn.execute('PRAGMA journal_mode=WAL;')
+    conn.execute('PRAGMA synchronous=NORMAL;')
+    return conn
+
+
 def replace_non_letters_with_spaces(text: str) -> str:
     """
     Replaces all characters in a string with spaces, except for letters and spaces.
@@ -36,6 +50,18 @@ def replace_non_letters_with_spaces(text: str) -> str:
     return r.strip()
 
 
+def percentile(values: List[float], p: float) -> float:
+    """
+    Returns the p-th percentile (0-100) of values using the nearest-rank method, 0 if empty:
+    the smallest value with at least p% of the values less than or equal to it.
+    """
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, math.ceil(p / 100 * len(values)) - 1))
+    return values[index]
+
+
 def seconds_to_hms(seconds: int) -> str:
     """Converts seconds to a human-readable string with hours, minutes, and seconds."""
     minutes, seconds = divmod(seconds, 60)
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+# Доставка результатов на callback_url клиента (вебхуки).
+# Запрос с "callback_url" сразу получает 202 и job_id, задание рисуется в фоне, а результат
+# отправляется POST запросом на callback_url. Задания и неотправленные результаты хранятся
+# в SQLite (outbox), так что после перезапуска недорисованные задания запускаются снова
+# (картинки уже отправленных в бинг заданий подхватывает job_journal), а недоставленные
+# результаты отправляются дальше. Отправка с повторами и растущей паузой между ними,
+# тело подписывается HMAC-SHA256 с ключом cfg.WEBHOOK_SECRET. Без ключа callback_url не принимается.
+# Адреса во внутренней сети (localhost, 10.x, 192.168.x, 169.254.x и т.п.) запрещены, чтобы через
+# вебхук нельзя было достучаться до сервисов рядом с сервером, кроме хостов из cfg.WEBHOOK_ALLOWED_HOSTS.
+#
+# Проверка подписи на стороне клиента:
+#   hmac.new(secret, f'{X-Webhook-Timestamp}.{body}'.encode(), sha256).hexdigest() == X-Webhook-Signature[7:]
+
+
+import hashlib
+import hmac
+import ipaddress
+import json
+import random
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import cfg  # type: ignore
+import my_log
+from utils import async_run, open_sqlite_wal
+
+
+DB_PATH = getattr(cfg, 'WEBHOOK_OUTBOX_PATH', 'webhooks.db')
+SECRET = getattr(cfg, 'WEBHOOK_SECRET', '')
+# хосты которым можно слать вебхуки даже если они во внутренней сети
+ALLOWED_HOSTS = set(getattr(cfg, 'WEBHOOK_ALLOWED_HOSTS', []))
+MAX_ATTEMPTS = getattr(cfg, 'WEBHOOK_MAX_ATTEMPTS', 10)
+# пауза перед повтором: BACKOFF_BASE * 2^попытка, но не больше BACKOFF_MAX, секунд
+BACKOFF_BASE = 5
+BACKOFF_MAX = 30 * 60
+# сколько хранить доставленные и проваленные записи, секунд
+KEEP_FINISHED = 7 * 24 * 60 * 60
+TIMEOUT = 20
+WORKERS = 4
+
+# состояния записи
+STATE_RUNNING = 'running'      # задание еще рисуется
+STATE_PENDING = 'pending'      # результат готов, ждет доставки
+STATE_DELIVERED = 'delivered'
+STATE_FAILED = 'failed'        # кончились попытки
+
+LOCK = threading.Lock()
+CONN = None
+# будит отправителя когда появился новый результат
+WAKEUP = threading.Event()
+SENDER_STARTED = False
+
+SESSION = requests.Session()
+SESSION.mount('https://', HTTPAdapter(pool_connections=16, pool_maxsize=WORKERS))
+SESSION.mount('http://', HTTPAdapter(pool_connections=16, pool_maxsize=WORKERS))
+POOL = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix='webhook')
+
+
+def get_conn():
+    global CONN
+    if CONN is None:
+        CONN = open_sqlite_wal(DB_PATH)
+        CONN.execute('''
+            CREATE TABLE IF NOT EXISTS outbox (
+                id TEXT PRIMARY KEY,
+                callback_url TEXT NOT NULL,
+                request TEXT NOT NULL,
+                created REAL NOT NULL,
+                state TEXT NOT NULL,
+                payload TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL,
+                finished REAL,
+                last_error TEXT
+            )''')
+        CONN.execute('CREATE INDEX IF NOT EXISTS outbox_state ON outbox (state, next_attempt)')
+        CONN.commit()
+    return CONN
+
+
+def check_url(callback_url: str) -> str:
+    """
+    Проверяет callback_url, возвращает текст ошибки или '' если на него можно отправлять.
+    Все адреса хоста должны быть публичными, если хост не в ALLOWED_HOSTS.
+    """
+    if not SECRET:
+        return 'callback_url is disabled on this server (WEBHOOK_SECRET is not set)'
+    if not isinstance(callback_url, str):
+        return 'callback_url must be an http(s) URL'
+    try:
+        parts = urlsplit(callback_url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+    except ValueError:
+        return 'callback_url must be an http(s) URL'
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        return 'callback_url must be an http(s) URL'
+    if parts.hostname in ALLOWED_HOSTS:
+        return ''
+    try:
+        addresses = {x[4][0] for x in socket.getaddrinfo(parts.hostname, port, proto=socket.IPPROTO_TCP)}
+    except (OSError, UnicodeError):
+        return f'callback_url host {parts.hostname} does not resolve'
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split('%', 1)[0])
+        if not ip.is_global or ip.is_multicast:
+            return f'callback_url host {parts.hostname} is not a public address'
+    return ''
+
+
+def accept(callback_url: str, request: Dict[str, Any]) -> str:
+    """Записывает принятое задание, возвращает его job_id."""
+    job_id = uuid.uuid4().hex
+    with LOCK:
+        conn = get_conn()
+        conn.execute('INSERT INTO outbox (id, callback_url, request, created, state) VALUES (?, ?, ?, ?, ?)',
+                     (job_id, callback_url, json.dumps(request, ensure_ascii=False), time.time(), STATE_RUNNING))
+        conn.commit()
+    return job_id
+
+
+def enqueue(job_id: str, payload: Dict[str, Any]) -> None:
+    """Задание закончилось, результат ставится в очередь на доставку."""
+    with LOCK:
+        conn = get_conn()
+        conn.execute('UPDATE outbox SET state = ?, payload = ?, next_attempt = ? WHERE id = ?',
+                     (STATE_PENDING, json.dumps(payload, ensure_ascii=False), time.time(), job_id))
+        conn.commit()
+    WAKEUP.set()
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    """Состояние задания для /jobs/<job_id>."""
+    with LOCK:
+        row = get_conn().execute(
+            'SELECT state, payload, attempts, created, finished, last_error FROM outbox WHERE id = ?',
+            (job_id,)).fetchone()
+    if row is None:
+        return None
+    state, payload, attempts, created, finished, last_error = row
+    return {
+        "job_id": job_id,
+        "state": state,
+        "result": json.loads(payload) if payload else None,
+        "delivery_attempts": attempts,
+        "created": created,
+        "finished": finished,
+        "last_error": last_error,
+    }
+
+
+def sign(body: bytes, timestamp: str) -> str:
+    return 'sha256=' + hmac.new(SECRET.encode('utf-8'), timestamp.encode() + b'.' + body, hashlib.sha256).hexdigest()
+
+
+def deliver(job_id: str, callback_url: str, payload: str, attempts: int) -> None:
+    """Одна попытка доставки, результат записывается в outbox."""
+    body = payload.encode('utf-8')
+    timestamp = str(int(time.time()))
+    headers = {
+        'Content-Type': 'application/json',
+        'X-Webhook-Id': job_id,
+        'X-Webhook-Timestamp': timestamp,
+    }
+    if SECRET:
+        headers['X-Webhook-Signature'] = sign(body, timestamp)
+
+    # адрес проверяется еще раз, DNS мог поменяться с момента приема задания;
+    # редиректы не выполняются, иначе ими можно обойти проверку
+    error = check_url(callback_url)
+    try:
+        if not error:
+            response = SESSION.post(callback_url, data=body, headers=headers, timeout=TIMEOUT,
+                                    allow_redirects=False)
+            if not 200 <= response.status_code < 300:
+                error = f'http {response.status_code}'
+    except Exception as delivery_error:
+        error = str(delivery_error)[:500]
+
+    attempts += 1
+    now = time.time()
+    if not error:
+        state, next_attempt = STATE_DELIVERED, None
+    elif attempts >= MAX_ATTEMPTS:
+        state, next_attempt = STATE_FAILED, None
+        my_log.log_bing_api(f'webhook:deliver: giving up {job_id} {callback_url}: {error}')
+    else:
+        # растущая пауза со случайным разбросом, чтобы повторы к одному клиенту не шли пачкой
+        delay = min(BACKOFF_BASE * 2 ** (attempts - 1), BACKOFF_MAX)
+        state, next_attempt = STATE_PENDING, now + delay * random.uniform(0.8, 1.2)
+
+    with LOCK:
+        conn = get_conn()
+        conn.execute('UPDATE outbox SET state = ?, attempts = ?, next_attempt = ?, finished = ?, last_error = ?'
+                     ' WHERE id = ?',
+                     (state, attempts, next_attempt, now if state != STATE_PENDING else None, error, job_id))
+        conn.commit()
+
+
+@async_run
+def sender_loop() -> None:
+    """Забирает из outbox результаты которым пора отправляться и раздает их пулу."""
+    in_progress = set()
+    while 1:
+        try:
+            WAKEUP.clear()
+            now = time.time()
+            with LOCK:
+                rows = get_conn().execute(
+                    'SELECT id, callback_url, payload, attempts FROM outbox'
+                    ' WHERE state = ? AND next_attempt <= ? ORDER BY next_attempt LIMIT 100',
+                    (STATE_PENDING, now)).fetchall()
+                next_row = get_conn().execute(
+                    'SELECT MIN(next_attempt) FROM outbox WHERE state = ? AND next_attempt > ?',
+                    (STATE_PENDING, now)).fetchone()
+
+            for job_id, callback_url, payload, attempts in rows:
+                if job_id in in_progress:
+                    continue
+                in_progress.add(job_id)
+                future = POOL.submit(deliver, job_id, callback_url, payload, attempts)
+                future.add_done_callback(lambda _, x=job_id: (in_progress.discard(x), WAKEUP.set()))
+
+            timeout = 60.0
+            if next_row and next_row[0]:
+                timeout = min(timeout, max(0.1, next_row[0] - now))
+            WAKEUP.wait(timeout)
+        except Exception as error:
+            my_log.log_bing_api(f'webhook:sender_loop: {error}')
+            time.sleep(5)
+
+
+def start_sender() -> None:
+    global SENDER_STARTED
+    with LOCK:
+        if SENDER_STARTED:
+            return
+        SENDER_STARTED = True
+    sender_loop()
+
+
+def resume_unfinished(run_job: Callable[[str, Dict[str, Any]], None]) -> int:
+    """
+    Вызывается при старте. Задания которые рисовались до перезапуска запускаются снова
+    через run_job(job_id, request), недоставленные результаты отправит sender_loop.
+    Возвращает сколько заданий запущено.
+    """
+    try:
+        now = time.time()
+        with LOCK:
+            conn = get_conn()
+            conn.execute('DELETE FROM outbox WHERE state IN (?, ?) AND finished < ?',
+                         (STATE_DELIVERED, STATE_FAILED, now - KEEP_FINISHED))
+            conn.commit()
+            rows: List[Any] = conn.execute('SELECT id, request FROM outbox WHERE state = ?',
+                                           (STATE_RUNNING,)).fetchall()
+        for job_id, request in rows:
+            run_job(job_id, json.loads(request))
+        if rows:
+            my_log.log_bing_api(f'webhook:resume_unfinished: restarted {len(rows)} jobs')
+        start_sender()
+        return len(rows)
+    except Exception as error:
+        my_log.log_bing_api(f'webhook:resume_unfinished: {error}')
+        return 0
+
+
+if __name__ == '__main__':
+    pass